@@ -1,16 +1,41 @@
-from flask import Flask
+import atexit
+from flask import Flask, g, request
 from flask_cors import CORS
 from config import Config
 from models import db
+from models.migrations import run_migrations
+from models.storage import StorageMaintenance, apply_storage_profile, engine_options, is_sqlite_file
 from services.ai_service import AIService
+from services.agnostic.entity.user_service import UserService
 from services.agnostic.task.messaging_capability import MessagingCapability
+from services.agnostic.task.conversation_summarizer import ConversationSummarizer
+from services.agnostic.task.message_persister import MessagePersister
+from services.agnostic.utility.retrieval_index import retrieval_index
+from services.agnostic.utility.id_allocator import message_id_allocator
+from services.agnostic.utility.identity_cache import identity_cache
+from services.agnostic.utility.segment_store import archive_store
+from services.agnostic.utility.message_codec import message_codec
+from services.agnostic.utility.event_log import event_log
+from services.agnostic.utility.login_limiter import login_limiter
+from services.agnostic.utility.session_tokens import session_tokens
+from services.agnostic.utility.query_stats import query_stats
+from utils.password_hasher import password_hasher
 from services.non_agnostic.api_controller import APIController
-from controllers.chat_controller import chat_bp, socketio
+from controllers.chat_controller import chat_bp, socketio, chat_manager
 
-def create_app(config_class=Config):
-    """Factory para crear la aplicación Flask"""
+def create_app(config_class=Config, ai_service=None):
+    """
+    Factory para crear la aplicación Flask
+
+    Args:
+        config_class: Clase de configuración
+        ai_service: AIService ya cargado (p. ej. por el lanzador pre-fork).
+            Si es None se crea y se carga uno nuevo.
+    """
     app = Flask(__name__)
     app.config.from_object(config_class)
+    # Pool y timeouts del engine (perfil de SQLite)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(config_class))
     
     # Inicializar extensiones
     db.init_app(app)
@@ -18,26 +43,139 @@ def create_app(config_class=Config):
     
     # Crear base de datos
     with app.app_context():
+        # WAL y PRAGMAs en cada conexión nueva (antes de la primera)
+        apply_storage_profile(db.engine, config_class)
+        
         # Eliminar todas las tablas existentes
         # db.drop_all()
         # print("Base de datos eliminada")
         
         # Crear todas las tablas nuevamente
         db.create_all()
+        run_migrations()
+        sqlite_engine = db.engine.dialect.name == 'sqlite'
+        if getattr(config_class, 'QUERY_STATS_ENABLED', True):
+            # Contar consultas por petición (después de las migraciones)
+            query_stats.install(db.engine)
         print("Base de datos inicializada con nuevo esquema")
     
     # Inicializar servicios
     # Capa Agnóstica
-    ai_service = AIService(model_name=Config.AI_MODEL_NAME)
-    print("Cargando modelo de IA...")
-    ai_service.load_model()
+    if ai_service is None:
+        ai_service = AIService(model_name=Config.AI_MODEL_NAME)
+        print("Cargando modelo de IA...")
+        ai_service.load_model()
+    
+    if getattr(config_class, 'AI_ADAPTERS_ENABLED', False) and ai_service.is_ready() and ai_service.adapters is None:
+        ai_service.enable_adapters(
+            config_class.AI_ADAPTERS_DIR,
+            memory_budget_mb=config_class.AI_ADAPTERS_MEMORY_MB,
+            target_modules=config_class.AI_ADAPTERS_TARGET_MODULES
+        )
+    
+    if getattr(config_class, 'AI_COMPILE_MODE', False) and ai_service.is_ready():
+        if ai_service.enable_compiled_mode(
+            shape_buckets=config_class.AI_COMPILE_BUCKETS,
+            new_tokens=config_class.AI_COMPILE_NEW_TOKENS,
+            backend=config_class.AI_COMPILE_BACKEND
+        ) and config_class.AI_COMPILE_WARMUP:
+            print("Compilando buckets de forma fija (warm-up)...")
+            ai_service.warm_up()
     
-    # Task Service (combina servicios de entidad y utilidad)
-    messaging_capability = MessagingCapability(ai_service)
+    retrieval_index.max_users = getattr(config_class, 'RETRIEVAL_MAX_USERS', retrieval_index.max_users)
+    retrieval_index.ttl_seconds = getattr(config_class, 'RETRIEVAL_INDEX_TTL', retrieval_index.ttl_seconds)
+    identity_cache.max_entries = getattr(config_class, 'IDENTITY_CACHE_MAX_ENTRIES', identity_cache.max_entries)
+    identity_cache.ttl_seconds = getattr(config_class, 'IDENTITY_CACHE_TTL', identity_cache.ttl_seconds)
+    archive_store.directory = getattr(config_class, 'ARCHIVE_DIR', archive_store.directory)
+    archive_store.max_segment_bytes = getattr(config_class, 'ARCHIVE_SEGMENT_MAX_MB', 64) * 1024 * 1024
+    # Los cuerpos en message_blobs se decodifican con una función de SQLite
+    message_codec.enabled = getattr(config_class, 'MESSAGE_CODEC_ENABLED', False) and sqlite_engine
+    message_codec.min_bytes = getattr(config_class, 'MESSAGE_CODEC_MIN_BYTES', message_codec.min_bytes)
+    message_codec.level = getattr(config_class, 'MESSAGE_CODEC_LEVEL', message_codec.level)
+    event_log.configure(
+        getattr(config_class, 'EVENT_LOG_DIR', event_log.directory),
+        getattr(config_class, 'EVENT_LOG_SEGMENT_MAX_MB', 64) * 1024 * 1024,
+        getattr(config_class, 'EVENT_LOG_ENABLED', False),
+        getattr(config_class, 'EVENT_LOG_FSYNC', False)
+    )
+    password_hasher.configure(
+        getattr(config_class, 'PASSWORD_HASH_METHOD', password_hasher.method),
+        getattr(config_class, 'PASSWORD_SALT_LENGTH', password_hasher.salt_length),
+        getattr(config_class, 'PASSWORD_HASH_WORKERS', password_hasher.workers),
+        getattr(config_class, 'PASSWORD_HASH_QUEUE', password_hasher.max_queue)
+    )
+    login_limiter.max_per_ip = getattr(config_class, 'LOGIN_MAX_CONCURRENT_PER_IP', login_limiter.max_per_ip)
+    login_limiter.max_per_username = getattr(config_class, 'LOGIN_MAX_CONCURRENT_PER_USERNAME', login_limiter.max_per_username)
+    query_stats.enabled = getattr(config_class, 'QUERY_STATS_ENABLED', True)
+    query_stats.warn_queries = getattr(config_class, 'QUERY_WARN_COUNT', query_stats.warn_queries)
+    query_stats.warn_ms = getattr(config_class, 'QUERY_WARN_MS', query_stats.warn_ms)
+    query_stats.max_worst = getattr(config_class, 'QUERY_WORST_MAX', query_stats.max_worst)
+    session_tokens.configure(
+        getattr(config_class, 'JWT_SECRET_KEY', config_class.SECRET_KEY),
+        getattr(config_class, 'JWT_ACCESS_TOKEN_EXPIRES', session_tokens.expires_seconds),
+        getattr(config_class, 'SESSION_TOKEN_CHECK_TTL', session_tokens.check_ttl),
+        getattr(config_class, 'SESSION_TOKEN_REQUIRED', session_tokens.required)
+    )
+    session_tokens.loader = UserService.load_user_identity
+    
+    # Task Services (combinan servicios de entidad y utilidad)
+    summarizer = None
+    if getattr(config_class, 'SUMMARY_ENABLED', False):
+        summarizer = ConversationSummarizer(
+            app.app_context,
+            recent_window=config_class.AI_CONTEXT_RECENT_TURNS,
+            max_sentences=config_class.SUMMARY_MAX_SENTENCES,
+            max_chars=config_class.SUMMARY_MAX_CHARS
+        )
+    message_id_allocator.block_size = getattr(config_class, 'MESSAGE_ID_BLOCK_SIZE', message_id_allocator.block_size)
+    persister = None
+    if getattr(config_class, 'MESSAGE_PERSIST_MODE', 'sync') != 'sync':
+        persister = MessagePersister(
+            app.app_context,
+            mode=config_class.MESSAGE_PERSIST_MODE,
+            interval_ms=config_class.MESSAGE_PERSIST_INTERVAL_MS,
+            batch_size=config_class.MESSAGE_PERSIST_BATCH_SIZE,
+            queue_size=config_class.MESSAGE_PERSIST_QUEUE_SIZE
+        )
+        # Escribir lo pendiente al terminar el proceso
+        atexit.register(persister.stop)
+        app.extensions['message_persister'] = persister
+    maintenance = None
+    if getattr(config_class, 'STORAGE_MAINTENANCE_INTERVAL', 0) > 0 and is_sqlite_file(config_class.SQLALCHEMY_DATABASE_URI):
+        # ANALYZE / incremental_vacuum / checkpoint del WAL periódicos
+        maintenance = StorageMaintenance(
+            app.app_context,
+            interval_seconds=config_class.STORAGE_MAINTENANCE_INTERVAL,
+            vacuum_pages=config_class.STORAGE_VACUUM_PAGES
+        )
+        # El hilo se arranca con la primera petición: en modo prefork eso ocurre
+        # ya dentro de cada worker, después de fork()
+        atexit.register(maintenance.stop)
+        app.extensions['storage_maintenance'] = maintenance
+    messaging_capability = MessagingCapability(ai_service, summarizer=summarizer, persister=persister)
+    # Los eventos de WebSocket usan el mismo modelo en lugar de cargar otra copia
+    chat_manager.attach_messaging_capability(messaging_capability)
     
     # Capa No Agnóstica (Transporte)
     api_controller = APIController(messaging_capability)
     
+    # Consultas por petición, acumuladas por ruta
+    @app.before_request
+    def start_query_scope():
+        rule = request.url_rule.rule if request.url_rule else '<sin ruta>'
+        g.query_scope = query_stats.begin(f"{request.method} {rule}")
+
+    if maintenance is not None:
+        @app.before_request
+        def ensure_storage_maintenance():
+            maintenance.start()
+
+    @app.teardown_request
+    def end_query_scope(exc):
+        scope = g.pop('query_scope', None)
+        if scope is not None:
+            query_stats.end(scope)
+    
     # ========================================
     # REGISTRAR RUTAS (Capa No Agnóstica)
     # ========================================
@@ -53,6 +191,11 @@ def create_app(config_class=Config):
         """Autenticar usuario"""
         return api_controller.login_user()
 
+    @app.route('/api/users/me', methods=['GET'])
+    def current_user():
+        """Usuario del token de sesión"""
+        return api_controller.get_current_user()
+
     # =============================
     # Rutas para servir HTML
     # =============================
@@ -75,6 +218,16 @@ def create_app(config_class=Config):
         """Obtener conversaciones de un usuario"""
         return api_controller.get_user_conversations(user_id)
     
+    @app.route('/api/users/<int:user_id>/search', methods=['GET'])
+    def search_messages(user_id):
+        """Buscar en los mensajes de un usuario"""
+        return api_controller.search_messages(user_id)
+    
+    @app.route('/api/users/<int:user_id>/export', methods=['GET'])
+    def export_conversations(user_id):
+        """Exportar los mensajes de un usuario (NDJSON o Parquet)"""
+        return api_controller.export_conversations(user_id)
+    
     # Rutas de conversaciones
     @app.route('/api/conversations', methods=['POST'])
     def create_conversation():
@@ -100,11 +253,37 @@ def create_app(config_class=Config):
             'status': 'ok',
             'ai_service_ready': ai_service.is_ready()
         }
+    
+    @app.route('/api/metrics', methods=['GET'])
+    def metrics():
+        """Métricas de rendimiento del servicio"""
+        return {
+            'ai': ai_service.latency_report(),
+            'persistence': persister.stats() if persister else {'mode': 'sync'},
+            'identity_cache': identity_cache.stats(),
+            'queries': query_stats.stats(),
+            'events': event_log.stats(),
+            'auth': {
+                'password_hasher': password_hasher.stats(),
+                'login_limiter': login_limiter.stats(),
+                'session_tokens': session_tokens.stats()
+            },
+            'storage': {
+                'pool': db.engine.pool.status(),
+                'message_codec': message_codec.stats(),
+                'last_maintenance': maintenance.last_result if maintenance else None
+            }
+        }
 
     # Registrar blueprint de WebSocket / chat (controlador no-agnóstico)
     app.register_blueprint(chat_bp, url_prefix='/chat')
     # Inicializar SocketIO con la app
     socketio.init_app(app, cors_allowed_origins="*")
+    # El servidor de eventlet atiende todo desde un hub sin monkey patch: el
+    # hashing de contraseñas y la espera de escrituras no deben bloquearlo
+    password_hasher.green = socketio.async_mode == 'eventlet'
+    if persister is not None:
+        persister.green = password_hasher.green
     
     return app
 
@@ -137,10 +316,13 @@ if __name__ == '__main__':
     print("   POST   /api/users/register")
     print("   POST   /api/users/login")
     print("   GET    /api/users/<user_id>/conversations")
+    print("   GET    /api/users/<user_id>/search?q=")
+    print("   GET    /api/users/<user_id>/export")
     print("   POST   /api/conversations")
     print("   GET    /api/conversations/<session_id>")
     print("   POST   /api/messages")
     print("   GET    /api/health")
+    print("   GET    /api/metrics")
     print("\n" + "="*60 + "\n")
     
     # Usar socketio.run para soportar WebSockets correctamente
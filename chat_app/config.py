@@ -7,11 +7,127 @@ class Config:
     SQLALCHEMY_DATABASE_URI = 'sqlite:///chat_app.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Perfil de SQLite (models/storage.py)
+    SQLITE_WAL = True  # Lectores y escritor concurrentes
+    SQLITE_SYNCHRONOUS = "NORMAL"  # Con WAL: fsync solo en checkpoints ("FULL" = fsync por commit)
+    SQLITE_CACHE_SIZE_KB = 65536  # Caché de páginas por conexión
+    SQLITE_MMAP_SIZE_MB = 256
+    SQLITE_BUSY_TIMEOUT_MS = 5000  # Espera por el lock de escritura antes de fallar
+    DB_POOL_SIZE = 10  # Conexiones persistentes (green threads con contexto de aplicación)
+    DB_POOL_MAX_OVERFLOW = 20
+    DB_POOL_TIMEOUT = 30
+    STORAGE_MAINTENANCE_INTERVAL = 3600  # Segundos entre pasadas de mantenimiento (0 = desactivado)
+    STORAGE_VACUUM_PAGES = 1000  # Páginas libres devueltas por pasada
+    
     # Configuración del modelo de IA
     AI_MODEL_NAME = "microsoft/DialoGPT-medium"  # Modelo más ligero para desarrollo
     AI_MAX_LENGTH = 1000  # Longitud máxima de la respuesta
     AI_TEMPERATURE = 0.7  # Temperatura para la generación de texto (0-1)
     
+    # Contexto enviado al modelo: resumen de turnos antiguos + turnos recientes
+    AI_CONTEXT_RECENT_TURNS = 6
+    AI_MAX_CONTEXT_TOKENS = 512
+    SUMMARY_ENABLED = False  # Resumir los turnos antiguos en segundo plano (opcional)
+    SUMMARY_MAX_SENTENCES = 5
+    SUMMARY_MAX_CHARS = 500
+    # Fragmentos de otras sesiones del usuario recuperados con BM25 (0 = desactivado, opcional)
+    RETRIEVAL_TOP_K = 0
+    RETRIEVAL_SNIPPET_CHARS = 200
+    RETRIEVAL_MAX_USERS = 1000  # Usuarios con índice residente en memoria
+    RETRIEVAL_INDEX_TTL = 300  # Segundos hasta recargar el índice de un usuario desde la BD
+    
+    # Adaptadores LoRA por tenant sobre el modelo base
+    AI_ADAPTERS_ENABLED = False  # Envolver las capas objetivo con LoRA al cargar el modelo (opcional)
+    AI_ADAPTERS_DIR = "adapters"  # <dir>/<tenant_id>/adapter.pt
+    AI_ADAPTERS_MEMORY_MB = 256  # Presupuesto del LRU de adaptadores residentes
+    AI_ADAPTERS_TARGET_MODULES = ("c_attn",)
+    
+    # Modo compilado (torch.compile) de la generación, opcional
+    AI_COMPILE_MODE = False
+    AI_COMPILE_BACKEND = "inductor"
+    AI_COMPILE_BUCKETS = (32, 64, 128, 256)  # Longitudes de prompt compiladas
+    AI_COMPILE_NEW_TOKENS = 128  # Tokens generados por respuesta en modo compilado
+    AI_COMPILE_WARMUP = True  # Compilar todos los buckets al arrancar
+    
+    # Caché de usuarios/sesiones del camino caliente (por proceso)
+    IDENTITY_CACHE_MAX_ENTRIES = 10000
+    IDENTITY_CACHE_TTL = 60  # Segundos; acota la desactualización entre workers
+    
+    # Escritura de mensajes agrupada (write-behind)
+    MESSAGE_PERSIST_MODE = "batched"  # "sync" (un commit por mensaje), "batched" o "async"
+    MESSAGE_PERSIST_INTERVAL_MS = 20  # Espera máxima para juntar un grupo
+    MESSAGE_PERSIST_BATCH_SIZE = 200
+    MESSAGE_PERSIST_QUEUE_SIZE = 10000
+    MESSAGE_ID_BLOCK_SIZE = 100  # IDs de mensaje reservados por viaje a la BD
+    
+    # Paginación del historial (GET /api/conversations/<id>?limit=...)
+    HISTORY_PAGE_SIZE = 50
+    HISTORY_MAX_PAGE_SIZE = 200
+    
+    # Búsqueda de texto completo (GET /api/users/<id>/search?q=...)
+    SEARCH_PAGE_SIZE = 20
+    SEARCH_MAX_PAGE_SIZE = 100
+    SEARCH_SNIPPET_TOKENS = 12  # Palabras del fragmento alrededor de los términos
+    
+    # Archivo de sesiones inactivas en segmentos comprimidos (manage.py archive)
+    ARCHIVE_DIR = "archive"
+    ARCHIVE_INACTIVE_DAYS = 90
+    ARCHIVE_SEGMENT_MAX_MB = 64  # Tamaño a partir del cual se abre un segmento nuevo
+    ARCHIVE_COMPRESSION_LEVEL = 6  # zlib 1-9
+    
+    # Exportación masiva (manage.py export y GET /api/users/<id>/export)
+    EXPORT_BATCH_SIZE = 1000  # Mensajes por bloque leído (y por row group en Parquet)
+    EXPORT_CHECKPOINT_ROWS = 50000  # Filas entre checkpoints (NDJSON)
+    EXPORT_ROWS_PER_FILE = 1000000  # Filas por parte (Parquet)
+    
+    # Respuestas JSON en streaming (historial completo, exportación NDJSON)
+    STREAM_CHUNK_BYTES = 64 * 1024  # Tamaño aproximado de cada fragmento enviado
+    STREAM_GZIP = True  # Comprimir con gzip si el cliente envía Accept-Encoding: gzip
+    STREAM_GZIP_LEVEL = 6  # zlib 1-9
+    
+    # Almacenamiento compacto de mensajes (message_blobs; manage.py compact-messages)
+    MESSAGE_CODEC_ENABLED = False  # Codificar los mensajes nuevos (solo SQLite)
+    MESSAGE_CODEC_MIN_BYTES = 256  # Textos más cortos quedan en la fila (la referencia ocupa casi lo mismo)
+    MESSAGE_CODEC_LEVEL = 6  # zlib 1-9
+    
+    # Registro local de eventos (mensajes guardados y cambios de sesión) para consumidores
+    # que trabajan fuera del camino de la petición (EventConsumer, manage.py events)
+    EVENT_LOG_ENABLED = False
+    EVENT_LOG_DIR = "events"
+    EVENT_LOG_SEGMENT_MAX_MB = 64  # Tamaño a partir del cual se abre un segmento nuevo
+    EVENT_LOG_FSYNC = False  # True = fsync por grupo de eventos (sin él, un corte de energía puede perder los últimos)
+    
+    # Contraseñas: costo del hash (formato de werkzeug) y pool de hashing
+    # Al cambiar PASSWORD_HASH_METHOD los hashes existentes se actualizan en el siguiente login
+    PASSWORD_HASH_METHOD = "scrypt:32768:8:1"  # o p. ej. "pbkdf2:sha256:600000"
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_HASH_WORKERS = 4  # Hashes simultáneos (hilos del sistema)
+    PASSWORD_HASH_QUEUE = 64  # Hashes en espera; con la cola llena se responde 503
+    LOGIN_MAX_CONCURRENT_PER_IP = 4  # Logins simultáneos por IP (429 al superarlo; 0 = sin límite)
+    LOGIN_MAX_CONCURRENT_PER_USERNAME = 2  # Logins simultáneos por nombre de usuario
+    
+    # Alta masiva de usuarios (manage.py import-users)
+    USER_IMPORT_BATCH_SIZE = 1000  # Filas por bloque (consulta de duplicados y transacción)
+    USER_IMPORT_HASH_WORKERS = None  # Procesos para el hash de contraseñas (None = uno por CPU)
+    
+    # Respuestas condicionales (ETag / If-None-Match) del historial y la lista de conversaciones
+    HTTP_CACHE_CONTROL = "private, no-cache"  # Datos por usuario; revalidar siempre con el ETag
+    
+    # Corpus de fine-tuning generado a partir de las conversaciones (manage.py build-corpus)
+    CORPUS_DIR = "corpus"
+    CORPUS_CHUNK_SIZE = 200  # Sesiones leídas por consulta
+    
+    # Servidor pre-fork (varios workers compartiendo el modelo)
+    PREFORK_WORKERS = 2
+    PREFORK_SHARED_MEMORY = True  # Mover pesos a memoria compartida antes del fork
+    PREFORK_REPORT_DELAY = 10  # Segundos hasta el primer reporte de memoria
+    
+    # Consultas SQL por petición / evento del socket (GET /api/metrics -> queries)
+    QUERY_STATS_ENABLED = True
+    QUERY_WARN_COUNT = 25  # Consultas de una petición a partir de las cuales se registra una advertencia
+    QUERY_WARN_MS = 500  # Tiempo en consultas de una petición a partir del cual se advierte
+    QUERY_WORST_MAX = 10  # Peores peticiones recordadas en las métricas
+    
     # Configuración de la API
     API_VERSION = "v1"
     API_PREFIX = f"/api/{API_VERSION}"
@@ -19,6 +135,9 @@ class Config:
     # Configuración de seguridad
     JWT_SECRET_KEY = "your-jwt-secret-key"
     JWT_ACCESS_TOKEN_EXPIRES = 3600  # 1 hora
+    # Token de sesión firmado que emite el login (socket y REST lo verifican sin consultar la BD)
+    SESSION_TOKEN_REQUIRED = False  # True = rechazar peticiones con solo user_id (401)
+    SESSION_TOKEN_CHECK_TTL = 5  # Segundos que un worker reutiliza la versión de tokens de un usuario
     
     # Configuración de logs
     LOG_LEVEL = "INFO"
@@ -3,6 +3,8 @@ from flask_socketio import SocketIO, emit, join_room, leave_room
 from core.chat_manager import ChatManager
 from core.chat_room_manager import ChatRoomManager
 from services.non_agnostic.response_handler import ResponseHandler
+from services.agnostic.utility.session_tokens import TOKEN_ERROR_MESSAGES, session_tokens
+from services.agnostic.utility.query_stats import query_stats
 from utils.logger import logger
 import time
 
@@ -11,30 +13,63 @@ socketio = SocketIO(cors_allowed_origins="*")
 chat_manager = ChatManager()
 room_manager = ChatRoomManager()
 
+# Token de sesión recibido al conectar, por socket (request.sid)
+_socket_tokens = {}
+
+
+def _resolve_socket_user(data):
+    """
+    Resuelve el usuario de un evento del socket sin consultar la BD
+
+    Usa el token del evento o, si no trae, el recibido al conectar. Sin
+    token (y si no es obligatorio) se usa data['user_id'] como antes.
+
+    Returns:
+        Tupla (user_id, UserRecord o None), o None si el token se rechazó
+        (el error ya se emitió al cliente)
+    """
+    token = data.get('token') or _socket_tokens.get(request.sid)
+    identity, error_code = session_tokens.authorize(token, data.get('user_id'))
+    if error_code:
+        emit('error', {'message': TOKEN_ERROR_MESSAGES[error_code], 'code': error_code})
+        return None
+    return (identity.id if identity else data.get('user_id')), identity
+
 # ===================================
 # WebSocket Events
 # ===================================
 
 @socketio.on('connect')
-def handle_connect():
+def handle_connect(auth=None):
     """
     Maneja la conexión de un cliente WebSocket
+    
+    El cliente puede enviar su token de sesión al conectar (auth={"token": ...});
+    los eventos siguientes lo usan sin tener que repetirlo.
     """
+    token = auth.get('token') if isinstance(auth, dict) else None
+    if token:
+        _socket_tokens[request.sid] = token
     logger.info(f"Nuevo cliente conectado: {request.sid}")
 
 @socketio.on('join')
+@query_stats.tracked('socket join')
 def handle_join(data):
     """
     Usuario se une a una sala de chat
     
     Datos esperados:
     {
-        "user_id": int,
-        "session_id": int
+        "user_id": int,        (opcional con token)
+        "session_id": int,
+        "token": str           (opcional si se envió al conectar)
     }
     """
     try:
-        user_id = data.get('user_id')
+        resolved = _resolve_socket_user(data)
+        if resolved is None:
+            return
+        user_id = resolved[0]
         session_id = data.get('session_id')
         
         if not user_id or not session_id:
@@ -61,6 +96,7 @@ def handle_join(data):
         emit('error', {'message': 'Error interno del servidor'})
 
 @socketio.on('leave')
+@query_stats.tracked('socket leave')
 def handle_leave(data):
     """
     Usuario sale de una sala de chat
@@ -86,6 +122,7 @@ def handle_leave(data):
         logger.error(f"Error en leave: {str(e)}", exc_info=True)
 
 @socketio.on('typing')
+@query_stats.tracked('socket typing')
 def handle_typing(data):
     """
     Usuario está escribiendo
@@ -110,20 +147,28 @@ def handle_typing(data):
         logger.error(f"Error en typing: {str(e)}", exc_info=True)
 
 @socketio.on('message')
+@query_stats.tracked('socket message')
 def handle_message(data):
     """
     Nuevo mensaje de chat
+    
+    Con token de sesión (en el evento o al conectar) el usuario se toma de él
+    y el procesamiento no vuelve a consultarlo.
     """
     try:
+        resolved = _resolve_socket_user(data)
+        if resolved is None:
+            return
+        user_id, identity = resolved
+
         # Validar datos
-        required_fields = ['user_id', 'session_id', 'content']
-        if not all(field in data for field in required_fields):
+        required_fields = ['session_id', 'content']
+        if user_id is None or not all(field in data for field in required_fields):
             emit('error', {
                 'message': 'Datos incompletos'
             })
             return
 
-        user_id = data['user_id']
         session_id = data['session_id']
         content = data['content']
         display_name = data.get('display_name') or f'user_{user_id}'
@@ -147,7 +192,7 @@ def handle_message(data):
         app = current_app._get_current_object()
 
         # Procesar la respuesta del bot en background para no bloquear el socket
-        def process_and_emit(app, u_id, s_id, msg_content, disp_name):
+        def process_and_emit(app, u_id, s_id, msg_content, disp_name, verified_user):
             try:
                 logger.info(f"Background: procesando mensaje para Session ID: {s_id}")
                 room_local = f"chat_{s_id}"
@@ -158,7 +203,8 @@ def handle_message(data):
                         result = chat_manager.messaging_capability.process_user_message(
                             user_id=u_id,
                             session_id=s_id,
-                            message_content=msg_content
+                            message_content=msg_content,
+                            identity=verified_user
                         )
                         
                         if result and hasattr(result, 'data'):
@@ -190,6 +236,9 @@ def handle_message(data):
                                 'timestamp': int(time.time()),
                                 'session_id': s_id
                             }
+                            # El ID se asigna antes del commit (escritura agrupada)
+                            if isinstance(data_obj, dict) and isinstance(data_obj.get('bot_message'), dict):
+                                bot_msg['id'] = data_obj['bot_message'].get('id')
 
                             socketio.emit('new_message', bot_msg, room=room_local)
                             logger.info(f"Background: respuesta del bot emitida para Session ID: {s_id}")
@@ -217,7 +266,9 @@ def handle_message(data):
                 # Siempre indicar que el bot terminó de escribir
                 socketio.emit('bot_typing', {'status': False}, room=room_local)
 
-        socketio.start_background_task(process_and_emit, app, user_id, session_id, content, display_name)
+        socketio.start_background_task(
+            process_and_emit, app, user_id, session_id, content, display_name, identity
+        )
 
     except Exception as e:
         logger.error(f"Error procesando mensaje: {str(e)}", exc_info=True)
@@ -228,6 +279,7 @@ def handle_disconnect():
     """
     Cliente WebSocket desconectado
     """
+    _socket_tokens.pop(request.sid, None)
     logger.info(f"Cliente desconectado: {request.sid}")
 
 # ===================================
@@ -12,6 +12,16 @@ class ChatManager:
         self.messaging_capability = MessagingCapability(self.ai_service)
         logger.info("ChatManager inicializado con servicios")
 
+    def attach_messaging_capability(self, messaging_capability: MessagingCapability):
+        """
+        Reutiliza la capacidad de mensajería (y su modelo ya cargado) creada por la app
+
+        Args:
+            messaging_capability: Instancia compartida con las rutas REST
+        """
+        self.messaging_capability = messaging_capability
+        self.ai_service = messaging_capability.ai_service
+
     def process_message(self, data: dict) -> dict:
         """
         Procesa mensajes entrantes del chat
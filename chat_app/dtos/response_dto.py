@@ -23,7 +23,8 @@ class ResponseDTO:
                     response["data"] = self.data
                 else:
                     response["data"] = self.data.to_dict() if hasattr(self.data, 'to_dict') else self.data
-            if self.message is not None:
+            # El mensaje solo puede incluirse cuando data es un objeto (no una lista)
+            if self.message is not None and isinstance(response.get("data", {}), dict):
                 if "data" not in response:
                     response["data"] = {}
                 response["data"]["message"] = self.message
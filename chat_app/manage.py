@@ -0,0 +1,375 @@
+"""
+Comandos de mantenimiento de la aplicación
+
+Se ejecutan sin cargar el modelo de IA, solo con la configuración y la BD.
+
+Uso:
+    python manage.py migrate
+    python manage.py maintenance [--vacuum-pages 1000] [--analyze]
+    python manage.py vacuum
+    python manage.py rebuild-search
+    python manage.py archive [--days 90] [--max-sessions N] [--compact]
+    python manage.py export --format ndjson|parquet --output PATH [--user-id N]
+                            [--since AAAA-MM-DD] [--until AAAA-MM-DD] [--resume]
+    python manage.py build-corpus [--output corpus] [--chunk-size 200]
+    python manage.py import-users --input usuarios.csv [--format csv|ndjson] [--report resultado.ndjson]
+    python manage.py set-tenant --user-id N [--tenant ID]
+    python manage.py compact-messages [--batch-size 1000] [--report-only]
+    python manage.py events [--consumer NOMBRE] [--from OFFSET] [--limit 1000]
+    python manage.py events-status [--prune]
+"""
+import argparse
+import sys
+from datetime import datetime
+
+from flask import Flask
+
+from config import Config
+from models import db
+from models.migrations import MIGRATIONS, current_version, run_migrations
+from models.storage import apply_storage_profile, database_size, engine_options, full_vacuum, run_maintenance
+from services.agnostic.utility.event_log import event_log
+from services.agnostic.utility.message_codec import message_codec
+from services.agnostic.utility.segment_store import archive_store
+from utils.logger import logger
+from utils.password_hasher import password_hasher
+
+
+def create_maintenance_app(config_class=Config) -> Flask:
+    """Aplicación mínima con acceso a la BD (sin modelo ni rutas)"""
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(config_class))
+    db.init_app(app)
+    with app.app_context():
+        apply_storage_profile(db.engine, config_class)
+        db.create_all()
+        run_migrations()
+    archive_store.directory = config_class.ARCHIVE_DIR
+    archive_store.max_segment_bytes = config_class.ARCHIVE_SEGMENT_MAX_MB * 1024 * 1024
+    message_codec.min_bytes = config_class.MESSAGE_CODEC_MIN_BYTES
+    message_codec.level = config_class.MESSAGE_CODEC_LEVEL
+    event_log.configure(
+        config_class.EVENT_LOG_DIR, config_class.EVENT_LOG_SEGMENT_MAX_MB * 1024 * 1024,
+        config_class.EVENT_LOG_ENABLED, config_class.EVENT_LOG_FSYNC
+    )
+    password_hasher.configure(
+        config_class.PASSWORD_HASH_METHOD, config_class.PASSWORD_SALT_LENGTH,
+        config_class.PASSWORD_HASH_WORKERS, config_class.PASSWORD_HASH_QUEUE
+    )
+    return app
+
+
+def migrate(app, args) -> int:
+    """Informa la versión del esquema (las migraciones pendientes ya se aplicaron al crear la app)"""
+    with app.app_context(), db.engine.connect() as connection:
+        version = current_version(connection)
+    logger.info(f"Esquema en la versión {version} de {MIGRATIONS[-1][0]}")
+    return 0
+
+
+def maintenance(app, args) -> int:
+    """Pasada de mantenimiento: estadísticas, incremental_vacuum y checkpoint del WAL"""
+    with app.app_context():
+        result = run_maintenance(args.vacuum_pages, analyze=True if args.analyze else None)
+    logger.info(
+        f"Mantenimiento: {'ANALYZE' if result['analyzed'] else 'PRAGMA optimize'}, "
+        f"páginas libres {result['freelist_before']} -> {result['freelist_after']}, "
+        f"cuerpos sin uso eliminados {result['pruned_blobs']}, checkpoint {result['wal_checkpoint']}"
+    )
+    return 0
+
+
+def vacuum(app, args) -> int:
+    """VACUUM completo (necesario una vez para activar auto_vacuum en bases existentes)"""
+    with app.app_context():
+        mode = full_vacuum()
+    logger.info(f"VACUUM completado (auto_vacuum = {mode})")
+    return 0
+
+
+def rebuild_search(app, args) -> int:
+    """Vuelve a indexar todos los mensajes en el índice de búsqueda de texto completo"""
+    from services.agnostic.entity.search_service import SearchService
+
+    with app.app_context():
+        indexed = SearchService.rebuild_index()
+    if indexed < 0:
+        logger.error("No se pudo reconstruir el índice de búsqueda")
+        return 1
+    logger.info(f"Índice de búsqueda reconstruido con {indexed} mensajes")
+    return 0
+
+
+def archive(app, args) -> int:
+    """Mueve las sesiones inactivas a los segmentos comprimidos del archivo"""
+    from services.agnostic.task.session_archiver import SessionArchiver
+
+    archiver = SessionArchiver(
+        inactive_days=args.days,
+        max_sessions=args.max_sessions,
+        compression_level=Config.ARCHIVE_COMPRESSION_LEVEL
+    )
+    with app.app_context():
+        report = archiver.run()
+
+    ratio = report['stored_bytes'] / report['raw_bytes'] if report['raw_bytes'] else None
+    logger.info(
+        f"Sesiones archivadas: {report['sessions']} ({report['messages']} mensajes, {report['failed']} con error); "
+        f"{report['raw_bytes']} bytes -> {report['stored_bytes']} comprimidos"
+        + (f" ({ratio:.0%})" if ratio is not None else "")
+    )
+    logger.info(
+        f"BD: {report['db_bytes_before']} -> {report['db_bytes_after']} bytes "
+        f"(devueltos {report['reclaimed_bytes']}, libres dentro del archivo {report['db_free_bytes']})"
+    )
+    failed = report['failed']
+    if args.compact:
+        from services.agnostic.entity.archive_service import ArchiveService
+
+        with app.app_context():
+            compaction = ArchiveService.compact()
+        logger.info(
+            f"Segmentos: {compaction['bytes_before']} -> {compaction['bytes_after']} bytes "
+            f"(devueltos {compaction['reclaimed_bytes']}; {compaction['records_moved']} registros copiados, "
+            f"{compaction['segments_removed']} segmentos borrados, {compaction['failed']} con error)"
+        )
+        failed += compaction['failed']
+    return 1 if failed else 0
+
+
+def export(app, args) -> int:
+    """Exporta los mensajes con sus sesiones y usuarios a NDJSON o Parquet"""
+    from services.agnostic.task.conversation_exporter import ConversationExporter
+
+    exporter = ConversationExporter(
+        user_id=args.user_id,
+        since=args.since,
+        until=args.until,
+        batch_size=Config.EXPORT_BATCH_SIZE,
+        include_archived=not args.no_archived
+    )
+    with app.app_context():
+        result = exporter.export_to_path(
+            args.format, args.output, resume=args.resume,
+            checkpoint_rows=Config.EXPORT_CHECKPOINT_ROWS,
+            rows_per_file=Config.EXPORT_ROWS_PER_FILE
+        )
+
+    logger.info(
+        f"Exportación {'reanudada' if result['resumed'] else 'completa'}: {result['written']} filas nuevas, "
+        f"{result['rows']} en total en {len(result['files'])} archivo(s) ({len(result['position']['sessions'])} sesiones)"
+    )
+    return 0
+
+
+def build_corpus(app, args) -> int:
+    """Agrega al corpus de fine-tuning los pares nuevos desde la última ejecución"""
+    from services.agnostic.task.corpus_builder import CorpusBuilder
+
+    builder = CorpusBuilder(args.output, chunk_size=args.chunk_size)
+    with app.app_context():
+        result = builder.build()
+
+    logger.info(
+        f"Corpus versión {result['version']}: {result['new_pairs']} pares nuevos, "
+        f"{result['duplicates']} duplicados, {result['total_pairs']} en total "
+        f"({result['sessions']} sesiones con mensajes nuevos)"
+    )
+    return 0
+
+
+def import_users(app, args) -> int:
+    """Alta masiva de usuarios desde un archivo CSV o NDJSON"""
+    import json
+    from services.agnostic.task.user_importer import UserImporter, iter_import_rows
+
+    import_format = args.format or ('ndjson' if args.input.endswith(('.ndjson', '.jsonl')) else 'csv')
+    importer = UserImporter(batch_size=args.batch_size, workers=args.workers)
+    report = open(args.report, 'w', encoding='utf-8') if args.report else None
+    try:
+        with app.app_context(), open(args.input, 'r', encoding='utf-8-sig', newline='') as stream:
+            for result in importer.run(iter_import_rows(stream, import_format)):
+                if report:
+                    report.write(json.dumps(result, ensure_ascii=False) + '\n')
+                elif result['status'] != 'created':
+                    logger.warning(f"Fila {result['row']} ({result['username']}): {result['status']} - {result['error']}")
+                if importer.summary['rows'] % 10000 == 0:
+                    logger.info(f"{importer.summary['rows']} filas procesadas")
+    finally:
+        if report:
+            report.close()
+
+    summary = importer.summary
+    logger.info(
+        f"Importación: {summary['created']} creados, {summary['duplicate']} duplicados, "
+        f"{summary['invalid']} inválidos, {summary['error']} con error de {summary['rows']} filas "
+        f"en {summary['seconds']} s"
+    )
+    return 1 if summary['error'] else 0
+
+
+def set_tenant(app, args) -> int:
+    """Asigna (o quita, sin --tenant) el tenant de un usuario"""
+    from services.agnostic.entity.user_service import UserService
+
+    with app.app_context():
+        if not UserService.set_tenant(args.user_id, args.tenant):
+            logger.error(f"Usuario no encontrado: {args.user_id}")
+            return 1
+    logger.info(f"Usuario {args.user_id}: tenant {args.tenant or '(modelo base)'}")
+    return 0
+
+
+def _log_storage_report(label: str, report: dict, size: dict):
+    logger.info(
+        f"{label}: {report['messages']} mensajes ({report['encoded_messages']} en message_blobs); "
+        f"texto en las filas {report['inline_bytes']} bytes, codificado {report['encoded_bytes']} bytes "
+        f"en {report['blobs']} cuerpos que ocupan {report['blob_bytes']}; "
+        f"BD {size['total_bytes']} bytes ({size['free_bytes']} libres)"
+    )
+
+
+def compact_messages(app, args) -> int:
+    """Pasa a message_blobs los mensajes ya guardados e informa el tamaño antes y después"""
+    from services.agnostic.entity.message_service import MessageService
+
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            logger.error("El almacenamiento compacto solo está disponible con SQLite")
+            return 1
+        _log_storage_report("Antes", MessageService.storage_report(), database_size())
+        if args.report_only:
+            return 0
+
+        position = compacted = 0
+        while True:
+            last_id, count = MessageService.compact_messages(position, args.batch_size)
+            if last_id == position:
+                break
+            position = last_id
+            compacted += count
+        # Devolver al sistema las páginas liberadas (requiere auto_vacuum incremental: manage.py vacuum)
+        run_maintenance(0)
+        logger.info(f"Mensajes compactados: {compacted} (umbral {message_codec.min_bytes} bytes)")
+        _log_storage_report("Después", MessageService.storage_report(), database_size())
+    return 0
+
+
+def events(app, args) -> int:
+    """
+    Escribe eventos del registro en la salida estándar (NDJSON, con su offset)
+
+    Con --consumer se empieza en el checkpoint de ese consumidor y se avanza
+    al terminar, así que un proceso externo puede consumir el registro con
+    `python manage.py events --consumer analitica | ...`; --from 0 lo repite
+    desde el principio.
+    """
+    import json
+
+    offset = args.from_offset
+    if offset is None:
+        offset = event_log.load_checkpoint(args.consumer) if args.consumer else 0
+    batch, next_offset = event_log.read(offset, args.limit)
+    for entry in batch:
+        sys.stdout.write(json.dumps({'offset': entry.offset, **entry.event}, ensure_ascii=False) + '\n')
+    sys.stdout.flush()
+    if args.consumer:
+        event_log.save_checkpoint(args.consumer, next_offset)
+    logger.info(f"{len(batch)} eventos desde {offset}; siguiente offset {next_offset}")
+    return 0
+
+
+def events_status(app, args) -> int:
+    """Tamaño del registro de eventos y retraso de cada consumidor"""
+    stats = event_log.stats()
+    logger.info(
+        f"Registro de eventos en '{event_log.directory}': {stats['segments']} segmentos, "
+        f"offsets {stats['first_offset']} - {stats['end_offset']}"
+    )
+    for name, consumer in stats['consumers'].items():
+        logger.info(f"Consumidor '{name}': offset {consumer['offset']}, retraso {consumer['lag_bytes']} bytes")
+    if args.prune:
+        if not stats['consumers']:
+            logger.warning("Sin consumidores registrados; no se elimina ningún segmento")
+            return 0
+        # Solo los segmentos que ya procesaron todos los consumidores
+        removed = event_log.prune(min(consumer['offset'] for consumer in stats['consumers'].values()))
+        logger.info(f"Segmentos eliminados: {removed}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Comandos de mantenimiento del chat")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('migrate', help="Aplicar migraciones pendientes del esquema").set_defaults(handler=migrate)
+
+    maint = subparsers.add_parser('maintenance', help="Mantenimiento liviano de la base SQLite")
+    maint.add_argument('--vacuum-pages', type=int, default=Config.STORAGE_VACUUM_PAGES)
+    maint.add_argument('--analyze', action='store_true', help="Forzar ANALYZE completo")
+    maint.set_defaults(handler=maintenance)
+
+    subparsers.add_parser('vacuum', help="VACUUM completo de la base SQLite").set_defaults(handler=vacuum)
+
+    subparsers.add_parser(
+        'rebuild-search', help="Reconstruir el índice de búsqueda de mensajes"
+    ).set_defaults(handler=rebuild_search)
+
+    archive_parser = subparsers.add_parser('archive', help="Archivar sesiones inactivas")
+    archive_parser.add_argument('--days', type=int, default=Config.ARCHIVE_INACTIVE_DAYS)
+    archive_parser.add_argument('--max-sessions', type=int, default=None)
+    archive_parser.add_argument('--compact', action='store_true',
+                                help="Reescribir los registros vivos y borrar los segmentos sin referencias")
+    archive_parser.set_defaults(handler=archive)
+
+    export_parser = subparsers.add_parser('export', help="Exportar conversaciones (NDJSON o Parquet)")
+    export_parser.add_argument('--format', choices=('ndjson', 'parquet'), default='ndjson')
+    export_parser.add_argument('--output', required=True, help="Archivo (NDJSON) o directorio (Parquet)")
+    export_parser.add_argument('--user-id', type=int, default=None)
+    export_parser.add_argument('--since', type=datetime.fromisoformat, default=None)
+    export_parser.add_argument('--until', type=datetime.fromisoformat, default=None)
+    export_parser.add_argument('--resume', action='store_true', help="Continuar desde el checkpoint")
+    export_parser.add_argument('--no-archived', action='store_true', help="Omitir las sesiones archivadas")
+    export_parser.set_defaults(handler=export)
+
+    corpus = subparsers.add_parser('build-corpus', help="Actualizar el corpus de fine-tuning")
+    corpus.add_argument('--output', default=Config.CORPUS_DIR)
+    corpus.add_argument('--chunk-size', type=int, default=Config.CORPUS_CHUNK_SIZE)
+    corpus.set_defaults(handler=build_corpus)
+
+    importer = subparsers.add_parser('import-users', help="Alta masiva de usuarios (CSV o NDJSON)")
+    importer.add_argument('--input', required=True)
+    importer.add_argument('--format', choices=('csv', 'ndjson'), default=None, help="Por defecto, según la extensión")
+    importer.add_argument('--report', default=None, help="Archivo NDJSON con el resultado de cada fila")
+    importer.add_argument('--batch-size', type=int, default=Config.USER_IMPORT_BATCH_SIZE)
+    importer.add_argument('--workers', type=int, default=Config.USER_IMPORT_HASH_WORKERS)
+    importer.set_defaults(handler=import_users)
+
+    tenant = subparsers.add_parser('set-tenant', help="Asignar el tenant (adaptador LoRA) de un usuario")
+    tenant.add_argument('--user-id', type=int, required=True)
+    tenant.add_argument('--tenant', default=None, help="Sin valor: modelo base")
+    tenant.set_defaults(handler=set_tenant)
+
+    compact = subparsers.add_parser('compact-messages', help="Comprimir y deduplicar el contenido de los mensajes")
+    compact.add_argument('--batch-size', type=int, default=1000)
+    compact.add_argument('--report-only', action='store_true', help="Solo informar el tamaño actual")
+    compact.set_defaults(handler=compact_messages)
+
+    events_parser = subparsers.add_parser('events', help="Leer el registro de eventos (NDJSON en stdout)")
+    events_parser.add_argument('--consumer', default=None, help="Usar y avanzar el checkpoint de este consumidor")
+    events_parser.add_argument('--from', dest='from_offset', type=int, default=None, help="Offset inicial (0 = repetir todo)")
+    events_parser.add_argument('--limit', type=int, default=1000)
+    events_parser.set_defaults(handler=events)
+
+    status = subparsers.add_parser('events-status', help="Estado del registro de eventos y de sus consumidores")
+    status.add_argument('--prune', action='store_true', help="Eliminar los segmentos ya procesados por todos")
+    status.set_defaults(handler=events_status)
+
+    args = parser.parse_args(argv)
+    app = create_maintenance_app(Config)
+    return args.handler(app, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
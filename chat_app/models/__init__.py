@@ -4,6 +4,11 @@ db = SQLAlchemy()
 
 from .user import User
 from .session import Session
+from .message_blob import MessageBlob
 from .chat_message import ChatMessage
+from .session_summary import SessionSummary
+from .id_sequence import IdSequence
+from .archived_session import ArchivedSession
+from . import message_search  # registra el índice FTS5 de chat_messages
 
-__all__ = ['db', 'User', 'Session', 'ChatMessage']
\ No newline at end of file
+__all__ = ['db', 'User', 'Session', 'MessageBlob', 'ChatMessage', 'SessionSummary', 'IdSequence', 'ArchivedSession']
\ No newline at end of file
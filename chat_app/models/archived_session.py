@@ -0,0 +1,27 @@
+from datetime import datetime
+from models import db
+
+class ArchivedSession(db.Model):
+    """Índice de las sesiones cuyos mensajes están en los segmentos del archivo"""
+    __tablename__ = 'archived_sessions'
+    
+    session_id = db.Column(db.Integer, db.ForeignKey('sessions.id'), primary_key=True)
+    # Ubicación del registro comprimido (SegmentStore)
+    segment = db.Column(db.String(64), nullable=False)
+    offset = db.Column(db.BigInteger, nullable=False)
+    length = db.Column(db.Integer, nullable=False)
+    crc = db.Column(db.BigInteger, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    # Bytes del contenido de los mensajes antes de comprimir
+    raw_bytes = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'session_id': self.session_id,
+            'segment': self.segment,
+            'message_count': self.message_count,
+            'raw_bytes': self.raw_bytes,
+            'stored_bytes': self.length,
+            'archived_at': self.archived_at.isoformat()
+        }
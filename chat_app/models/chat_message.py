@@ -1,22 +1,57 @@
 from datetime import datetime
+from sqlalchemy import case, select
+from sqlalchemy.orm import column_property, deferred
 from models import db
+from models.message_blob import MessageBlob, message_text
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
     
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('sessions.id'), nullable=False)
+    # Posición del mensaje dentro de su sesión (1, 2, 3...), asignada desde Session.last_seq
+    seq = db.Column(db.Integer)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    content = db.Column(db.Text, nullable=False)
+    # Texto guardado en la fila ('' si el cuerpo está en message_blobs); para leer, `content`
+    stored_content = deferred(db.Column('content', db.Text, nullable=False))
+    content_hash = db.Column(db.LargeBinary(32), db.ForeignKey('message_blobs.hash'), nullable=True)
     is_bot = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_chat_messages_session_seq', 'session_id', 'seq', unique=True),
+        # Historial de una sesión en orden cronológico (MessageService.get_messages)
+        db.Index('ix_chat_messages_session_created', 'session_id', 'created_at'),
+        # Mensajes de un usuario (reconstrucción del índice de recuperación)
+        db.Index('ix_chat_messages_user_id', 'user_id'),
+        # Cuerpos aún referenciados (limpieza de message_blobs)
+        db.Index('ix_chat_messages_content_hash', 'content_hash'),
+    )
+    
+    def __init__(self, **kwargs):
+        # Un mensaje agregado con el ORM guarda el texto en la fila, sin codificar
+        if 'content' in kwargs:
+            kwargs.setdefault('stored_content', kwargs['content'])
+        super().__init__(**kwargs)
+    
     def to_dict(self):
         return {
             'id': self.id,
             'session_id': self.session_id,
+            'seq': self.seq,
             'user_id': self.user_id,
             'content': self.content,
             'is_bot': self.is_bot,
             'created_at': self.created_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+
+# Texto del mensaje, decodificado en la misma consulta: ChatMessage.content sirve
+# igual en consultas del ORM, en select() de columnas y en instancias cargadas
+_columns = ChatMessage.__table__.c
+ChatMessage.content = column_property(case(
+    (_columns.content_hash.is_(None), _columns.content),
+    else_=select(message_text(MessageBlob.codec, MessageBlob.data))
+    .where(MessageBlob.hash == _columns.content_hash)
+    .scalar_subquery()
+))
@@ -0,0 +1,9 @@
+from models import db
+
+class IdSequence(db.Model):
+    """Contador de IDs reservados por bloques (ver IdAllocator)"""
+    __tablename__ = 'id_sequences'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    # Primer ID aún no reservado por ningún proceso
+    next_value = db.Column(db.Integer, nullable=False)
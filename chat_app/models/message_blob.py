@@ -0,0 +1,97 @@
+"""
+Cuerpos de mensaje compartidos (almacenamiento compacto)
+
+Los mensajes largos pueden guardarse fuera de chat_messages, en
+`message_blobs`, direccionados por el SHA-256 de su texto: las copias
+idénticas (p. ej. respuestas repetidas del bot) comparten una sola fila, y
+cada cuerpo se guarda comprimido con zlib si así ocupa menos. El mensaje
+queda con `content = ''` y `content_hash` apuntando al cuerpo.
+
+`message_text(codec, data)` decodifica un cuerpo dentro de SQL. Se registra
+como función en cada conexión SQLite del proceso, así que ChatMessage.content,
+la vista del índice de búsqueda y sus triggers siempre ven el texto original
+(una herramienta externa, como la CLI de sqlite3, no la tiene: puede leer
+pero no insertar mensajes). En otros motores el codec no se usa y la
+función compila a NULL.
+"""
+import hashlib
+import sqlite3
+import zlib
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import GenericFunction
+from sqlalchemy.types import Text
+from models import db
+
+CODEC_PLAIN = 0
+CODEC_ZLIB = 1
+
+
+class MessageBlob(db.Model):
+    __tablename__ = 'message_blobs'
+
+    # SHA-256 del texto en UTF-8
+    hash = db.Column(db.LargeBinary(32), primary_key=True)
+    codec = db.Column(db.SmallInteger, nullable=False, default=CODEC_PLAIN)
+    data = db.Column(db.LargeBinary, nullable=False)
+    # Bytes del texto original (sin comprimir)
+    size = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+def body_hash(content: str) -> bytes:
+    """Dirección de un cuerpo: SHA-256 de su texto"""
+    return hashlib.sha256(content.encode('utf-8')).digest()
+
+
+def encode_body(content: str, level: int = 6) -> Tuple[int, bytes]:
+    """
+    Codifica un cuerpo: comprimido con zlib solo si así ocupa menos
+
+    Returns:
+        Tupla (codec, datos)
+    """
+    raw = content.encode('utf-8')
+    compressed = zlib.compress(raw, level)
+    if len(compressed) < len(raw):
+        return CODEC_ZLIB, compressed
+    return CODEC_PLAIN, raw
+
+
+@lru_cache(maxsize=1024)
+def decode_body(codec: int, data: bytes) -> str:
+    """Texto original de un cuerpo (los repetidos se descomprimen una vez)"""
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data).decode('utf-8')
+    return bytes(data).decode('utf-8')
+
+
+def _sqlite_message_text(codec: Optional[int], data: Optional[bytes]) -> Optional[str]:
+    return None if data is None else decode_body(codec, data)
+
+
+class message_text(GenericFunction):
+    """message_text(codec, data): texto de un cuerpo de message_blobs"""
+    type = Text()
+    inherit_cache = True
+
+
+@compiles(message_text)
+def _compile_message_text(element, compiler, **kw):
+    # Fuera de SQLite no hay cuerpos codificados
+    return "NULL"
+
+
+@compiles(message_text, 'sqlite')
+def _compile_message_text_sqlite(element, compiler, **kw):
+    return f"message_text({compiler.process(element.clauses, **kw)})"
+
+
+@event.listens_for(Engine, 'connect')
+def _register_sqlite_functions(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function('message_text', 2, _sqlite_message_text, deterministic=True)
@@ -0,0 +1,101 @@
+"""
+Índice de texto completo de los mensajes (SQLite FTS5)
+
+`message_search` es una tabla virtual FTS5 de contenido externo: guarda solo
+el índice invertido y lee el texto (por rowid = id) para los fragmentos, así
+que el contenido no se duplica. El texto sale de la vista
+`message_search_source`, que decodifica los cuerpos guardados en
+message_blobs (ver models/message_blob.py). Los triggers la mantienen
+sincronizada con cada INSERT/UPDATE/DELETE de chat_messages, incluido el
+INSERT de varias filas de MessageService.save_messages_batch, en la misma
+transacción que el mensaje.
+
+La vista, la tabla y los triggers se crean y eliminan junto con chat_messages
+(db.create_all / db.drop_all); en bases existentes los agrega la migración
+`add_message_blobs` (`add_message_search` creó antes el índice sobre
+chat_messages.content). En motores distintos de SQLite no se crea nada.
+"""
+from sqlalchemy import DDL, event, text
+from models.chat_message import ChatMessage
+
+SEARCH_TABLE = 'message_search'
+SEARCH_SOURCE_VIEW = 'message_search_source'
+
+
+def _message_text_sql(row: str) -> str:
+    """Texto de un mensaje en SQL (`row` = tabla o new/old en un trigger)"""
+    return (
+        f"CASE WHEN {row}.content_hash IS NULL THEN {row}.content "
+        f"ELSE (SELECT message_text(b.codec, b.data) FROM message_blobs b WHERE b.hash = {row}.content_hash) END"
+    )
+
+
+CREATE_SEARCH_SOURCE = (
+    f"CREATE VIEW IF NOT EXISTS {SEARCH_SOURCE_VIEW} AS "
+    f"SELECT chat_messages.id AS id, {_message_text_sql('chat_messages')} AS content FROM chat_messages"
+)
+
+# remove_diacritics 2: "cancion" encuentra "canción"
+CREATE_SEARCH_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    f"content, content='{SEARCH_SOURCE_VIEW}', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')"
+)
+
+SEARCH_TRIGGERS = (
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ai AFTER INSERT ON chat_messages BEGIN "
+    f"INSERT INTO {SEARCH_TABLE} (rowid, content) VALUES (new.id, {_message_text_sql('new')}); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ad AFTER DELETE ON chat_messages BEGIN "
+    f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, content) "
+    f"VALUES ('delete', old.id, {_message_text_sql('old')}); END",
+    # Pasar un cuerpo a message_blobs (manage.py compact-messages) no cambia el texto: no se reindexa
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_au AFTER UPDATE OF content, content_hash ON chat_messages "
+    f"WHEN ({_message_text_sql('old')}) IS NOT ({_message_text_sql('new')}) BEGIN "
+    f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, content) "
+    f"VALUES ('delete', old.id, {_message_text_sql('old')}); "
+    f"INSERT INTO {SEARCH_TABLE} (rowid, content) VALUES (new.id, {_message_text_sql('new')}); END",
+)
+
+
+def create_search_index(connection) -> bool:
+    """
+    Crea la tabla FTS5 y sus triggers si no existen
+
+    Returns:
+        True si el motor es SQLite (índice disponible)
+    """
+    if connection.dialect.name != 'sqlite':
+        return False
+    connection.execute(text(CREATE_SEARCH_SOURCE))
+    connection.execute(text(CREATE_SEARCH_TABLE))
+    for trigger in SEARCH_TRIGGERS:
+        connection.execute(text(trigger))
+    return True
+
+
+def drop_search_index(connection):
+    """Elimina los triggers, la tabla FTS5 y su vista (para recrearlos con otra definición)"""
+    for name in ('ai', 'ad', 'au'):
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_{name}"))
+    connection.execute(text(f"DROP TABLE IF EXISTS {SEARCH_TABLE}"))
+    connection.execute(text(f"DROP VIEW IF EXISTS {SEARCH_SOURCE_VIEW}"))
+
+
+def rebuild_search_index(connection) -> int:
+    """
+    Vuelve a indexar todos los mensajes desde chat_messages
+
+    Returns:
+        Número de mensajes indexados
+    """
+    connection.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')"))
+    return connection.execute(text("SELECT COUNT(*) FROM chat_messages")).scalar()
+
+
+# Crear / eliminar el índice junto con chat_messages
+event.listen(ChatMessage.__table__, 'after_create', DDL(CREATE_SEARCH_SOURCE).execute_if(dialect='sqlite'))
+event.listen(ChatMessage.__table__, 'after_create', DDL(CREATE_SEARCH_TABLE).execute_if(dialect='sqlite'))
+for _trigger in SEARCH_TRIGGERS:
+    event.listen(ChatMessage.__table__, 'after_create', DDL(_trigger).execute_if(dialect='sqlite'))
+event.listen(ChatMessage.__table__, 'before_drop', DDL(f"DROP TABLE IF EXISTS {SEARCH_TABLE}").execute_if(dialect='sqlite'))
+event.listen(ChatMessage.__table__, 'before_drop', DDL(f"DROP VIEW IF EXISTS {SEARCH_SOURCE_VIEW}").execute_if(dialect='sqlite'))
@@ -0,0 +1,227 @@
+"""
+Migraciones versionadas del esquema
+
+db.create_all() solo crea tablas nuevas: no agrega columnas ni índices a
+tablas creadas con una versión anterior de los modelos. Cada migración de
+MIGRATIONS completa lo que falta en una base existente y rellena los datos
+derivados; la tabla schema_version registra las aplicadas, así que un
+`chat_app.db` antiguo se actualiza en su lugar al arrancar.
+
+Las migraciones deben ser idempotentes: en una base nueva create_all ya creó
+las columnas e índices actuales y la migración solo queda registrada.
+
+Agregar una migración:
+    1. Escribir una función `def mi_cambio(connection) -> None`
+    2. Agregarla al final de MIGRATIONS con la siguiente versión
+"""
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from models import db
+from models.chat_message import ChatMessage
+from models.message_blob import MessageBlob
+from models.message_search import (
+    SEARCH_SOURCE_VIEW, SEARCH_TABLE, create_search_index, drop_search_index, rebuild_search_index
+)
+from models.session import Session
+from utils.logger import logger
+
+
+def _add_missing_columns(connection, table: str, columns: dict) -> list:
+    """
+    Agrega las columnas que no existan en la tabla
+
+    Args:
+        connection: Conexión dentro de una transacción
+        table: Nombre de la tabla
+        columns: {nombre: definición SQL}
+
+    Returns:
+        Nombres de las columnas agregadas
+    """
+    existing = {column['name'] for column in inspect(connection).get_columns(table)}
+    added = []
+    for name, definition in columns.items():
+        if name not in existing:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {definition}"))
+            added.append(name)
+    return added
+
+
+def _create_model_indexes(connection, *tables):
+    """
+    Crea los índices declarados en los modelos que aún no existan
+
+    Omite los índices sobre columnas que la base todavía no tiene (las agrega
+    una migración posterior, que crea entonces el índice).
+    """
+    for table in tables:
+        existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+        for index in table.indexes:
+            if all(column.name in existing for column in index.columns):
+                index.create(connection, checkfirst=True)
+
+
+def add_message_sequences(connection):
+    """Agrega sessions.last_seq y chat_messages.seq y numera los mensajes existentes"""
+    added = _add_missing_columns(connection, 'sessions', {'last_seq': "INTEGER NOT NULL DEFAULT 0"})
+    added += _add_missing_columns(connection, 'chat_messages', {'seq': "INTEGER"})
+    if added:
+        # Numeración por sesión en orden de ID, en una sola pasada
+        connection.execute(text(
+            "UPDATE chat_messages SET seq = numbered.rn "
+            "FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY id) AS rn "
+            "      FROM chat_messages) AS numbered "
+            "WHERE chat_messages.id = numbered.id"
+        ))
+        connection.execute(text(
+            "UPDATE sessions SET last_seq = COALESCE("
+            "(SELECT MAX(seq) FROM chat_messages WHERE chat_messages.session_id = sessions.id), 0)"
+        ))
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_chat_messages_session_seq ON chat_messages (session_id, seq)"
+    ))
+
+
+def add_session_activity(connection):
+    """Agrega las columnas de resumen de Session y las calcula desde los mensajes"""
+    added = _add_missing_columns(connection, 'sessions', {
+        'message_count': "INTEGER NOT NULL DEFAULT 0",
+        'last_message_preview': "VARCHAR(200)",
+        'last_activity': "DATETIME"
+    })
+    if not added:
+        return
+
+    connection.execute(text(
+        "UPDATE sessions SET "
+        "message_count = (SELECT COUNT(*) FROM chat_messages m WHERE m.session_id = sessions.id), "
+        "last_activity = COALESCE("
+        "    (SELECT MAX(m.created_at) FROM chat_messages m WHERE m.session_id = sessions.id), created_at), "
+        "last_message_preview = (SELECT SUBSTR(m.content, 1, :chars) FROM chat_messages m "
+        "    WHERE m.session_id = sessions.id ORDER BY m.id DESC LIMIT 1)"
+    ), {'chars': Session.PREVIEW_CHARS})
+
+
+def add_query_indexes(connection):
+    """Índices de las consultas frecuentes (historial por sesión, conversaciones por usuario)"""
+    _create_model_indexes(connection, ChatMessage.__table__, Session.__table__)
+    # Estadísticas para que el planificador elija los índices nuevos
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text("ANALYZE"))
+
+
+# Índice de búsqueda tal como lo creaba la versión 4: lee chat_messages.content
+# directamente (add_message_blobs lo recrea sobre la vista que decodifica los cuerpos)
+_SEARCH_TABLE_V4 = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    "content, content='chat_messages', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')"
+)
+_SEARCH_TRIGGERS_V4 = (
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ai AFTER INSERT ON chat_messages BEGIN "
+    f"INSERT INTO {SEARCH_TABLE} (rowid, content) VALUES (new.id, new.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ad AFTER DELETE ON chat_messages BEGIN "
+    f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_au AFTER UPDATE OF content ON chat_messages BEGIN "
+    f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+    f"INSERT INTO {SEARCH_TABLE} (rowid, content) VALUES (new.id, new.content); END",
+)
+
+
+def add_message_search(connection):
+    """Índice FTS5 de los mensajes (búsqueda de texto completo) e indexado de los existentes"""
+    if connection.dialect.name != 'sqlite':
+        return
+    connection.execute(text(_SEARCH_TABLE_V4))
+    for trigger in _SEARCH_TRIGGERS_V4:
+        connection.execute(text(trigger))
+    indexed = rebuild_search_index(connection)
+    logger.info(f"Índice de búsqueda creado con {indexed} mensajes")
+
+
+def add_session_version(connection):
+    """Agrega sessions.version (validador de las respuestas condicionales)"""
+    if _add_missing_columns(connection, 'sessions', {'version': "INTEGER NOT NULL DEFAULT 0"}):
+        # Distinto de 0 en las sesiones con mensajes
+        connection.execute(text("UPDATE sessions SET version = last_seq"))
+
+
+def add_message_blobs(connection):
+    """Cuerpos compartidos (message_blobs), chat_messages.content_hash y el índice de búsqueda sobre el texto decodificado"""
+    MessageBlob.__table__.create(connection, checkfirst=True)
+    _add_missing_columns(connection, 'chat_messages', {'content_hash': "BLOB REFERENCES message_blobs (hash)"})
+    _create_model_indexes(connection, ChatMessage.__table__)
+    if connection.dialect.name != 'sqlite':
+        return
+    # El índice de la versión 4 leía chat_messages.content directamente: se recrea
+    # sobre la vista, que necesita las columnas recién agregadas
+    definition = connection.execute(
+        text("SELECT sql FROM sqlite_master WHERE name = :name"), {'name': SEARCH_TABLE}
+    ).scalar()
+    if not definition or SEARCH_SOURCE_VIEW not in definition:
+        drop_search_index(connection)
+        create_search_index(connection)
+        indexed = rebuild_search_index(connection)
+        logger.info(f"Índice de búsqueda recreado sobre {SEARCH_SOURCE_VIEW} con {indexed} mensajes")
+
+
+def add_user_token_version(connection):
+    """Agrega users.token_version (revocación de tokens de sesión compartida entre workers)"""
+    _add_missing_columns(connection, 'users', {'token_version': "INTEGER NOT NULL DEFAULT 0"})
+
+
+def add_user_tenant(connection):
+    """Agrega users.tenant_id (adaptador LoRA asignado por el servidor)"""
+    _add_missing_columns(connection, 'users', {'tenant_id': "VARCHAR(64)"})
+
+
+# (versión, función) en orden de aplicación
+MIGRATIONS: List[Tuple[int, Callable]] = [
+    (1, add_message_sequences),
+    (2, add_session_activity),
+    (3, add_query_indexes),
+    (4, add_message_search),
+    (5, add_session_version),
+    (6, add_message_blobs),
+    (7, add_user_token_version),
+    (8, add_user_tenant),
+]
+
+
+def current_version(connection) -> int:
+    """Última versión aplicada (0 si la base no tiene registro de migraciones)"""
+    if not inspect(connection).has_table('schema_version'):
+        return 0
+    return connection.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+
+def run_migrations() -> List[int]:
+    """
+    Aplica las migraciones pendientes, cada una en su propia transacción
+
+    Requiere un contexto de aplicación y que db.create_all() se haya ejecutado.
+
+    Returns:
+        Versiones aplicadas
+    """
+    with db.engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, applied_at DATETIME NOT NULL)"
+        ))
+
+    applied = []
+    for version, migration in MIGRATIONS:
+        with db.engine.begin() as connection:
+            if version <= current_version(connection):
+                continue
+            logger.info(f"Aplicando migración {version}: {migration.__name__}")
+            migration(connection)
+            connection.execute(
+                text("INSERT INTO schema_version (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+                {'version': version, 'name': migration.__name__, 'applied_at': datetime.utcnow()}
+            )
+        applied.append(version)
+    return applied
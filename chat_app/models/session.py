@@ -5,19 +5,44 @@ from models.chat_message import ChatMessage
 class Session(db.Model):
     __tablename__ = 'sessions'
     
+    # Longitud de last_message_preview
+    PREVIEW_CHARS = 200
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     title = db.Column(db.String(255), nullable=False, default="Nueva Conversación")
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Último número de secuencia asignado a un mensaje de la sesión
+    last_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Resumen desnormalizado para listar conversaciones sin cargar mensajes
+    # (se actualiza en MessageService.save_message)
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_message_preview = db.Column(db.String(PREVIEW_CHARS))
+    last_activity = db.Column(db.DateTime, default=datetime.utcnow)
+    # Aumenta con cada cambio de la sesión o de sus mensajes (validador para ETag)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    __table_args__ = (
+        # Conversaciones de un usuario por actividad reciente
+        db.Index('ix_sessions_user_activity', 'user_id', 'last_activity'),
+    )
     
     # Relaciones
-    messages = db.relationship(ChatMessage, backref='session', lazy=True)
+    messages = db.relationship(ChatMessage, backref='session', lazy=True, order_by=ChatMessage.seq)
     
-    def to_dict(self):
+    def to_dict(self, messages=None):
+        """
+        Args:
+            messages: Mensajes ya serializados (p. ej. de MessageService.get_message_records);
+                si es None se serializa la relación messages
+        """
         return {
             'id': self.id,
             'user_id': self.user_id,
             'title': self.title,
             'created_at': self.created_at.isoformat(),
-            'messages': [message.to_dict() for message in self.messages]
+            'last_seq': self.last_seq,
+            'message_count': self.message_count,
+            'last_activity': self.last_activity.isoformat() if self.last_activity else None,
+            'messages': messages if messages is not None else [message.to_dict() for message in self.messages]
         }
\ No newline at end of file
@@ -0,0 +1,23 @@
+from datetime import datetime
+from models import db
+
+class SessionSummary(db.Model):
+    """Resumen acumulado de los turnos antiguos de una sesión"""
+    __tablename__ = 'session_summaries'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('sessions.id'), nullable=False, unique=True)
+    summary = db.Column(db.Text, nullable=False, default="")
+    # seq del último mensaje incorporado al resumen (los posteriores aún no están resumidos)
+    covered_seq = db.Column(db.Integer, nullable=False, default=0)
+    covered_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'session_id': self.session_id,
+            'summary': self.summary,
+            'covered_seq': self.covered_seq,
+            'covered_count': self.covered_count,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
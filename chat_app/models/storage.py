@@ -0,0 +1,232 @@
+"""
+Perfil de almacenamiento para SQLite
+
+- WAL: los lectores no bloquean al escritor ni el escritor a los lectores.
+- synchronous=NORMAL: con WAL solo se hace fsync en los checkpoints; un
+  corte de energía puede perder las últimas transacciones, nunca corromper.
+- cache_size / mmap_size: páginas calientes en memoria y lecturas sin copia.
+- busy_timeout: los escritores esperan el lock en lugar de fallar.
+- auto_vacuum=INCREMENTAL: el espacio libre se devuelve al sistema por
+  partes con `incremental_vacuum` (en bases nuevas; las existentes necesitan
+  un VACUUM completo una vez: `python manage.py vacuum`).
+
+El pool de conexiones se dimensiona para eventlet: cada green thread con un
+contexto de aplicación toma una conexión mientras dura la petición.
+"""
+import threading
+from typing import Callable, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from models import db
+from utils.logger import logger
+
+
+def is_sqlite_file(uri: str) -> bool:
+    """Indica si la URI es una base SQLite en archivo (no en memoria)"""
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def engine_options(config_class) -> dict:
+    """
+    Opciones del engine (SQLALCHEMY_ENGINE_OPTIONS) según la configuración
+
+    Args:
+        config_class: Clase de configuración
+
+    Returns:
+        Diccionario de opciones para create_engine
+    """
+    uri = config_class.SQLALCHEMY_DATABASE_URI
+    if not is_sqlite_file(uri):
+        return {}
+
+    return {
+        'pool_size': getattr(config_class, 'DB_POOL_SIZE', 10),
+        'max_overflow': getattr(config_class, 'DB_POOL_MAX_OVERFLOW', 20),
+        'pool_timeout': getattr(config_class, 'DB_POOL_TIMEOUT', 30),
+        'pool_pre_ping': False,
+        'connect_args': {
+            # Segundos que el driver espera un lock antes de fallar
+            'timeout': getattr(config_class, 'SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000.0,
+            # Las conexiones pasan entre hilos del pool (hilos de trabajo y green threads)
+            'check_same_thread': False
+        }
+    }
+
+
+def connection_pragmas(config_class) -> list:
+    """PRAGMAs que se ejecutan en cada conexión nueva"""
+    pragmas = [
+        # Solo tiene efecto en una base vacía (o tras VACUUM); debe ir antes de activar WAL
+        "PRAGMA auto_vacuum = INCREMENTAL",
+        f"PRAGMA busy_timeout = {int(getattr(config_class, 'SQLITE_BUSY_TIMEOUT_MS', 5000))}",
+        f"PRAGMA synchronous = {getattr(config_class, 'SQLITE_SYNCHRONOUS', 'NORMAL')}",
+        # Valor negativo = KiB
+        f"PRAGMA cache_size = -{int(getattr(config_class, 'SQLITE_CACHE_SIZE_KB', 65536))}",
+        f"PRAGMA mmap_size = {int(getattr(config_class, 'SQLITE_MMAP_SIZE_MB', 256)) * 1024 * 1024}",
+        "PRAGMA temp_store = MEMORY",
+    ]
+    if getattr(config_class, 'SQLITE_WAL', True):
+        pragmas.insert(1, "PRAGMA journal_mode = WAL")
+    return pragmas
+
+
+def apply_storage_profile(engine, config_class) -> bool:
+    """
+    Registra los PRAGMAs del perfil en las conexiones nuevas del engine
+
+    Debe llamarse antes de la primera conexión (justo después de db.init_app).
+
+    Returns:
+        True si el perfil se aplicó (solo SQLite en archivo)
+    """
+    if not is_sqlite_file(str(engine.url)):
+        return False
+
+    pragmas = connection_pragmas(config_class)
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    return True
+
+
+def run_maintenance(vacuum_pages: int = 1000, analyze: Optional[bool] = None) -> dict:
+    """
+    Mantenimiento liviano de SQLite
+
+    - PRAGMA optimize: actualiza estadísticas solo donde hace falta
+      (ANALYZE completo con analyze=True, o si la base aún no tiene estadísticas)
+    - incremental_vacuum: devuelve hasta `vacuum_pages` páginas libres (0 = todas)
+    - wal_checkpoint(PASSIVE): mueve el WAL a la base sin bloquear
+    - elimina los cuerpos de message_blobs que ya no usa ningún mensaje
+
+    Requiere un contexto de aplicación.
+
+    Returns:
+        Páginas libres antes y después, cuerpos eliminados y resultado del checkpoint
+    """
+    with db.engine.connect() as connection:
+        pruned_blobs = connection.execute(text(
+            "DELETE FROM message_blobs WHERE NOT EXISTS "
+            "(SELECT 1 FROM chat_messages m WHERE m.content_hash = message_blobs.hash)"
+        )).rowcount
+        connection.commit()
+        freelist_before = connection.execute(text("PRAGMA freelist_count")).scalar()
+        if analyze is None:
+            analyze = connection.execute(text(
+                "SELECT COUNT(*) FROM sqlite_master WHERE name = 'sqlite_stat1'"
+            )).scalar() == 0
+        connection.execute(text("ANALYZE" if analyze else "PRAGMA optimize"))
+        # El driver avanza un solo paso (una página) con execute; executescript
+        # ejecuta el PRAGMA hasta el final
+        connection.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(vacuum_pages)})")
+        freelist_after = connection.execute(text("PRAGMA freelist_count")).scalar()
+        checkpoint = connection.execute(text("PRAGMA wal_checkpoint(PASSIVE)")).fetchone()
+        connection.commit()
+
+    return {
+        'analyzed': analyze,
+        'freelist_before': freelist_before,
+        'freelist_after': freelist_after,
+        'pruned_blobs': pruned_blobs,
+        'wal_checkpoint': list(checkpoint) if checkpoint else None
+    }
+
+
+def database_size() -> Optional[dict]:
+    """
+    Tamaño de la base y espacio libre dentro del archivo
+
+    Requiere un contexto de aplicación.
+
+    Returns:
+        {'total_bytes', 'free_bytes'}, o None si la base no es SQLite
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return None
+    with db.engine.connect() as connection:
+        page_size = connection.execute(text("PRAGMA page_size")).scalar()
+        page_count = connection.execute(text("PRAGMA page_count")).scalar()
+        free_pages = connection.execute(text("PRAGMA freelist_count")).scalar()
+    return {'total_bytes': page_size * page_count, 'free_bytes': page_size * free_pages}
+
+
+def full_vacuum() -> str:
+    """
+    VACUUM completo: reescribe la base y activa auto_vacuum=INCREMENTAL en bases
+    creadas antes del perfil. Bloquea la base mientras dura.
+
+    Returns:
+        Modo de auto_vacuum resultante
+    """
+    # VACUUM no puede ejecutarse dentro de una transacción
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+        connection.execute(text("VACUUM"))
+        mode = connection.execute(text("PRAGMA auto_vacuum")).scalar()
+    return {0: 'NONE', 1: 'FULL', 2: 'INCREMENTAL'}.get(mode, str(mode))
+
+
+class StorageMaintenance:
+    """
+    Ejecuta run_maintenance periódicamente en un hilo
+
+    Cada `analyze_every` pasadas se hace un ANALYZE completo; las demás usan
+    PRAGMA optimize. La primera pasada se ejecuta al arrancar.
+    """
+
+    def __init__(self, context_factory: Callable, interval_seconds: float = 3600,
+                 vacuum_pages: int = 1000, analyze_every: int = 24):
+        """
+        Args:
+            context_factory: Callable que devuelve un context manager con acceso a la BD
+            interval_seconds: Segundos entre pasadas
+            vacuum_pages: Páginas máximas devueltas por pasada
+            analyze_every: Pasadas entre ANALYZE completos
+        """
+        self.context_factory = context_factory
+        self.interval_seconds = interval_seconds
+        self.vacuum_pages = vacuum_pages
+        self.analyze_every = max(1, analyze_every)
+        self.last_result: Optional[dict] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    def start(self):
+        """Arranca el hilo de mantenimiento si no está en marcha en este proceso"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._stop.clear()
+                self._worker = threading.Thread(target=self._run, name="storage-maintenance", daemon=True)
+                self._worker.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Detiene el hilo de mantenimiento"""
+        self._stop.set()
+        if self._worker and self._worker.is_alive():
+            self._worker.join(timeout)
+
+    def _run(self):
+        passes = 0
+        while not self._stop.wait(self.interval_seconds if passes else 0):
+            # None en la primera pasada: ANALYZE solo si la base no tiene estadísticas
+            analyze = None if passes == 0 else passes % self.analyze_every == 0
+            try:
+                with self.context_factory():
+                    self.last_result = run_maintenance(self.vacuum_pages, analyze=analyze)
+                logger.debug(f"Mantenimiento de almacenamiento: {self.last_result}")
+            except Exception as e:
+                logger.error(f"Error en mantenimiento de almacenamiento: {str(e)}", exc_info=True)
+            passes += 1
@@ -1,5 +1,5 @@
 from . import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from utils.password_hasher import password_hasher
 from datetime import datetime
 
 class User(db.Model):
@@ -13,6 +13,10 @@ class User(db.Model):
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
     last_login = db.Column(db.DateTime)
+    # Se incrementa al desactivar al usuario: invalida los tokens de sesión emitidos antes
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Tenant cuyo adaptador LoRA atiende al usuario (lo asigna `manage.py set-tenant`)
+    tenant_id = db.Column(db.String(64), nullable=True)
     
     def __init__(self, username, email, password, is_active=True):
         self.username = username
@@ -23,12 +27,12 @@ class User(db.Model):
         self.updated_at = self.created_at
 
     def set_password(self, password):
-        """Establece el hash de la contraseña"""
-        self.password_hash = generate_password_hash(password)
+        """Establece el hash de la contraseña (en el pool de hashing)"""
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        """Verifica si la contraseña coincide con el hash"""
-        return check_password_hash(self.password_hash, password)
+        """Verifica si la contraseña coincide con el hash (en el pool de hashing)"""
+        return password_hasher.verify(self.password_hash, password)
 
     def to_dict(self):
         """Convierte el usuario a diccionario"""
@@ -0,0 +1,244 @@
+"""
+Lanzador pre-fork para servir la aplicación con varios workers
+
+El proceso maestro carga el modelo de IA una sola vez, congela sus pesos en
+memoria compartida y después crea N workers con fork(). Cada worker atiende
+HTTP y Socket.IO sobre el mismo socket de escucha, y todos leen las mismas
+páginas de memoria del modelo (copy-on-write).
+
+Uso:
+    python prefork.py --workers 4 --port 5000
+
+Notas:
+    - Requiere eventlet (igual que socketio.run en app.py).
+    - Con varios workers, los clientes Socket.IO deben usar el transporte
+      websocket (sin long-polling), ya que no hay sesiones "sticky".
+    - Enviar SIGUSR1 al maestro imprime el reporte de memoria por worker.
+"""
+import argparse
+import gc
+import os
+import signal
+import sys
+import time
+
+import psutil
+
+from config import Config
+from services.ai_service import AIService
+from utils.logger import logger
+
+MB = 1024 * 1024
+
+
+def load_shared_ai_service(config_class=Config, use_shared_memory: bool = True) -> AIService:
+    """
+    Carga el modelo en el proceso maestro y lo congela para compartirlo
+
+    Args:
+        config_class: Clase de configuración
+        use_shared_memory: Mover los pesos a memoria compartida
+
+    Returns:
+        AIService listo para ser heredado por los workers
+    """
+    ai_service = AIService(model_name=config_class.AI_MODEL_NAME)
+    logger.info("Maestro: cargando modelo de IA una sola vez...")
+    if not ai_service.load_model():
+        logger.error("Maestro: no se pudo cargar el modelo, los workers responderán sin IA")
+        return ai_service
+
+    ai_service.freeze_for_sharing(use_shared_memory=use_shared_memory)
+    logger.info("Maestro: pesos del modelo congelados para compartir entre workers")
+    return ai_service
+
+
+def run_worker(app, listener):
+    """
+    Bucle de servicio de un worker (se ejecuta en el proceso hijo)
+
+    Args:
+        app: Aplicación Flask heredada del maestro
+        listener: Socket de escucha compartido
+    """
+    import eventlet.wsgi
+    from models import db
+
+    # Las conexiones abiertas por el maestro no pueden compartirse entre procesos
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+    logger.info(f"Worker {os.getpid()} atendiendo peticiones")
+    try:
+        eventlet.wsgi.server(listener, app, log_output=False)
+    finally:
+        # os._exit() no ejecuta atexit: escribir aquí los mensajes encolados
+        persister = app.extensions.get('message_persister')
+        if persister is not None:
+            persister.stop()
+        maintenance = app.extensions.get('storage_maintenance')
+        if maintenance is not None:
+            maintenance.stop()
+
+
+def spawn_worker(app, listener) -> int:
+    """
+    Crea un worker con fork()
+
+    Returns:
+        PID del worker creado
+    """
+    pid = os.fork()
+    if pid:
+        return pid
+
+    # Proceso hijo
+    # SIGTERM termina el servidor con SystemExit para que run_worker vacíe la cola
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+    exit_code = 0
+    try:
+        run_worker(app, listener)
+    except Exception as e:
+        logger.error(f"Worker {os.getpid()} terminó con error: {str(e)}", exc_info=True)
+        exit_code = 1
+    finally:
+        os._exit(exit_code)
+
+
+def memory_report(master_pid: int, worker_pids: list) -> dict:
+    """
+    Mide la memoria del maestro y de cada worker
+
+    RSS cuenta las páginas compartidas en cada proceso; PSS las reparte entre
+    quienes las comparten y USS solo incluye las privadas. Si el modelo se
+    comparte, la suma de RSS supera ampliamente la suma de PSS y el USS de
+    cada worker queda muy por debajo del tamaño del modelo.
+
+    Args:
+        master_pid: PID del proceso maestro
+        worker_pids: PIDs de los workers
+
+    Returns:
+        Diccionario con filas por proceso y totales (en MB)
+    """
+    rows = []
+    for role, pid in [('master', master_pid)] + [('worker', pid) for pid in worker_pids]:
+        try:
+            info = psutil.Process(pid).memory_full_info()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        rows.append({
+            'role': role,
+            'pid': pid,
+            'rss_mb': round(info.rss / MB, 1),
+            'pss_mb': round(getattr(info, 'pss', 0) / MB, 1),
+            'uss_mb': round(getattr(info, 'uss', 0) / MB, 1),
+            'shared_mb': round(getattr(info, 'shared', 0) / MB, 1)
+        })
+
+    total_rss = sum(row['rss_mb'] for row in rows)
+    total_pss = sum(row['pss_mb'] for row in rows)
+    return {
+        'processes': rows,
+        'total_rss_mb': round(total_rss, 1),
+        'total_pss_mb': round(total_pss, 1),
+        'shared_savings_mb': round(total_rss - total_pss, 1)
+    }
+
+
+def log_memory_report(report: dict):
+    """Imprime el reporte de memoria en forma de tabla"""
+    logger.info("Reporte de memoria (MB):")
+    logger.info(f"   {'rol':<8}{'pid':>8}{'rss':>10}{'pss':>10}{'uss':>10}{'shared':>10}")
+    for row in report['processes']:
+        logger.info(
+            f"   {row['role']:<8}{row['pid']:>8}{row['rss_mb']:>10}"
+            f"{row['pss_mb']:>10}{row['uss_mb']:>10}{row['shared_mb']:>10}"
+        )
+    logger.info(
+        f"   Total RSS: {report['total_rss_mb']} MB | Total PSS: {report['total_pss_mb']} MB | "
+        f"Ahorro por páginas compartidas: {report['shared_savings_mb']} MB"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor pre-fork con modelo compartido")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=Config.PREFORK_WORKERS)
+    parser.add_argument('--no-shared-memory', action='store_true',
+                        help="Depender solo de copy-on-write, sin mover pesos a /dev/shm")
+    parser.add_argument('--report-delay', type=float, default=Config.PREFORK_REPORT_DELAY)
+    args = parser.parse_args(argv)
+
+    try:
+        import eventlet
+    except ImportError:
+        logger.error("El lanzador pre-fork requiere eventlet (pip install eventlet)")
+        return 1
+
+    from app import create_app
+
+    ai_service = load_shared_ai_service(
+        Config,
+        use_shared_memory=Config.PREFORK_SHARED_MEMORY and not args.no_shared_memory
+    )
+    app = create_app(Config, ai_service=ai_service)
+    listener = eventlet.listen((args.host, args.port))
+
+    # Mover los objetos existentes a la generación permanente evita que el GC
+    # de cada hijo escriba en sus cabeceras y rompa el copy-on-write
+    gc.collect()
+    gc.freeze()
+
+    workers = set()
+    for _ in range(args.workers):
+        workers.add(spawn_worker(app, listener))
+    logger.info(f"Maestro {os.getpid()}: {len(workers)} workers escuchando en {args.host}:{args.port}")
+
+    shutting_down = False
+
+    def handle_shutdown(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def handle_report(signum, frame):
+        log_memory_report(memory_report(os.getpid(), sorted(workers)))
+
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    signal.signal(signal.SIGINT, handle_shutdown)
+    signal.signal(signal.SIGUSR1, handle_report)
+
+    report_at = time.monotonic() + args.report_delay
+    while workers:
+        if report_at is not None and time.monotonic() >= report_at:
+            log_memory_report(memory_report(os.getpid(), sorted(workers)))
+            report_at = None
+
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+
+        if pid == 0:
+            time.sleep(0.5)
+            continue
+
+        workers.discard(pid)
+        if not shutting_down:
+            logger.warning(f"Worker {pid} terminó (estado {status}), creando reemplazo")
+            workers.add(spawn_worker(app, listener))
+
+    logger.info("Maestro: todos los workers finalizaron")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,6 +4,9 @@
 from .agnostic.entity.user_service import UserService
 from .agnostic.entity.message_service import MessageService
 from .agnostic.entity.conversation_service import ConversationService
+from .agnostic.entity.summary_service import SummaryService
+from .agnostic.entity.search_service import SearchService
+from .agnostic.entity.archive_service import ArchiveService
 
 # Servicios Agnósticos - Utilidad
 from .agnostic.utility.text_utils import TextUtils
@@ -11,6 +14,11 @@ from .agnostic.utility.time_utils import TimeUtils
 
 # Servicios Agnósticos - Task
 from .agnostic.task.messaging_capability import MessagingCapability
+from .agnostic.task.conversation_summarizer import ConversationSummarizer
+from .agnostic.task.message_persister import MessagePersister
+from .agnostic.task.session_archiver import SessionArchiver
+from .agnostic.task.conversation_exporter import ConversationExporter
+from .agnostic.task.user_importer import UserImporter
 
 # Servicios de IA
 from .ai_service import AIService
@@ -24,6 +32,9 @@ __all__ = [
     'UserService',
     'MessageService',
     'ConversationService',
+    'SummaryService',
+    'SearchService',
+    'ArchiveService',
     
     # Utility Services
     'TextUtils',
@@ -31,6 +42,11 @@ __all__ = [
     
     # Task Services
     'MessagingCapability',
+    'ConversationSummarizer',
+    'MessagePersister',
+    'SessionArchiver',
+    'ConversationExporter',
+    'UserImporter',
     
     # AI Service
     'AIService',
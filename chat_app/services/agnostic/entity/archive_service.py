@@ -0,0 +1,292 @@
+import json
+import time
+import zlib
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import delete, exists, func, update
+from models import db, ArchivedSession, ChatMessage, Session, User
+from services.agnostic.entity.message_service import MessageService
+from services.agnostic.utility.retrieval_index import retrieval_index
+from services.agnostic.utility.segment_store import SegmentRecord, archive_store
+from services.agnostic.utility.event_log import event_log
+
+# Mensajes borrados por sentencia (límite de parámetros de SQLite)
+_DELETE_CHUNK = 500
+
+
+class ArchiveService:
+    """
+    Servicio de Entidad para el archivo de sesiones inactivas (Agnóstico)
+
+    Los mensajes de una sesión archivada salen de chat_messages y quedan
+    comprimidos en un registro de los segmentos (archive_store); la fila de
+    ArchivedSession guarda su ubicación. La sesión en sí (título y columnas
+    de resumen) no se mueve, así que sigue apareciendo en los listados.
+    Rehidratar o volver a archivar una sesión deja su registro anterior sin
+    referencia en el segmento; compact() reescribe los vivos y borra el resto.
+    """
+
+    @staticmethod
+    def find_inactive_sessions(cutoff: datetime, limit: Optional[int] = None) -> List[int]:
+        """
+        Obtiene las sesiones sin actividad desde `cutoff` que tienen mensajes en la tabla
+
+        Args:
+            cutoff: Fecha límite de última actividad
+            limit: Número máximo de sesiones
+
+        Returns:
+            IDs de sesión, de la menos a la más reciente
+        """
+        try:
+            query = db.session.query(Session.id).filter(
+                Session.last_activity < cutoff,
+                exists().where(ChatMessage.session_id == Session.id)
+            ).order_by(Session.last_activity.asc())
+            if limit is not None:
+                query = query.limit(limit)
+            return [session_id for (session_id,) in query.all()]
+        except Exception as e:
+            print(f"Error finding inactive sessions: {str(e)}")
+            return []
+
+    @staticmethod
+    def archive_session(session_id: int, compression_level: int = 6) -> Optional[dict]:
+        """
+        Mueve los mensajes de una sesión a un registro comprimido de los segmentos
+
+        Si la sesión ya tenía un registro (recibió mensajes después de archivarse)
+        se escribe uno nuevo con los mensajes anteriores y los nuevos.
+
+        Args:
+            session_id: ID de la sesión
+            compression_level: Nivel de zlib (1-9)
+
+        Returns:
+            Mensajes movidos y bytes antes y después de comprimir, o None si no
+            había mensajes o hubo error
+        """
+        try:
+            rows = db.session.query(
+                ChatMessage.id, ChatMessage.seq, ChatMessage.user_id,
+                ChatMessage.content, ChatMessage.is_bot, ChatMessage.created_at
+            ).filter(ChatMessage.session_id == session_id).order_by(ChatMessage.seq.asc()).all()
+            if not rows:
+                return None
+
+            entry = db.session.get(ArchivedSession, session_id)
+            messages = ArchiveService._read_messages(entry) if entry else []
+            messages += [
+                [row.id, row.seq, row.user_id, row.content, bool(row.is_bot), row.created_at.isoformat()]
+                for row in rows
+            ]
+            raw = json.dumps({'session_id': session_id, 'messages': messages}, ensure_ascii=False).encode('utf-8')
+            payload = zlib.compress(raw, compression_level)
+
+            # El registro queda en disco antes del commit: si el commit falla solo
+            # sobran bytes sin referencia en el segmento
+            record = archive_store.append(payload)
+            if entry is None:
+                entry = ArchivedSession(session_id=session_id)
+                db.session.add(entry)
+            entry.segment, entry.offset, entry.length, entry.crc = record
+            entry.message_count = len(messages)
+            entry.raw_bytes = len(raw)
+            entry.archived_at = datetime.utcnow()
+            # La sesión pasa a mostrarse como archivada: cambia el validador de las respuestas
+            ArchiveService._bump_version(session_id)
+
+            # Solo los mensajes leídos: los que lleguen mientras tanto quedan en la tabla
+            ids = [row.id for row in rows]
+            for start in range(0, len(ids), _DELETE_CHUNK):
+                db.session.execute(delete(ChatMessage).where(ChatMessage.id.in_(ids[start:start + _DELETE_CHUNK])))
+            db.session.commit()
+        except Exception as e:
+            print(f"Error archiving session: {str(e)}")
+            db.session.rollback()
+            return None
+
+        # El índice de recuperación del usuario se reconstruye sin estos mensajes
+        retrieval_index.remove_user(rows[0].user_id)
+        event_log.append([{'type': 'session.archived', 'session_id': session_id, 'messages': len(rows)}])
+        return {'messages': len(rows), 'raw_bytes': len(raw), 'stored_bytes': len(payload)}
+
+    @staticmethod
+    def rehydrate(session_id: int) -> int:
+        """
+        Devuelve a chat_messages los mensajes archivados de una sesión
+
+        Conserva IDs, números de secuencia y fechas. Si dos peticiones
+        rehidratan la misma sesión a la vez, solo una inserta los mensajes.
+
+        Args:
+            session_id: ID de la sesión
+
+        Returns:
+            Mensajes restaurados (0 si la sesión no estaba archivada), o -1 si hubo error
+        """
+        try:
+            entry = db.session.get(ArchivedSession, session_id)
+            if entry is None:
+                return 0
+
+            messages = ArchiveService._read_messages(entry)
+            # Borrar la entrada primero: quien no la borre es porque otro ya restauró
+            if db.session.execute(
+                delete(ArchivedSession).where(ArchivedSession.session_id == session_id)
+            ).rowcount == 0:
+                db.session.rollback()
+                return 0
+
+            if messages:
+                MessageService.insert_message_rows([
+                    {
+                        'id': message_id,
+                        'session_id': session_id,
+                        'seq': seq,
+                        'user_id': user_id,
+                        'content': content,
+                        'is_bot': is_bot,
+                        'created_at': datetime.fromisoformat(created_at)
+                    }
+                    for message_id, seq, user_id, content, is_bot, created_at in messages
+                ])
+            ArchiveService._bump_version(session_id)
+            db.session.commit()
+        except Exception as e:
+            print(f"Error rehydrating session: {str(e)}")
+            db.session.rollback()
+            return -1
+
+        if messages:
+            retrieval_index.remove_user(messages[0][2])
+        event_log.append([{'type': 'session.restored', 'session_id': session_id, 'messages': len(messages)}])
+        return len(messages)
+
+    @staticmethod
+    def is_archived(session_id: int) -> bool:
+        """Indica si la sesión tiene mensajes en el archivo"""
+        try:
+            return db.session.query(
+                exists().where(ArchivedSession.session_id == session_id)
+            ).scalar()
+        except Exception as e:
+            print(f"Error checking archived session: {str(e)}")
+            return False
+
+    @staticmethod
+    def get_archived_messages(session_id: int) -> list:
+        """
+        Lee los mensajes archivados de una sesión
+
+        Args:
+            session_id: ID de la sesión
+
+        Returns:
+            Mensajes como listas [id, seq, user_id, content, is_bot, created_at ISO]
+            en orden de seq (lista vacía si la sesión no está archivada)
+        """
+        entry = db.session.get(ArchivedSession, session_id)
+        return ArchiveService._read_messages(entry) if entry else []
+
+    @staticmethod
+    def compact(min_age_seconds: float = 60) -> dict:
+        """
+        Reclama el espacio de los registros sin referencia en los segmentos
+
+        Los registros vivos de cada segmento con bytes muertos se copian al
+        segmento actual y el segmento se borra. Los segmentos modificados hace
+        menos de `min_age_seconds` se omiten: pueden tener un registro recién
+        escrito cuyo commit aún no terminó. Si el segmento actual tiene bytes
+        muertos se abre uno nuevo antes de copiar.
+
+        Args:
+            min_age_seconds: Antigüedad mínima de un segmento para compactarlo
+
+        Returns:
+            Segmentos compactados y borrados, registros copiados y bytes en
+            disco antes y después
+        """
+        sizes = archive_store.segment_sizes()
+        live = ArchiveService._live_bytes_by_segment()
+        now = time.time()
+        candidates = [
+            segment for segment, size in sizes.items()
+            if size > live.get(segment, 0) and now - archive_store.segment_mtime(segment) >= min_age_seconds
+        ]
+        report = {'segments_compacted': 0, 'segments_removed': 0, 'records_moved': 0, 'failed': 0,
+                  'bytes_before': sum(sizes.values())}
+        if candidates and candidates[-1] == list(sizes)[-1]:
+            archive_store.rotate()
+
+        for segment in candidates:
+            try:
+                entries = db.session.query(
+                    ArchivedSession.session_id, ArchivedSession.offset, ArchivedSession.length, ArchivedSession.crc
+                ).filter(ArchivedSession.segment == segment).all()
+                for session_id, offset, length, crc in entries:
+                    record = archive_store.append(archive_store.read(SegmentRecord(segment, offset, length, crc)))
+                    # Si la sesión se rehidrató o se volvió a archivar mientras tanto, la copia queda muerta
+                    moved = db.session.execute(
+                        update(ArchivedSession).where(
+                            ArchivedSession.session_id == session_id,
+                            ArchivedSession.segment == segment,
+                            ArchivedSession.offset == offset
+                        ).values(segment=record.segment, offset=record.offset)
+                    ).rowcount
+                    report['records_moved'] += moved
+                db.session.commit()
+            except Exception as e:
+                print(f"Error compacting archive segment: {str(e)}")
+                db.session.rollback()
+                report['failed'] += 1
+                continue
+
+            report['segments_compacted'] += 1
+            if not db.session.query(exists().where(ArchivedSession.segment == segment)).scalar():
+                archive_store.remove(segment)
+                report['segments_removed'] += 1
+
+        report['bytes_after'] = archive_store.stats()['bytes']
+        report['reclaimed_bytes'] = report['bytes_before'] - report['bytes_after']
+        return report
+
+    @staticmethod
+    def stats() -> dict:
+        """Sesiones y mensajes archivados, bytes antes y después de comprimir y bytes muertos en los segmentos"""
+        sessions, messages, raw_bytes, stored_bytes = db.session.query(
+            func.count(ArchivedSession.session_id),
+            func.coalesce(func.sum(ArchivedSession.message_count), 0),
+            func.coalesce(func.sum(ArchivedSession.raw_bytes), 0),
+            func.coalesce(func.sum(ArchivedSession.length), 0)
+        ).one()
+        segments = archive_store.stats()
+        live_bytes = sum(ArchiveService._live_bytes_by_segment().values())
+        return {
+            'sessions': sessions,
+            'messages': messages,
+            'raw_bytes': raw_bytes,
+            'stored_bytes': stored_bytes,
+            'live_bytes': live_bytes,
+            'dead_bytes': max(0, segments['bytes'] - live_bytes),
+            'segments': segments
+        }
+
+    @staticmethod
+    def _live_bytes_by_segment() -> dict:
+        """Bytes en disco de los registros referenciados por archived_sessions, por segmento"""
+        rows = db.session.query(
+            ArchivedSession.segment, func.count(), func.coalesce(func.sum(ArchivedSession.length), 0)
+        ).group_by(ArchivedSession.segment).all()
+        return {segment: archive_store.record_size(0) * count + length for segment, count, length in rows}
+
+    @staticmethod
+    def _bump_version(session_id: int):
+        """Incrementa Session.version dentro de la transacción en curso"""
+        db.session.execute(update(Session).where(Session.id == session_id).values(version=Session.version + 1))
+
+    @staticmethod
+    def _read_messages(entry: ArchivedSession) -> list:
+        """Lee y descomprime los mensajes del registro de una sesión"""
+        payload = archive_store.read(SegmentRecord(entry.segment, entry.offset, entry.length, entry.crc))
+        return json.loads(zlib.decompress(payload).decode('utf-8'))['messages']
@@ -1,24 +1,35 @@
 from models.session import Session
+from models.archived_session import ArchivedSession
+from models.user import User
 from models import db
+from sqlalchemy import exists, func
+from sqlalchemy.orm import selectinload
 from dtos import ConversationDTO
 from services.agnostic.entity.user_service import UserService
+from services.agnostic.entity.archive_service import ArchiveService
+from services.agnostic.utility.identity_cache import identity_cache, SessionRecord, UserRecord
+from services.agnostic.utility.event_log import event_log
+from typing import Iterator, Optional
 
 class ConversationService:
     @staticmethod
-    def create_conversation(user_id: int, title: str = "Nueva Conversación") -> Session:
+    def create_conversation(user_id: int, title: str = "Nueva Conversación",
+                            user: Optional[UserRecord] = None) -> Session:
         """
         Crea una nueva conversación para un usuario
         
         Args:
             user_id: ID del usuario
             title: Título de la conversación
+            user: Registro del usuario ya validado por el llamador (evita la consulta)
             
         Returns:
             Session object if successful, None otherwise
         """
         try:
-            # Verificar que el usuario existe
-            user = UserService.get_user(user_id)
+            # Verificar que el usuario existe (normalmente ya está en caché)
+            if user is None or user.id != user_id:
+                user = UserService.get_user_identity(user_id)
             if not user:
                 return None
                 
@@ -30,6 +41,13 @@ class ConversationService:
             
             db.session.add(session)
             db.session.commit()
+            identity_cache.put('session', session.id, SessionRecord(session.id, session.user_id))
+            event_log.append([{
+                'type': 'session.created',
+                'session_id': session.id,
+                'user_id': user_id,
+                'title': session.title
+            }])
             
             return session
             
@@ -39,35 +57,180 @@ class ConversationService:
             return None
             
     @staticmethod
-    def get_conversation(conversation_id: int) -> Session:
+    def get_conversation(conversation_id: int, user_id: Optional[int] = None) -> Session:
         """
         Obtiene una conversación por su ID
         
+        Si la conversación fue archivada, sus mensajes vuelven primero a la
+        tabla de mensajes (ArchiveService.rehydrate), solo cuando la pide
+        su dueño: el llamador rechaza a los demás.
+        
         Args:
             conversation_id: ID de la conversación
+            user_id: Usuario que la pide (None = sin comprobar el dueño)
             
         Returns:
             Session object if found, None otherwise
         """
         try:
-            return Session.query.get(conversation_id)
+            session = Session.query.get(conversation_id)
+            if session is not None and (user_id is None or session.user_id == user_id):
+                ArchiveService.rehydrate(conversation_id)
+            return session
         except Exception as e:
             print(f"Error getting conversation: {str(e)}")
             return None
             
+    @staticmethod
+    def restore_messages(session_id: int) -> int:
+        """
+        Devuelve a la tabla los mensajes de la conversación si estaba archivada
+        
+        Args:
+            session_id: ID de la conversación
+            
+        Returns:
+            Mensajes restaurados (0 si no estaba archivada), o -1 si hubo error
+        """
+        return ArchiveService.rehydrate(session_id)
+    
+    @staticmethod
+    def get_session_identity(session_id: int) -> Optional[SessionRecord]:
+        """
+        Obtiene el registro mínimo de la sesión (ID y dueño) desde la caché
+        
+        Args:
+            session_id: ID de la conversación
+            
+        Returns:
+            SessionRecord o None si no existe
+        """
+        return identity_cache.get_or_load('session', session_id, ConversationService._load_session_identity)
+    
+    @staticmethod
+    def _load_session_identity(session_id: int) -> Optional[SessionRecord]:
+        """Lee de la BD solo las columnas del SessionRecord"""
+        row = db.session.query(Session.id, Session.user_id).filter(Session.id == session_id).first()
+        return SessionRecord(row.id, row.user_id) if row else None
+    
+    @staticmethod
+    def get_conversation_version(session_id: int) -> Optional[tuple]:
+        """
+        Lee el dueño y la versión de una conversación (sin leer mensajes)
+        
+        Args:
+            session_id: ID de la conversación
+            
+        Returns:
+            Tupla (user_id, version) o None si no existe
+        """
+        try:
+            row = db.session.query(Session.user_id, Session.version).filter(Session.id == session_id).first()
+            return tuple(row) if row else None
+        except Exception as e:
+            print(f"Error getting conversation version: {str(e)}")
+            return None
+    
+    @staticmethod
+    def get_user_conversations_version(user_id: int) -> Optional[tuple]:
+        """
+        Resume el estado de las conversaciones de un usuario en una consulta
+        
+        Cambia al crear una sesión (cantidad y último ID) y con cada cambio
+        de una sesión existente (suma de versiones).
+        
+        Args:
+            user_id: ID del usuario
+            
+        Returns:
+            Tupla (cantidad, último ID, suma de versiones) o None si hubo error
+        """
+        try:
+            return tuple(db.session.query(
+                func.count(Session.id),
+                func.coalesce(func.max(Session.id), 0),
+                func.coalesce(func.sum(Session.version), 0)
+            ).filter(Session.user_id == user_id).one())
+        except Exception as e:
+            print(f"Error getting conversations version: {str(e)}")
+            return None
+    
     @staticmethod
     def get_user_conversations(user_id: int) -> list:
         """
         Obtiene todas las conversaciones de un usuario
         
+        Las conversaciones archivadas no se restauran: vienen sin mensajes
+        y marcadas como archivadas.
+        
         Args:
             user_id: ID del usuario
             
         Returns:
-            List of Session objects
+            Lista de tuplas (Session, archivada)
         """
         try:
-            return Session.query.filter_by(user_id=user_id).all()
+            archived = exists().where(ArchivedSession.session_id == Session.id)
+            # Carga los mensajes de todas las sesiones en una sola consulta adicional
+            return db.session.query(Session, archived).options(
+                selectinload(Session.messages)
+            ).filter(Session.user_id == user_id).all()
         except Exception as e:
             print(f"Error getting user conversations: {str(e)}")
+            return []
+    
+    @staticmethod
+    def iter_session_chunks(user_id: Optional[int] = None, from_session_id: int = 0,
+                            chunk_size: int = 200) -> Iterator[list]:
+        """
+        Recorre las sesiones en orden de ID por bloques (paginación keyset)
+        
+        Args:
+            user_id: Solo sesiones de este usuario
+            from_session_id: Primera sesión a incluir (inclusive)
+            chunk_size: Sesiones por consulta
+            
+        Yields:
+            Listas de filas (id, title, user_id, username, last_seq, archived)
+        """
+        query = db.session.query(
+            Session.id, Session.title, Session.user_id, User.username, Session.last_seq,
+            exists().where(ArchivedSession.session_id == Session.id).label('archived')
+        ).join(User, User.id == Session.user_id)
+        if user_id is not None:
+            query = query.filter(Session.user_id == user_id)
+        
+        next_id = from_session_id
+        while True:
+            rows = query.filter(Session.id >= next_id).order_by(Session.id.asc()).limit(chunk_size).all()
+            if not rows:
+                return
+            yield rows
+            if len(rows) < chunk_size:
+                return
+            next_id = rows[-1].id + 1
+    
+    @staticmethod
+    def get_user_conversation_summaries(user_id: int) -> list:
+        """
+        Obtiene el resumen de las conversaciones de un usuario sin cargar mensajes
+        
+        Lee solo las columnas desnormalizadas de Session, en una consulta,
+        de la actividad más reciente a la más antigua.
+        
+        Args:
+            user_id: ID del usuario
+            
+        Returns:
+            Lista de filas (id, title, created_at, message_count, last_message_preview, last_activity)
+        """
+        try:
+            return db.session.query(
+                Session.id, Session.title, Session.created_at, Session.message_count,
+                Session.last_message_preview, Session.last_activity
+            ).filter(
+                Session.user_id == user_id
+            ).order_by(Session.last_activity.desc(), Session.id.desc()).all()
+        except Exception as e:
+            print(f"Error getting conversation summaries: {str(e)}")
             return []
\ No newline at end of file
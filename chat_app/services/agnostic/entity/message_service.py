@@ -1,6 +1,82 @@
 from models.chat_message import ChatMessage
+from models.message_blob import MessageBlob
+from models.session import Session
+from models.user import User
 from models import db
-from typing import Optional, List
+from sqlalchemy import String, and_, bindparam, cast, func, insert, or_, select, type_coerce, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional, List, Iterator, Tuple
+from services.agnostic.utility.retrieval_index import retrieval_index
+from services.agnostic.utility.id_allocator import message_id_allocator
+from services.agnostic.utility.message_codec import message_codec
+from services.agnostic.utility.event_log import event_log
+
+class MessageRecord(NamedTuple):
+    """
+    Mensaje de solo lectura para el historial (sin objeto ORM)
+    
+    Una tupla con las columnas que devuelve ChatMessage.to_dict; created_at
+    ya viene en formato ISO.
+    """
+    id: int
+    session_id: int
+    seq: Optional[int]
+    user_id: int
+    content: str
+    is_bot: bool
+    created_at: str
+    
+    def to_dict(self) -> dict:
+        """Mismo diccionario que ChatMessage.to_dict"""
+        return {
+            'id': self.id,
+            'session_id': self.session_id,
+            'seq': self.seq,
+            'user_id': self.user_id,
+            'content': self.content,
+            'is_bot': self.is_bot,
+            'created_at': self.created_at
+        }
+
+
+def _record_columns():
+    """
+    Columnas de MessageRecord para una consulta Core
+    
+    En SQLite created_at se lee como el texto guardado ("AAAA-MM-DD HH:MM:SS.ffffff")
+    y se pasa a ISO sin construir un datetime por fila (ver _iso_from_sqlite).
+    """
+    created_at = ChatMessage.created_at
+    if db.engine.dialect.name == 'sqlite':
+        created_at = type_coerce(ChatMessage.created_at, String)
+    return (
+        ChatMessage.id, ChatMessage.session_id, ChatMessage.seq, ChatMessage.user_id,
+        ChatMessage.content, ChatMessage.is_bot, created_at
+    )
+
+
+def _iso_from_sqlite(value: str) -> str:
+    """Texto de fecha de SQLite -> lo mismo que datetime.isoformat()"""
+    # isoformat omite los microsegundos cuando son cero
+    if value.endswith('.000000'):
+        value = value[:-7]
+    return value.replace(' ', 'T', 1)
+
+
+def _to_records(rows) -> List[MessageRecord]:
+    """Convierte filas de _record_columns en MessageRecord"""
+    make = MessageRecord._make
+    if db.engine.dialect.name == 'sqlite':
+        return [
+            make((id_, session_id, seq, user_id, content, bool(is_bot), _iso_from_sqlite(created_at)))
+            for id_, session_id, seq, user_id, content, is_bot, created_at in rows
+        ]
+    return [
+        make((id_, session_id, seq, user_id, content, bool(is_bot), created_at.isoformat()))
+        for id_, session_id, seq, user_id, content, is_bot, created_at in rows
+    ]
+
 
 class MessageService:
     @staticmethod
@@ -18,22 +94,221 @@ class MessageService:
             ChatMessage object if successful, None otherwise
         """
         try:
-            message = ChatMessage(
-                session_id=session_id,
-                user_id=user_id,
-                content=content,
-                is_bot=is_bot
-            )
+            message = MessageService.build_message(session_id, user_id, content, is_bot)
+        except Exception as e:
+            print(f"Error saving message: {str(e)}")
+            return None
+        
+        return message if MessageService.save_messages_batch([message]) else None
+    
+    @staticmethod
+    def build_message(session_id: int, user_id: int, content: str, is_bot: bool = False) -> ChatMessage:
+        """
+        Crea un mensaje sin guardarlo, con su ID definitivo ya asignado
+        
+        El número de secuencia (seq) se asigna al escribirlo con save_messages_batch.
+        
+        Args:
+            session_id: ID de la sesión/conversación
+            user_id: ID del usuario que envía el mensaje
+            content: Contenido del mensaje
+            is_bot: Si el mensaje es del bot o del usuario
             
-            db.session.add(message)
-            db.session.commit()
+        Returns:
+            ChatMessage transitorio (fuera de la sesión de SQLAlchemy)
+        """
+        return ChatMessage(
+            id=message_id_allocator.next_id(),
+            session_id=session_id,
+            user_id=user_id,
+            content=content,
+            is_bot=is_bot,
+            created_at=datetime.utcnow()
+        )
+    
+    @staticmethod
+    def save_messages_batch(messages: List[ChatMessage]) -> bool:
+        """
+        Escribe un grupo de mensajes creados con build_message en una sola transacción
+        
+        Por cada sesión del grupo se hace un UPDATE que reserva los números de
+        secuencia y actualiza el resumen de la sesión; los mensajes se insertan
+        con un único INSERT de varias filas. El UPDATE bloquea la fila (o la BD
+        en SQLite) hasta el commit, así que dos escritores no repiten número.
+        
+        Args:
+            messages: Mensajes en orden de llegada (se les asigna seq)
             
-            return message
+        Returns:
+            True si se guardaron todos, False si hubo error (no se guarda ninguno)
+        """
+        if not messages:
+            return True
+        
+        by_session = {}
+        for message in messages:
+            by_session.setdefault(message.session_id, []).append(message)
+        
+        try:
+            for session_id, group in by_session.items():
+                last = group[-1]
+                db.session.execute(
+                    update(Session).where(Session.id == session_id).values(
+                        last_seq=Session.last_seq + len(group),
+                        message_count=Session.message_count + len(group),
+                        last_message_preview=last.content[:Session.PREVIEW_CHARS],
+                        last_activity=last.created_at,
+                        version=Session.version + 1
+                    )
+                )
+                last_seq = db.session.query(Session.last_seq).filter(Session.id == session_id).scalar()
+                if last_seq is not None:
+                    for offset, message in enumerate(group):
+                        message.seq = last_seq - len(group) + 1 + offset
             
+            MessageService.insert_message_rows([
+                {
+                    'id': m.id,
+                    'session_id': m.session_id,
+                    'seq': m.seq,
+                    'user_id': m.user_id,
+                    'content': m.content,
+                    'is_bot': bool(m.is_bot),
+                    'created_at': m.created_at
+                }
+                for m in messages
+            ])
+            db.session.commit()
         except Exception as e:
-            print(f"Error saving message: {str(e)}")
+            print(f"Error saving messages: {str(e)}")
             db.session.rollback()
-            return None
+            for message in messages:
+                message.seq = None
+            return False
+        
+        # Mantener el índice de recuperación del usuario (solo sus propios mensajes)
+        for message in messages:
+            if not message.is_bot:
+                retrieval_index.add(message.user_id, message.id, message.session_id, message.content)
+        # Un solo write al registro de eventos por grupo
+        event_log.append(
+            {
+                'type': 'message.created',
+                'id': m.id,
+                'session_id': m.session_id,
+                'seq': m.seq,
+                'user_id': m.user_id,
+                'content': m.content,
+                'is_bot': bool(m.is_bot),
+                'created_at': m.created_at
+            }
+            for m in messages
+        )
+        return True
+    
+    @staticmethod
+    def insert_message_rows(rows: List[dict]):
+        """
+        Inserta filas de chat_messages aplicando el almacenamiento compacto
+        
+        Los cuerpos que elige message_codec se guardan en message_blobs (los
+        ya existentes se reutilizan) y la fila queda con su content_hash. No
+        hace commit: va en la transacción del llamador.
+        
+        Args:
+            rows: Diccionarios con las columnas de chat_messages ('content' con el texto)
+        """
+        MessageService.store_blobs(message_codec.encode_rows(rows))
+        db.session.execute(insert(ChatMessage.__table__), rows)
+    
+    @staticmethod
+    def store_blobs(blobs: List[dict]):
+        """Inserta los cuerpos de message_codec que aún no existen (sin commit)"""
+        if blobs:
+            db.session.execute(
+                sqlite_insert(MessageBlob.__table__).on_conflict_do_nothing(index_elements=['hash']),
+                blobs
+            )
+    
+    @staticmethod
+    def compact_messages(after_id: int = 0, batch_size: int = 1000) -> Tuple[int, int]:
+        """
+        Pasa a message_blobs un bloque de mensajes ya guardados (solo SQLite)
+        
+        Recorre por ID los mensajes sin codificar; los que message_codec elige
+        (aunque esté desactivado para los mensajes nuevos) se actualizan en
+        una transacción por bloque. El texto no cambia, así que el índice de
+        búsqueda no se toca.
+        
+        Args:
+            after_id: Continuar después de este mensaje
+            batch_size: Mensajes leídos por bloque
+            
+        Returns:
+            Tupla (último ID recorrido, mensajes compactados); el ID es igual a
+            after_id cuando no quedan mensajes
+        """
+        table = ChatMessage.__table__
+        rows = db.session.execute(
+            select(table.c.id, table.c.content)
+            .where(table.c.id > after_id, table.c.content_hash.is_(None))
+            .order_by(table.c.id.asc())
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return after_id, 0
+        
+        updates = [{'b_id': row.id, 'content': row.content} for row in rows]
+        blobs = message_codec.encode_rows(updates, force=True)
+        updates = [row for row in updates if row['content_hash'] is not None]
+        try:
+            MessageService.store_blobs(blobs)
+            if updates:
+                db.session.execute(
+                    update(table).where(table.c.id == bindparam('b_id')).values(
+                        content=bindparam('content'), content_hash=bindparam('content_hash')
+                    ),
+                    updates
+                )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return rows[-1].id, len(updates)
+    
+    @staticmethod
+    def storage_report() -> dict:
+        """
+        Tamaño del contenido de los mensajes: en la fila y en message_blobs
+        
+        Returns:
+            Mensajes (total y codificados), bytes del texto en las filas, bytes
+            originales de los codificados, cuerpos distintos y bytes guardados en message_blobs
+        """
+        table = ChatMessage.__table__
+        messages, encoded, inline_bytes = db.session.execute(
+            select(
+                func.count(),
+                func.count(table.c.content_hash),
+                func.coalesce(func.sum(func.length(cast(table.c.content, db.LargeBinary))), 0)
+            ).select_from(table)
+        ).one()
+        encoded_bytes = db.session.execute(
+            select(func.coalesce(func.sum(MessageBlob.size), 0))
+            .select_from(table)
+            .join(MessageBlob, MessageBlob.hash == table.c.content_hash)
+        ).scalar()
+        blobs, blob_bytes = db.session.execute(
+            select(func.count(), func.coalesce(func.sum(func.length(MessageBlob.data)), 0))
+        ).one()
+        return {
+            'messages': messages,
+            'encoded_messages': encoded,
+            'inline_bytes': inline_bytes,
+            'encoded_bytes': encoded_bytes,
+            'blobs': blobs,
+            'blob_bytes': blob_bytes
+        }
     
     @staticmethod
     def get_messages(session_id: int) -> List[ChatMessage]:
@@ -47,7 +322,323 @@ class MessageService:
             List of ChatMessage objects
         """
         try:
-            return ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.created_at.asc()).all()
+            return ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.seq.asc()).all()
         except Exception as e:
             print(f"Error getting messages: {str(e)}")
-            return []
\ No newline at end of file
+            return []
+    
+    @staticmethod
+    def get_messages_page(session_id: int, limit: int, before_seq: Optional[int] = None,
+                          after_seq: Optional[int] = None) -> Tuple[List[ChatMessage], bool]:
+        """
+        Obtiene una página de mensajes por cursor de secuencia (paginación keyset)
+        
+        Con after_seq se avanza hacia mensajes más nuevos; en otro caso se toman
+        los más recientes anteriores a before_seq (o los últimos de la sesión).
+        
+        Args:
+            session_id: ID de la sesión/conversación
+            limit: Número máximo de mensajes
+            before_seq: Solo mensajes con seq menor
+            after_seq: Solo mensajes con seq mayor
+            
+        Returns:
+            Tupla (mensajes en orden cronológico, hay más mensajes en esa dirección)
+        """
+        try:
+            query = ChatMessage.query.filter(ChatMessage.session_id == session_id)
+            if before_seq is not None:
+                query = query.filter(ChatMessage.seq < before_seq)
+            if after_seq is not None:
+                query = query.filter(ChatMessage.seq > after_seq)
+                order = ChatMessage.seq.asc()
+            else:
+                order = ChatMessage.seq.desc()
+            
+            # Se pide una fila extra para saber si hay más sin hacer un COUNT
+            messages = query.order_by(order).limit(limit + 1).all()
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+            if after_seq is None:
+                messages.reverse()
+            return messages, has_more
+        except Exception as e:
+            print(f"Error getting messages page: {str(e)}")
+            return [], False
+    
+    @staticmethod
+    def get_message_records(session_id: int) -> List[MessageRecord]:
+        """
+        Obtiene todos los mensajes de una conversación sin pasar por el ORM
+        
+        Consulta Core solo con las columnas necesarias: sin objetos
+        ChatMessage ni mapa de identidad. Mismo orden que Session.messages (seq).
+        
+        Args:
+            session_id: ID de la sesión/conversación
+            
+        Returns:
+            Lista de MessageRecord
+        """
+        try:
+            statement = select(*_record_columns()).where(
+                ChatMessage.session_id == session_id
+            ).order_by(ChatMessage.seq.asc())
+            return _to_records(db.session.execute(statement).tuples())
+        except Exception as e:
+            print(f"Error getting message records: {str(e)}")
+            return []
+    
+    @staticmethod
+    def get_message_records_page(session_id: int, limit: int, before_seq: Optional[int] = None,
+                                 after_seq: Optional[int] = None) -> Tuple[List[MessageRecord], bool]:
+        """
+        Igual que get_messages_page pero con MessageRecord (sin objetos ORM)
+        
+        Args:
+            session_id: ID de la sesión/conversación
+            limit: Número máximo de mensajes
+            before_seq: Solo mensajes con seq menor
+            after_seq: Solo mensajes con seq mayor
+            
+        Returns:
+            Tupla (mensajes en orden cronológico, hay más mensajes en esa dirección)
+        """
+        try:
+            statement = select(*_record_columns()).where(ChatMessage.session_id == session_id)
+            if before_seq is not None:
+                statement = statement.where(ChatMessage.seq < before_seq)
+            if after_seq is not None:
+                statement = statement.where(ChatMessage.seq > after_seq).order_by(ChatMessage.seq.asc())
+            else:
+                statement = statement.order_by(ChatMessage.seq.desc())
+            
+            records = _to_records(db.session.execute(statement.limit(limit + 1)).tuples())
+            has_more = len(records) > limit
+            records = records[:limit]
+            if after_seq is None:
+                records.reverse()
+            return records, has_more
+        except Exception as e:
+            print(f"Error getting message records page: {str(e)}")
+            return [], False
+    
+    @staticmethod
+    def get_message_seq(session_id: int, message_id: int) -> Optional[int]:
+        """
+        Obtiene el número de secuencia de un mensaje de la sesión
+        
+        Returns:
+            seq del mensaje, o None si no pertenece a la sesión
+        """
+        try:
+            return db.session.query(ChatMessage.seq).filter(
+                ChatMessage.id == message_id,
+                ChatMessage.session_id == session_id
+            ).scalar()
+        except Exception as e:
+            print(f"Error getting message seq: {str(e)}")
+            return None
+    
+    @staticmethod
+    def get_recent_messages(session_id: int, limit: int, before_seq: Optional[int] = None,
+                            exclude_id: Optional[int] = None) -> List[ChatMessage]:
+        """
+        Obtiene los últimos mensajes de una conversación en orden cronológico
+        
+        El orden es el de seq: los IDs vienen de bloques por proceso y no
+        siguen el orden de escritura entre workers.
+        
+        Args:
+            session_id: ID de la sesión/conversación
+            limit: Número máximo de mensajes
+            before_seq: Si se indica, solo mensajes con seq menor
+            exclude_id: Mensaje a omitir (p. ej. el que se está respondiendo
+                cuando todavía no tiene seq)
+            
+        Returns:
+            List of ChatMessage objects (del más antiguo al más reciente)
+        """
+        try:
+            query = ChatMessage.query.filter_by(session_id=session_id)
+            if before_seq is not None:
+                query = query.filter(ChatMessage.seq < before_seq)
+            if exclude_id is not None:
+                query = query.filter(ChatMessage.id != exclude_id)
+            messages = query.order_by(ChatMessage.seq.desc()).limit(limit).all()
+            messages.reverse()
+            return messages
+        except Exception as e:
+            print(f"Error getting recent messages: {str(e)}")
+            return []
+    
+    @staticmethod
+    def get_messages_in_range(session_id: int, after_seq: int, before_seq: int) -> List[ChatMessage]:
+        """
+        Obtiene los mensajes de una conversación con after_seq < seq < before_seq
+        
+        Args:
+            session_id: ID de la sesión/conversación
+            after_seq: Límite inferior exclusivo
+            before_seq: Límite superior exclusivo
+            
+        Returns:
+            List of ChatMessage objects en orden cronológico
+        """
+        try:
+            return ChatMessage.query.filter(
+                ChatMessage.session_id == session_id,
+                ChatMessage.seq > after_seq,
+                ChatMessage.seq < before_seq
+            ).order_by(ChatMessage.seq.asc()).all()
+        except Exception as e:
+            print(f"Error getting messages in range: {str(e)}")
+            return []
+    
+    @staticmethod
+    def rebuild_retrieval_index(user_id: Optional[int] = None) -> int:
+        """
+        Reconstruye el índice de recuperación desde la base de datos
+        
+        Args:
+            user_id: Usuario a reconstruir; None descarta todos los índices
+                (cada usuario se reconstruye en su próxima consulta)
+            
+        Returns:
+            Número de mensajes indexados
+        """
+        if user_id is None:
+            retrieval_index.clear()
+            return 0
+        
+        rows = db.session.query(
+            ChatMessage.id, ChatMessage.session_id, ChatMessage.content
+        ).filter(
+            ChatMessage.user_id == user_id,
+            ChatMessage.is_bot.is_(False)
+        ).order_by(ChatMessage.id.asc()).yield_per(1000)
+        
+        return retrieval_index.load_user(user_id, rows)
+    
+    @staticmethod
+    def search_user_history(user_id: int, query: str, top_k: int = 3,
+                            exclude_session_id: Optional[int] = None) -> List[ChatMessage]:
+        """
+        Busca en los mensajes pasados del usuario (todas sus sesiones) con BM25
+        
+        Args:
+            user_id: ID del usuario
+            query: Texto de la consulta
+            top_k: Número máximo de mensajes
+            exclude_session_id: Sesión a omitir (normalmente la actual)
+            
+        Returns:
+            List of ChatMessage objects ordenados por relevancia
+        """
+        try:
+            if not retrieval_index.has_user(user_id):
+                MessageService.rebuild_retrieval_index(user_id)
+            
+            hits = retrieval_index.search(user_id, query, top_k, exclude_session_id)
+            if not hits:
+                return []
+            
+            ids = [doc_id for doc_id, _, _ in hits]
+            by_id = {m.id: m for m in ChatMessage.query.filter(ChatMessage.id.in_(ids)).all()}
+            return [by_id[doc_id] for doc_id in ids if doc_id in by_id]
+        except Exception as e:
+            print(f"Error searching user history: {str(e)}")
+            return []
+    
+    @staticmethod
+    def iter_new_messages(watermarks: Dict[int, int], sessions_per_chunk: int = 200) -> Iterator[Tuple[Dict[int, int], list]]:
+        """
+        Recorre los mensajes posteriores a la marca de agua de cada sesión
+        
+        La marca de agua es el seq por sesión, no un ID global: los IDs se
+        reparten por bloques entre procesos y un mensaje confirmado más tarde
+        puede tener un ID menor que otro ya recorrido. Las sesiones se leen
+        por bloques (paginación keyset por ID de sesión) y de cada una solo
+        los mensajes con seq mayor que su marca, si Session.last_seq indica
+        que hay alguno.
+        
+        Args:
+            watermarks: {session_id: último seq recorrido}
+            sessions_per_chunk: Sesiones por consulta
+            
+        Yields:
+            Tuplas (marcas nuevas {session_id: seq} del bloque, filas
+            (id, session_id, seq, user_id, content, is_bot) en orden de sesión y seq)
+        """
+        last_session_id = 0
+        while True:
+            sessions = db.session.query(Session.id, Session.last_seq).filter(
+                Session.id > last_session_id
+            ).order_by(Session.id.asc()).limit(sessions_per_chunk).all()
+            if not sessions:
+                return
+            last_session_id = sessions[-1].id
+            
+            # last_seq se actualiza en la transacción de los mensajes: todos los
+            # mensajes hasta él ya están confirmados (o archivados) al leerlos
+            marks = {
+                session.id: session.last_seq for session in sessions
+                if session.last_seq > watermarks.get(session.id, 0)
+            }
+            if marks:
+                rows = db.session.query(
+                    ChatMessage.id, ChatMessage.session_id, ChatMessage.seq, ChatMessage.user_id,
+                    ChatMessage.content, ChatMessage.is_bot
+                ).filter(or_(*(
+                    and_(ChatMessage.session_id == session_id, ChatMessage.seq > watermarks.get(session_id, 0))
+                    for session_id in marks
+                ))).order_by(ChatMessage.session_id.asc(), ChatMessage.seq.asc()).all()
+                for row in rows:
+                    marks[row.session_id] = max(marks[row.session_id], row.seq)
+                yield marks, rows
+            
+            if len(sessions) < sessions_per_chunk:
+                return
+    
+    @staticmethod
+    def iter_export_rows(bounds: Dict[int, int], since: Optional[datetime] = None,
+                         until: Optional[datetime] = None, batch_size: int = 1000) -> Iterator[list]:
+        """
+        Recorre los mensajes de varias sesiones con los datos de la sesión y del usuario para exportar
+        
+        Una sola consulta en orden de sesión y seq leída por bloques con
+        yield_per (cursor del lado del servidor cuando el driver lo soporta):
+        la memoria no depende del número de mensajes.
+        
+        Args:
+            bounds: {session_id: seq ya exportado}; solo mensajes con seq mayor
+                (hasta unas 200 sesiones por llamada)
+            since: Solo mensajes creados desde esta fecha (inclusive)
+            until: Solo mensajes creados antes de esta fecha
+            batch_size: Filas por bloque
+            
+        Yields:
+            Listas de filas (id, session_id, title, user_id, username, seq, is_bot, content, created_at)
+        """
+        if not bounds:
+            return
+        query = db.session.query(
+            ChatMessage.id, ChatMessage.session_id, Session.title, ChatMessage.user_id,
+            User.username, ChatMessage.seq, ChatMessage.is_bot, ChatMessage.content, ChatMessage.created_at
+        ).join(Session, Session.id == ChatMessage.session_id).join(
+            User, User.id == ChatMessage.user_id
+        ).filter(or_(*(
+            and_(ChatMessage.session_id == session_id, ChatMessage.seq > seq) for session_id, seq in bounds.items()
+        )))
+        if since is not None:
+            query = query.filter(ChatMessage.created_at >= since)
+        if until is not None:
+            query = query.filter(ChatMessage.created_at < until)
+        
+        # yield_per activa stream_results y entrega las filas en particiones
+        statement = query.order_by(
+            ChatMessage.session_id.asc(), ChatMessage.seq.asc()
+        ).statement.execution_options(yield_per=batch_size)
+        for partition in db.session.execute(statement).partitions():
+            yield partition
+
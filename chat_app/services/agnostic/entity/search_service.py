@@ -0,0 +1,125 @@
+import html
+import re
+from typing import List, Optional, Tuple
+from sqlalchemy import text
+from models import db
+from models.message_search import SEARCH_TABLE, rebuild_search_index
+
+# Marcas de los términos encontrados dentro del fragmento: caracteres de control
+# que no aparecen en el texto, para escapar el contenido antes de poner <mark>
+_MATCH_START = '\x02'
+_MATCH_END = '\x03'
+
+_TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchService:
+    """
+    Servicio de Entidad para la búsqueda de texto completo en mensajes (Agnóstico)
+    """
+
+    @staticmethod
+    def build_match_query(query: str) -> Optional[str]:
+        """
+        Convierte el texto del usuario en una consulta FTS5 segura
+
+        Cada palabra se pasa entre comillas (sin operadores ni sintaxis FTS5)
+        y deben aparecer todas; la última busca también por prefijo, para
+        resultados mientras se escribe.
+
+        Args:
+            query: Texto libre de la búsqueda
+
+        Returns:
+            Expresión MATCH, o None si el texto no tiene palabras
+        """
+        terms = _TERM_PATTERN.findall(query or '')
+        if not terms:
+            return None
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += '*'
+        return ' '.join(quoted)
+
+    @staticmethod
+    def search_messages(user_id: int, query: str, session_id: Optional[int] = None, limit: int = 20,
+                        offset: int = 0, snippet_tokens: int = 12) -> Tuple[List[dict], bool]:
+        """
+        Busca en los mensajes de un usuario ordenando por relevancia (BM25)
+
+        Args:
+            user_id: ID del usuario
+            query: Texto de la búsqueda
+            session_id: Limitar a una conversación
+            limit: Resultados por página
+            offset: Resultados a saltar
+            snippet_tokens: Palabras del fragmento alrededor de los términos
+
+        Returns:
+            Tupla (resultados, hay más resultados)
+        """
+        match = SearchService.build_match_query(query)
+        if match is None:
+            return [], False
+
+        try:
+            sql = (
+                f"SELECT m.id, m.session_id, m.seq, m.is_bot, m.created_at, s.title AS session_title, "
+                f"snippet({SEARCH_TABLE}, 0, :mark_start, :mark_end, '…', :tokens) AS snippet, "
+                f"bm25({SEARCH_TABLE}) AS score "
+                f"FROM {SEARCH_TABLE} "
+                f"JOIN chat_messages m ON m.id = {SEARCH_TABLE}.rowid "
+                f"JOIN sessions s ON s.id = m.session_id "
+                f"WHERE {SEARCH_TABLE} MATCH :match AND m.user_id = :user_id"
+            )
+            params = {
+                'match': match, 'user_id': user_id, 'tokens': snippet_tokens,
+                'mark_start': _MATCH_START, 'mark_end': _MATCH_END,
+                'limit': limit + 1, 'offset': offset
+            }
+            if session_id is not None:
+                sql += " AND m.session_id = :session_id"
+                params['session_id'] = session_id
+            # bm25 es menor cuanto más relevante; a igual relevancia, el más reciente
+            sql += " ORDER BY score ASC, m.id DESC LIMIT :limit OFFSET :offset"
+
+            rows = db.session.execute(text(sql).columns(created_at=db.DateTime), params).all()
+        except Exception as e:
+            print(f"Error searching messages: {str(e)}")
+            db.session.rollback()
+            return [], False
+
+        has_more = len(rows) > limit
+        results = [
+            {
+                'message_id': row.id,
+                'session_id': row.session_id,
+                'session_title': row.session_title,
+                'seq': row.seq,
+                'is_bot': bool(row.is_bot),
+                'created_at': row.created_at.isoformat(),
+                'snippet': SearchService._highlight(row.snippet),
+                'score': round(-row.score, 6)
+            }
+            for row in rows[:limit]
+        ]
+        return results, has_more
+
+    @staticmethod
+    def rebuild_index() -> int:
+        """
+        Reconstruye el índice de búsqueda desde chat_messages
+
+        Returns:
+            Número de mensajes indexados, o -1 si hubo error
+        """
+        try:
+            with db.engine.begin() as connection:
+                return rebuild_search_index(connection)
+        except Exception as e:
+            print(f"Error rebuilding search index: {str(e)}")
+            return -1
+
+    @staticmethod
+    def _highlight(snippet: str) -> str:
+        """Escapa el fragmento para HTML y marca los términos con <mark>"""
+        return html.escape(snippet or '').replace(_MATCH_START, '<mark>').replace(_MATCH_END, '</mark>')
@@ -0,0 +1,56 @@
+from typing import Optional
+from models import db, SessionSummary
+
+class SummaryService:
+    """
+    Servicio de Entidad para los resúmenes de sesión (Agnóstico)
+    """
+    
+    @staticmethod
+    def get_summary(session_id: int) -> Optional[SessionSummary]:
+        """
+        Obtiene el resumen acumulado de una sesión
+        
+        Args:
+            session_id: ID de la sesión
+            
+        Returns:
+            SessionSummary o None si la sesión aún no tiene resumen
+        """
+        try:
+            return SessionSummary.query.filter_by(session_id=session_id).first()
+        except Exception as e:
+            print(f"Error getting summary: {str(e)}")
+            return None
+    
+    @staticmethod
+    def save_summary(session_id: int, summary: str, covered_seq: int, added_count: int) -> Optional[SessionSummary]:
+        """
+        Crea o actualiza el resumen de una sesión
+        
+        Args:
+            session_id: ID de la sesión
+            summary: Texto del resumen
+            covered_seq: seq del último mensaje incorporado al resumen
+            added_count: Mensajes incorporados en esta actualización
+            
+        Returns:
+            SessionSummary actualizado o None si hay error
+        """
+        try:
+            record = SessionSummary.query.filter_by(session_id=session_id).first()
+            if not record:
+                record = SessionSummary(session_id=session_id, covered_count=0)
+                db.session.add(record)
+            
+            record.summary = summary
+            record.covered_seq = covered_seq
+            record.covered_count = (record.covered_count or 0) + added_count
+            db.session.commit()
+            
+            return record
+            
+        except Exception as e:
+            print(f"Error saving summary: {str(e)}")
+            db.session.rollback()
+            return None
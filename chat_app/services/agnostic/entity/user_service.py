@@ -1,7 +1,17 @@
-from typing import Optional
-from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import insert
 from models import db, User
 from dtos import UserDTO, CredentialsDTO
+from services.agnostic.utility.retrieval_index import retrieval_index
+from services.agnostic.utility.identity_cache import identity_cache, UserRecord
+from services.agnostic.utility.session_tokens import session_tokens
+from services.agnostic.utility.event_log import event_log
+from utils.password_hasher import PasswordHasherBusy, password_hasher
+
+# Valores por consulta IN (límite de parámetros de SQLite)
+_LOOKUP_CHUNK = 500
+
 
 class UserService:
     """
@@ -45,6 +55,9 @@ class UserService:
             # Convertir a DTO
             return UserService._user_to_dto(new_user)
             
+        except PasswordHasherBusy:
+            db.session.rollback()
+            raise
         except Exception as e:
             db.session.rollback()
             print(f"Error al crear usuario: {str(e)}")
@@ -67,6 +80,30 @@ class UserService:
         
         return UserService._user_to_dto(user)
     
+    @staticmethod
+    def get_user_identity(user_id: int) -> Optional[UserRecord]:
+        """
+        Obtiene el registro mínimo del usuario (ID y estado) desde la caché
+        
+        Es la consulta del camino caliente: validar que el usuario existe y
+        está activo antes de procesar un mensaje.
+        
+        Args:
+            user_id: ID del usuario
+        
+        Returns:
+            UserRecord o None si no existe
+        """
+        return identity_cache.get_or_load('user', user_id, UserService.load_user_identity)
+    
+    @staticmethod
+    def load_user_identity(user_id: int) -> Optional[UserRecord]:
+        """Lee de la BD solo las columnas del UserRecord (sin caché)"""
+        row = db.session.query(
+            User.id, User.is_active, User.token_version, User.tenant_id
+        ).filter(User.id == user_id).first()
+        return UserRecord(row.id, bool(row.is_active), row.token_version or 0, row.tenant_id) if row else None
+    
     @staticmethod
     def get_user_by_username(username: str) -> Optional[UserDTO]:
         """
@@ -101,14 +138,21 @@ class UserService:
             if not user:
                 return None
             
+            was_active = user.is_active
+            
             # Actualizar campos
             if update_data.username:
                 user.username = update_data.username
             if update_data.email:
                 user.email = update_data.email
             user.is_active = update_data.is_active
+            if was_active and not user.is_active:
+                # Los tokens emitidos mientras estaba activo dejan de valer (en todos los workers)
+                user.token_version = (user.token_version or 0) + 1
             
             db.session.commit()
+            identity_cache.invalidate('user', user_id)
+            session_tokens.revoke(user_id)
             
             return UserService._user_to_dto(user)
             
@@ -117,6 +161,32 @@ class UserService:
             print(f"Error al actualizar usuario: {str(e)}")
             return None
     
+    @staticmethod
+    def set_tenant(user_id: int, tenant_id: Optional[str]) -> bool:
+        """
+        Asigna el tenant del usuario (su adaptador LoRA); lo decide el servidor, nunca la petición
+        
+        Args:
+            user_id: ID del usuario
+            tenant_id: Tenant (None = modelo base)
+        
+        Returns:
+            True si el usuario existe
+        """
+        try:
+            user = User.query.get(user_id)
+            if not user:
+                return False
+            user.tenant_id = tenant_id
+            db.session.commit()
+            identity_cache.invalidate('user', user_id)
+            session_tokens.revoke(user_id)
+            return True
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error al asignar tenant: {str(e)}")
+            return False
+    
     @staticmethod
     def delete_user(user_id: int) -> bool:
         """
@@ -135,6 +205,10 @@ class UserService:
             
             db.session.delete(user)
             db.session.commit()
+            identity_cache.invalidate('user', user_id)
+            session_tokens.revoke(user_id)
+            retrieval_index.remove_user(user_id)
+            event_log.append([{'type': 'user.deleted', 'user_id': user_id}])
             
             return True
             
@@ -148,22 +222,105 @@ class UserService:
         """
         Autentica usuario con credenciales
         
+        La verificación corre en el pool de hashing (también para usuarios
+        inexistentes, para no revelarlos por el tiempo de respuesta). Si el
+        hash guardado usa otros parámetros de costo se reemplaza por uno con
+        los actuales, ya que aquí se conoce la contraseña.
+        
         Args:
             credentials: DTO con username y password
         
         Returns:
             UserDTO si la autenticación es exitosa, None si falla
+            
+        Raises:
+            PasswordHasherBusy: Si el pool de hashing está saturado
         """
         user = User.query.filter_by(username=credentials.username).first()
         
         if not user or not user.is_active:
+            password_hasher.verify(None, credentials.password)
             return None
         
-        if not check_password_hash(user.password_hash, credentials.password):
+        if not password_hasher.verify(user.password_hash, credentials.password):
             return None
         
+        if password_hasher.needs_rehash(user.password_hash):
+            try:
+                user.set_password(credentials.password)
+                db.session.commit()
+                password_hasher.count_rehash()
+            except Exception as e:
+                # El login sigue siendo válido; se reintenta en el próximo
+                db.session.rollback()
+                print(f"Error al actualizar hash de contraseña: {str(e)}")
+        
         return UserService._user_to_dto(user)
     
+    @staticmethod
+    def find_existing(usernames: Iterable[str], emails: Iterable[str]) -> Tuple[Set[str], Set[str]]:
+        """
+        Busca qué nombres de usuario y emails ya están registrados
+        
+        Una consulta por columna y bloque de valores (en lugar de una por usuario).
+        
+        Args:
+            usernames: Nombres de usuario a comprobar
+            emails: Emails a comprobar
+        
+        Returns:
+            Tupla (nombres de usuario existentes, emails existentes)
+        """
+        found = []
+        for column, values in ((User.username, list(usernames)), (User.email, list(emails))):
+            existing = set()
+            for start in range(0, len(values), _LOOKUP_CHUNK):
+                existing.update(
+                    value for (value,) in db.session.query(column).filter(
+                        column.in_(values[start:start + _LOOKUP_CHUNK])
+                    )
+                )
+            found.append(existing)
+        return found[0], found[1]
+    
+    @staticmethod
+    def insert_users(rows: List[Dict]) -> Optional[Dict[str, int]]:
+        """
+        Inserta usuarios con el hash de contraseña ya calculado, en una transacción
+        
+        Args:
+            rows: Diccionarios con username, email, password_hash e is_active
+        
+        Returns:
+            {username: id} de los usuarios creados, o None si la transacción falló
+            (p. ej. un usuario registrado a la vez por otra vía); no se crea ninguno
+        """
+        if not rows:
+            return {}
+        now = datetime.utcnow()
+        try:
+            result = db.session.execute(
+                insert(User.__table__).returning(User.__table__.c.id, User.__table__.c.username),
+                [
+                    {
+                        'username': row['username'],
+                        'email': row['email'],
+                        'password_hash': row['password_hash'],
+                        'is_active': row['is_active'],
+                        'created_at': now,
+                        'updated_at': now
+                    }
+                    for row in rows
+                ]
+            )
+            created = {username: user_id for user_id, username in result}
+            db.session.commit()
+            return created
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error al insertar usuarios: {str(e)}")
+            return None
+    
     @staticmethod
     def _user_to_dto(user: User) -> UserDTO:
         """Convierte modelo User a UserDTO"""
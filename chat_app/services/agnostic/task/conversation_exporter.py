@@ -0,0 +1,397 @@
+import heapq
+import json
+import os
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from typing import Dict, Iterator, List, Optional, Tuple
+from services.agnostic.entity.archive_service import ArchiveService
+from services.agnostic.entity.conversation_service import ConversationService
+from services.agnostic.entity.message_service import MessageService
+from utils.logger import logger
+
+EXPORT_FORMATS = ('ndjson', 'parquet')
+
+# Columnas de cada fila exportada (un mensaje con los datos de su sesión y usuario)
+EXPORT_COLUMNS = (
+    'message_id', 'session_id', 'session_title', 'user_id', 'username',
+    'seq', 'is_bot', 'content', 'created_at', 'archived'
+)
+
+
+def _parquet_schema():
+    """Esquema de Arrow de EXPORT_COLUMNS (pyarrow se importa solo si se usa)"""
+    import pyarrow as pa
+
+    return pa.schema([
+        ('message_id', pa.int64()),
+        ('session_id', pa.int64()),
+        ('session_title', pa.string()),
+        ('user_id', pa.int64()),
+        ('username', pa.string()),
+        ('seq', pa.int64()),
+        ('is_bot', pa.bool_()),
+        ('content', pa.string()),
+        ('created_at', pa.timestamp('us')),
+        ('archived', pa.bool_()),
+    ])
+
+
+class _ByteSink:
+    """Destino de escritura en memoria que se vacía después de cada grupo de filas"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class ConversationExporter:
+    """
+    Task Service: Exportación masiva de conversaciones (NDJSON / Parquet)
+
+    Recorre las sesiones en orden de ID y los mensajes de cada una en orden
+    de seq, mezclando los de la tabla (leídos con un cursor por bloques) con
+    los archivados de la sesión, así que la memoria no depende del tamaño de
+    la exportación. Cada bloque se escribe en cuanto se lee: una línea por
+    mensaje en NDJSON o un row group en Parquet.
+
+    La posición de la exportación es {'after_session', 'after_seq', 'sessions'}:
+    la sesión y el seq del último mensaje escrito y, por sesión, el seq hasta
+    el cual ya se exportó. Los IDs de mensaje no sirven de posición (se
+    reservan por bloques y se confirman fuera de orden, y una sesión
+    archivada o restaurada cambia de lugar); el seq de cada sesión sí. Con la
+    posición se reanuda una exportación interrumpida y, desde un checkpoint
+    terminado, se agregan solo los mensajes nuevos de cada sesión.
+    """
+
+    def __init__(self, user_id: Optional[int] = None, since: Optional[datetime] = None,
+                 until: Optional[datetime] = None, batch_size: int = 1000, include_archived: bool = True):
+        """
+        Args:
+            user_id: Solo mensajes de este usuario
+            since: Solo mensajes creados desde esta fecha (inclusive)
+            until: Solo mensajes creados antes de esta fecha
+            batch_size: Mensajes por bloque (y por row group en Parquet)
+            include_archived: Incluir las sesiones archivadas
+        """
+        self.user_id = user_id
+        self.since = since
+        self.until = until
+        self.batch_size = batch_size
+        self.include_archived = include_archived
+
+    def iter_batches(self, position: Optional[Dict] = None) -> Iterator[Tuple[List[tuple], Dict]]:
+        """
+        Recorre los mensajes a exportar por bloques
+
+        Requiere un contexto con acceso a la BD.
+
+        Args:
+            position: Posición desde la cual reanudar (None = desde el principio)
+
+        Yields:
+            Tuplas (filas con las columnas de EXPORT_COLUMNS, posición después del bloque).
+            La posición es válida hasta pedir el bloque siguiente; el último bloque
+            (quizás vacío) trae la posición de la exportación terminada.
+        """
+        position = position or {}
+        marks: Dict[str, int] = dict(position.get('sessions') or {})
+        cursor = {
+            'after_session': position.get('after_session', 0),
+            'after_seq': position.get('after_seq', 0),
+            'sessions': marks
+        }
+        start_session, start_seq = cursor['after_session'], cursor['after_seq']
+        rows: List[tuple] = []
+
+        for sessions in ConversationService.iter_session_chunks(self.user_id, start_session):
+            bounds = {}
+            for session in sessions:
+                bound = start_seq if session.id == start_session else marks.get(str(session.id), 0)
+                if session.last_seq > bound:
+                    bounds[session.id] = bound
+            if not bounds:
+                continue
+
+            live = groupby(self._live_rows(bounds), key=itemgetter(1))
+            live_session, live_rows = next(live, (None, None))
+            for session in sessions:
+                if session.id not in bounds:
+                    continue
+                session_rows = live_rows if session.id == live_session else iter(())
+                if session.archived:
+                    archived_rows = self._archived_rows(session, bounds[session.id])
+                    session_rows = heapq.merge(archived_rows, session_rows, key=itemgetter(5))
+
+                key = str(session.id)
+                # Mientras la sesión está a medias la posición la marca after_session/after_seq
+                marks[key] = session.last_seq
+                for row in session_rows:
+                    rows.append(row)
+                    cursor['after_session'], cursor['after_seq'] = session.id, row[5]
+                    if row[5] > marks[key]:
+                        marks[key] = row[5]
+                    if len(rows) >= self.batch_size:
+                        yield rows, cursor
+                        rows = []
+                # El grupo de groupby se consume antes de avanzar a la sesión siguiente
+                if session.id == live_session:
+                    live_session, live_rows = next(live, (None, None))
+
+        # Terminada: todas las sesiones quedan cubiertas por su seq
+        cursor['after_session'] = cursor['after_seq'] = 0
+        yield rows, cursor
+
+    def _live_rows(self, bounds: Dict[int, int]) -> Iterator[tuple]:
+        """Mensajes de la tabla de las sesiones de `bounds`, en orden de sesión y seq"""
+        for partition in MessageService.iter_export_rows(bounds, self.since, self.until, self.batch_size):
+            for row in partition:
+                yield tuple(row) + (False,)
+
+    def _archived_rows(self, session, after_seq: int) -> Iterator[tuple]:
+        """Mensajes archivados de una sesión posteriores a `after_seq`, en orden de seq"""
+        if not self.include_archived:
+            return
+        for message_id, seq, author_id, content, is_bot, created_at in ArchiveService.get_archived_messages(session.id):
+            if seq <= after_seq:
+                continue
+            created_at = datetime.fromisoformat(created_at)
+            if (self.since and created_at < self.since) or (self.until and created_at >= self.until):
+                continue
+            yield (message_id, session.id, session.title, author_id, session.username, seq,
+                   is_bot, content, created_at, True)
+
+    def stream(self, export_format: str, position: Optional[Dict] = None) -> Iterator[bytes]:
+        """
+        Genera la exportación como bytes, bloque por bloque (para respuestas HTTP)
+
+        Args:
+            export_format: 'ndjson' o 'parquet'
+            position: Posición desde la cual reanudar
+
+        Yields:
+            Fragmentos del archivo exportado
+        """
+        if export_format == 'ndjson':
+            for rows, _ in self.iter_batches(position):
+                if rows:
+                    yield self._ndjson_lines(rows)
+            return
+
+        import pyarrow.parquet as pq
+
+        sink = _ByteSink()
+        writer = pq.ParquetWriter(sink, _parquet_schema(), compression='zstd')
+        try:
+            for rows, _ in self.iter_batches(position):
+                if rows:
+                    writer.write_table(self._arrow_table(rows))
+                    yield sink.drain()
+        finally:
+            # Pie del archivo Parquet (metadatos de los row groups)
+            writer.close()
+        yield sink.drain()
+
+    def export_to_path(self, export_format: str, output: str, resume: bool = False,
+                       checkpoint_rows: int = 50000, rows_per_file: int = 1000000) -> Dict:
+        """
+        Exporta a disco con checkpoints para poder reanudar
+
+        NDJSON se escribe en un solo archivo; el checkpoint guarda la posición
+        y los bytes ya escritos, y al reanudar se trunca lo posterior.
+        Parquet se escribe como directorio de partes (`part-NNNNN.parquet`);
+        el checkpoint se guarda al cerrar cada parte y al reanudar se descarta
+        la parte incompleta.
+
+        Requiere un contexto con acceso a la BD.
+
+        Args:
+            export_format: 'ndjson' o 'parquet'
+            output: Archivo (NDJSON) o directorio (Parquet) de salida
+            resume: Continuar desde el checkpoint de `output` si existe
+            checkpoint_rows: Filas entre checkpoints (NDJSON)
+            rows_per_file: Filas por parte (Parquet)
+
+        Returns:
+            Resumen (filas totales, filas de esta ejecución, posición final, archivos)
+        """
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Formato inválido: {export_format!r} (use {', '.join(EXPORT_FORMATS)})")
+
+        checkpoint_path = self._checkpoint_path(export_format, output)
+        checkpoint = None
+        if resume and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            problem = self._checkpoint_problem(export_format, output, checkpoint)
+            if problem:
+                logger.warning(f"No se puede reanudar la exportación ({problem}): se empieza de nuevo")
+                checkpoint = None
+            else:
+                position = checkpoint['position']
+                logger.info(
+                    f"Reanudando exportación desde la sesión {position['after_session']}, "
+                    f"seq {position['after_seq']} ({checkpoint['rows']} filas)"
+                )
+
+        if export_format == 'ndjson':
+            result = self._export_ndjson(output, checkpoint_path, checkpoint, checkpoint_rows)
+        else:
+            result = self._export_parquet(output, checkpoint_path, checkpoint, rows_per_file)
+        result['resumed'] = checkpoint is not None
+        return result
+
+    def _export_ndjson(self, output: str, checkpoint_path: str, checkpoint: Optional[Dict],
+                       checkpoint_rows: int) -> Dict:
+        position = checkpoint['position'] if checkpoint else None
+        total = checkpoint['rows'] if checkpoint else 0
+        written = since_checkpoint = 0
+
+        with open(output, 'r+b' if checkpoint else 'wb') as f:
+            if checkpoint:
+                # Descartar lo escrito después del último checkpoint
+                f.truncate(checkpoint['bytes'])
+                f.seek(checkpoint['bytes'])
+            for rows, position in self.iter_batches(position):
+                if rows:
+                    f.write(self._ndjson_lines(rows))
+                    written += len(rows)
+                    since_checkpoint += len(rows)
+                if since_checkpoint >= checkpoint_rows:
+                    self._save_checkpoint(checkpoint_path, f, position, total + written)
+                    since_checkpoint = 0
+            if position is not None:
+                self._save_checkpoint(checkpoint_path, f, position, total + written, done=True)
+
+        return {'rows': total + written, 'written': written, 'position': position, 'files': [output]}
+
+    def _export_parquet(self, output: str, checkpoint_path: str, checkpoint: Optional[Dict],
+                        rows_per_file: int) -> Dict:
+        import pyarrow.parquet as pq
+
+        os.makedirs(output, exist_ok=True)
+        position = checkpoint['position'] if checkpoint else None
+        total = checkpoint['rows'] if checkpoint else 0
+        parts: List[str] = list(checkpoint['parts']) if checkpoint else []
+        # Partes que no llegaron al checkpoint (exportación interrumpida)
+        for name in os.listdir(output):
+            if name.startswith('part-') and name.endswith('.parquet') and name not in parts:
+                os.remove(os.path.join(output, name))
+
+        schema = _parquet_schema()
+        writer = None
+        part_rows = written = 0
+        last_position = position
+        try:
+            for rows, last_position in self.iter_batches(position):
+                if not rows:
+                    continue
+                if writer is None:
+                    name = f"part-{len(parts):05d}.parquet"
+                    writer = pq.ParquetWriter(os.path.join(output, name), schema, compression='zstd')
+                writer.write_table(self._arrow_table(rows))
+                part_rows += len(rows)
+                written += len(rows)
+                if part_rows >= rows_per_file:
+                    writer.close()
+                    writer = None
+                    parts.append(name)
+                    part_rows = 0
+                    self._save_part_checkpoint(checkpoint_path, last_position, total + written, parts)
+        finally:
+            if writer is not None:
+                writer.close()
+                parts.append(name)
+        if last_position is not None:
+            self._save_part_checkpoint(checkpoint_path, last_position, total + written, parts, done=True)
+
+        return {
+            'rows': total + written, 'written': written, 'position': last_position,
+            'files': [os.path.join(output, name) for name in parts]
+        }
+
+    @staticmethod
+    def _checkpoint_problem(export_format: str, output: str, checkpoint: Dict) -> Optional[str]:
+        """Motivo por el cual el checkpoint no sirve para reanudar (None si sirve)"""
+        if 'sessions' not in checkpoint.get('position', {}):
+            return "checkpoint de una versión anterior"
+        if export_format == 'ndjson':
+            if not os.path.exists(output):
+                return f"falta {output}"
+            if os.path.getsize(output) < checkpoint['bytes']:
+                return f"{output} es más corto que el checkpoint"
+            return None
+        missing = [name for name in checkpoint['parts'] if not os.path.exists(os.path.join(output, name))]
+        if missing:
+            return f"faltan {', '.join(missing)}"
+        return None
+
+    @staticmethod
+    def _ndjson_lines(rows: List[tuple]) -> bytes:
+        lines = []
+        for row in rows:
+            record = dict(zip(EXPORT_COLUMNS, row))
+            record['is_bot'] = bool(record['is_bot'])
+            record['created_at'] = record['created_at'].isoformat()
+            lines.append(json.dumps(record, ensure_ascii=False))
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+    @staticmethod
+    def _arrow_table(rows: List[tuple]):
+        import pyarrow as pa
+
+        schema = _parquet_schema()
+        columns = list(zip(*rows))
+        return pa.Table.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+            schema=schema
+        )
+
+    @staticmethod
+    def _checkpoint_path(export_format: str, output: str) -> str:
+        if export_format == 'parquet':
+            return os.path.join(output, 'checkpoint.json')
+        return output + '.checkpoint.json'
+
+    @staticmethod
+    def _write_checkpoint(path: str, state: Dict):
+        """Escribe el checkpoint de forma atómica"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _save_checkpoint(path: str, handle, position: Dict, rows: int, done: bool = False):
+        # Los datos deben estar en disco antes que el checkpoint que los cubre
+        handle.flush()
+        os.fsync(handle.fileno())
+        ConversationExporter._write_checkpoint(path, {
+            'position': position, 'rows': rows, 'bytes': handle.tell(), 'done': done
+        })
+
+    @staticmethod
+    def _save_part_checkpoint(path: str, position: Dict, rows: int, parts: List[str], done: bool = False):
+        ConversationExporter._write_checkpoint(path, {
+            'position': position, 'rows': rows, 'parts': parts, 'done': done
+        })
@@ -0,0 +1,138 @@
+import queue
+import threading
+from typing import Callable, Optional, Set
+from services.agnostic.entity.message_service import MessageService
+from services.agnostic.entity.summary_service import SummaryService
+from services.agnostic.utility.text_utils import TextUtils
+from utils.logger import logger
+
+class ConversationSummarizer:
+    """
+    Task Service: Resumen incremental de conversaciones en segundo plano
+
+    Los turnos que salen de la ventana reciente se incorporan al resumen de la
+    sesión en un hilo aparte, nunca en el camino de la petición. Las sesiones
+    pendientes se deduplican: una sesión programada varias veces se resume una vez.
+    """
+
+    def __init__(self, context_factory: Callable, recent_window: int = 6,
+                 max_sentences: int = 5, max_chars: int = 500):
+        """
+        Inicializa el resumidor
+
+        Args:
+            context_factory: Callable que devuelve un context manager con acceso a la BD
+                (p. ej. app.app_context)
+            recent_window: Turnos recientes que se envían sin resumir al modelo
+            max_sentences: Oraciones máximas del resumen
+            max_chars: Longitud máxima del resumen
+        """
+        self.context_factory = context_factory
+        self.recent_window = recent_window
+        self.max_sentences = max_sentences
+        self.max_chars = max_chars
+
+        self._queue: "queue.Queue[Optional[int]]" = queue.Queue()
+        self._pending: Set[int] = set()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    def schedule(self, session_id: int) -> bool:
+        """
+        Programa la actualización del resumen de una sesión
+
+        Args:
+            session_id: ID de la sesión
+
+        Returns:
+            True si se encoló, False si ya estaba pendiente
+        """
+        with self._lock:
+            if session_id in self._pending:
+                return False
+            self._pending.add(session_id)
+            self._ensure_worker()
+
+        self._queue.put(session_id)
+        return True
+
+    def is_stale(self, summary, newest_aged_out_seq: Optional[int]) -> bool:
+        """
+        Indica si el resumen no cubre todos los turnos fuera de la ventana reciente
+
+        Args:
+            summary: SessionSummary actual (o None)
+            newest_aged_out_seq: seq del mensaje más reciente fuera de la ventana
+        """
+        if newest_aged_out_seq is None:
+            return False
+        covered = summary.covered_seq if summary else 0
+        return covered < newest_aged_out_seq
+
+    def summarize_session(self, session_id: int) -> bool:
+        """
+        Incorpora al resumen los turnos que salieron de la ventana reciente
+
+        Requiere un contexto con acceso a la BD.
+
+        Args:
+            session_id: ID de la sesión
+
+        Returns:
+            True si el resumen se actualizó
+        """
+        recent = MessageService.get_recent_messages(session_id, self.recent_window)
+        if len(recent) < self.recent_window:
+            return False
+
+        summary = SummaryService.get_summary(session_id)
+        covered_seq = summary.covered_seq if summary else 0
+        aged_out = MessageService.get_messages_in_range(session_id, covered_seq, recent[0].seq)
+        if not aged_out:
+            return False
+
+        texts = ([summary.summary] if summary and summary.summary else []) + [m.content for m in aged_out]
+        new_summary = TextUtils.extractive_summary(texts, self.max_sentences, self.max_chars)
+
+        saved = SummaryService.save_summary(
+            session_id=session_id,
+            summary=new_summary,
+            covered_seq=aged_out[-1].seq,
+            added_count=len(aged_out)
+        )
+        if saved:
+            logger.debug(f"Resumen actualizado - Session ID: {session_id}, mensajes: {len(aged_out)}")
+        return saved is not None
+
+    def stop(self, timeout: float = 5.0):
+        """Detiene el hilo de trabajo tras procesar lo pendiente"""
+        worker = self._worker
+        if worker and worker.is_alive():
+            self._queue.put(None)
+            worker.join(timeout)
+
+    def _ensure_worker(self):
+        """Arranca el hilo de trabajo la primera vez que se necesita"""
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(
+                target=self._run,
+                name="conversation-summarizer",
+                daemon=True
+            )
+            self._worker.start()
+
+    def _run(self):
+        """Bucle del hilo de trabajo"""
+        while True:
+            session_id = self._queue.get()
+            if session_id is None:
+                return
+
+            with self._lock:
+                self._pending.discard(session_id)
+
+            try:
+                with self.context_factory():
+                    self.summarize_session(session_id)
+            except Exception as e:
+                logger.error(f"Error resumiendo sesión {session_id}: {str(e)}", exc_info=True)
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Dict
+from services.agnostic.entity.message_service import MessageService
+from utils.logger import logger
+
+MANIFEST_FILENAME = "manifest.json"
+HASH_INDEX_FILENAME = "seen_hashes.sqlite"
+
+class CorpusBuilder:
+    """
+    Task Service: Corpus de fine-tuning incremental a partir de las conversaciones
+
+    Cada ejecución recorre solo los mensajes posteriores a la marca de agua
+    guardada (el último seq recorrido de cada sesión), arma pares (mensaje del usuario, respuesta del bot) de la misma
+    sesión, descarta pares repetidos por hash de contenido y agrega un shard
+    JSONL nuevo como versión siguiente del dataset. Cada línea tiene el campo
+    `dialog` (lista de turnos) igual que daily_dialog, así que
+    `DialoGPTService.prepare_dataset(<directorio>)` lo lee directamente.
+
+    Estructura en disco:
+        <output_dir>/manifest.json        versión, marcas de agua por sesión, shards
+        <output_dir>/shard-00001.jsonl    pares de la versión 1
+        <output_dir>/seen_hashes.sqlite   hashes ya incluidos y versión que los agregó (deduplicación)
+    """
+
+    def __init__(self, output_dir: str, chunk_size: int = 200):
+        """
+        Args:
+            output_dir: Directorio del dataset versionado
+            chunk_size: Sesiones leídas por consulta
+        """
+        self.output_dir = output_dir
+        self.chunk_size = chunk_size
+
+    def load_manifest(self) -> Dict:
+        """Lee el manifiesto (o uno vacío si el dataset aún no existe)"""
+        path = os.path.join(self.output_dir, MANIFEST_FILENAME)
+        if not os.path.exists(path):
+            return {'version': 0, 'watermarks': {}, 'total_pairs': 0, 'shards': [], 'pending': {}}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def build(self) -> Dict:
+        """
+        Agrega al dataset los pares de mensajes nuevos desde la última marca de agua
+
+        Requiere un contexto con acceso a la BD.
+
+        Returns:
+            Resumen de la ejecución (versión, pares nuevos, duplicados, sesiones recorridas)
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        manifest = self.load_manifest()
+        version = manifest['version'] + 1
+        watermarks = {int(session_id): seq for session_id, seq in manifest['watermarks'].items()}
+        # Último mensaje de usuario sin respuesta por sesión (puede responderse en otra ejecución)
+        pending: Dict[str, str] = dict(manifest.get('pending', {}))
+
+        shard_name = f"shard-{version:05d}.jsonl"
+        shard_path = os.path.join(self.output_dir, shard_name)
+        tmp_path = shard_path + ".tmp"
+
+        hashes = self._open_hashes(manifest['version'])
+
+        scanned = written = duplicates = 0
+        touched_sessions = 0
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as shard:
+                for marks, rows in MessageService.iter_new_messages(watermarks, self.chunk_size):
+                    for row in rows:
+                        scanned += 1
+                        session_key = str(row.session_id)
+                        if not row.is_bot:
+                            pending[session_key] = row.content
+                            continue
+
+                        user_text = pending.pop(session_key, None)
+                        if user_text is None:
+                            continue
+
+                        digest = hashlib.sha1(f"{user_text}\x1e{row.content}".encode('utf-8')).digest()
+                        inserted = hashes.execute(
+                            "INSERT OR IGNORE INTO seen (hash, version) VALUES (?, ?)", (digest, version)
+                        )
+                        if inserted.rowcount == 0:
+                            duplicates += 1
+                            continue
+
+                        shard.write(json.dumps({
+                            'dialog': [user_text, row.content],
+                            'session_id': row.session_id,
+                            'message_id': row.id
+                        }, ensure_ascii=False) + "\n")
+                        written += 1
+
+                    watermarks.update(marks)
+                    touched_sessions += len(marks)
+                    logger.debug(f"Corpus: {scanned} mensajes recorridos en {touched_sessions} sesiones")
+
+            if written:
+                os.replace(tmp_path, shard_path)
+                manifest['shards'].append({
+                    'file': shard_name,
+                    'version': version,
+                    'pairs': written,
+                    'sessions': touched_sessions
+                })
+                manifest['version'] = version
+                manifest['total_pairs'] += written
+            else:
+                os.remove(tmp_path)
+
+            manifest['watermarks'] = {str(session_id): seq for session_id, seq in watermarks.items()}
+            manifest['pending'] = pending
+            # Si el proceso cae entre ambas escrituras, _open_hashes descarta los hashes
+            # de esta versión y la próxima ejecución repite el tramo con los mismos pares
+            hashes.commit()
+            self._write_manifest(manifest)
+        except Exception:
+            hashes.rollback()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            hashes.close()
+
+        result = {
+            'version': manifest['version'],
+            'new_pairs': written,
+            'duplicates': duplicates,
+            'scanned_messages': scanned,
+            'sessions': touched_sessions,
+            'total_pairs': manifest['total_pairs']
+        }
+        logger.info(f"Corpus actualizado: {result}")
+        return result
+
+    def _open_hashes(self, manifest_version: int) -> sqlite3.Connection:
+        """Abre el índice de hashes sin los de versiones que el manifiesto no registra"""
+        hashes = sqlite3.connect(os.path.join(self.output_dir, HASH_INDEX_FILENAME))
+        hashes.execute(
+            "CREATE TABLE IF NOT EXISTS seen (hash BLOB PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID"
+        )
+        if 'version' not in {column[1] for column in hashes.execute("PRAGMA table_info(seen)")}:
+            hashes.execute("ALTER TABLE seen ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        # Hashes confirmados por una ejecución que no llegó a escribir su manifiesto
+        hashes.execute("DELETE FROM seen WHERE version > ?", (manifest_version,))
+        hashes.commit()
+        return hashes
+
+    def _write_manifest(self, manifest: Dict):
+        """Escribe el manifiesto de forma atómica"""
+        path = os.path.join(self.output_dir, MANIFEST_FILENAME)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
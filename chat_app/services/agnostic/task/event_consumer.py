@@ -0,0 +1,107 @@
+import threading
+from contextlib import nullcontext
+from typing import Callable, List, Optional
+from services.agnostic.utility.event_log import EventLog, LogEvent, event_log
+from utils.logger import logger
+
+
+class EventConsumer:
+    """
+    Task Service: Consumidor del registro de eventos
+
+    Lee el registro desde su checkpoint, entrega los eventos al manejador en
+    bloques y guarda el checkpoint solo cuando el manejador terminó sin
+    error: cada evento se procesa al menos una vez, así que el manejador debe
+    tolerar repeticiones (p. ej. usar el ID del mensaje como clave). Con un
+    error el bloque se reintenta en la siguiente pasada.
+
+    Puede ejecutarse en un hilo propio (start/stop) o por pasadas (run_once,
+    p. ej. desde un comando de manage.py).
+    """
+
+    def __init__(self, name: str, handler: Callable[[List[LogEvent]], None], log: EventLog = event_log,
+                 context_factory: Optional[Callable] = None, batch_size: int = 500, poll_interval: float = 1.0):
+        """
+        Args:
+            name: Nombre del consumidor (identifica su checkpoint)
+            handler: Recibe cada bloque de eventos en orden
+            log: Registro de eventos
+            context_factory: Callable que devuelve un context manager para el
+                manejador (p. ej. app.app_context si necesita la BD)
+            batch_size: Eventos máximos por bloque
+            poll_interval: Segundos de espera cuando no hay eventos nuevos
+        """
+        self.name = name
+        self.handler = handler
+        self.log = log
+        self.context_factory = context_factory or nullcontext
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self._stats = {'events': 0, 'batches': 0, 'failed_batches': 0, 'last_error': None}
+
+    def run_once(self) -> int:
+        """
+        Procesa un bloque de eventos pendientes
+
+        Returns:
+            Eventos procesados (0 si no había nuevos o el manejador falló)
+        """
+        offset = self.log.load_checkpoint(self.name)
+        events, next_offset = self.log.read(offset, self.batch_size)
+        if events:
+            try:
+                with self.context_factory():
+                    self.handler(events)
+            except Exception as e:
+                logger.error(f"Consumidor '{self.name}': error en el bloque desde {offset}: {str(e)}", exc_info=True)
+                self._stats['failed_batches'] += 1
+                self._stats['last_error'] = str(e)
+                return 0
+            self._stats['events'] += len(events)
+            self._stats['batches'] += 1
+        if next_offset != offset:
+            self.log.save_checkpoint(self.name, next_offset)
+        return len(events)
+
+    def run_until_idle(self) -> int:
+        """Procesa bloques hasta alcanzar el final del registro (o un error)"""
+        total = 0
+        while True:
+            processed = self.run_once()
+            total += processed
+            if processed < self.batch_size:
+                return total
+
+    def replay(self, offset: int = 0):
+        """Vuelve a procesar desde un offset (0 = desde el principio) en la siguiente pasada"""
+        self.log.save_checkpoint(self.name, offset)
+
+    def start(self):
+        """Arranca el hilo del consumidor"""
+        if self._worker is None or not self._worker.is_alive():
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name=f"event-consumer-{self.name}", daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Detiene el hilo del consumidor"""
+        self._stop.set()
+        if self._worker and self._worker.is_alive():
+            self._worker.join(timeout)
+
+    def stats(self) -> dict:
+        """Checkpoint, retraso y bloques procesados"""
+        offset = self.log.load_checkpoint(self.name)
+        return dict(self._stats, offset=offset, lag_bytes=max(self.log.end_offset() - offset, 0))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                idle = self.run_once() < self.batch_size
+            except Exception as e:
+                logger.error(f"Consumidor '{self.name}': {str(e)}", exc_info=True)
+                idle = True
+            if idle:
+                self._stop.wait(self.poll_interval)
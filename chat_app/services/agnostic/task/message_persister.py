@@ -0,0 +1,248 @@
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+from models.chat_message import ChatMessage
+from services.agnostic.entity.message_service import MessageService
+from utils.logger import logger
+
+PERSIST_MODES = ('sync', 'batched', 'async')
+
+
+class _PendingWrite:
+    """Mensaje encolado y aviso de que su grupo ya se escribió"""
+
+    __slots__ = ('message', 'done', 'ok')
+
+    def __init__(self, message: Optional[ChatMessage]):
+        self.message = message
+        self.done = threading.Event()
+        self.ok = False
+
+
+class MessagePersister:
+    """
+    Task Service: Escritura diferida (write-behind) de mensajes
+
+    Los mensajes reciben su ID al encolarse (IdAllocator), así que el llamador
+    puede devolverlos o emitirlos por el socket antes del commit. Un hilo los
+    escribe en transacciones agrupadas cada `interval_ms` o al juntar
+    `batch_size` mensajes: muchas peticiones comparten un solo commit.
+
+    Modos de durabilidad:
+        sync: cada mensaje se escribe en su propia transacción (sin cola)
+        batched: se encola y el llamador espera el commit del grupo
+        async: se encola y se vuelve de inmediato; un fallo del proceso
+            puede perder hasta un intervalo de mensajes
+
+    Con el servidor de eventlet sin monkey patch (`green`), threading.Event.wait
+    o una cola llena bloquearían el hub y con él todos los sockets: desde el
+    hilo del hub la espera del commit cede con eventlet.sleep y una cola
+    llena se resuelve escribiendo en línea sin esperar.
+    """
+
+    def __init__(self, context_factory: Callable, mode: str = 'batched', interval_ms: float = 20,
+                 batch_size: int = 200, queue_size: int = 10000, enqueue_timeout: float = 1.0):
+        """
+        Inicializa el persistidor
+
+        Args:
+            context_factory: Callable que devuelve un context manager con acceso a la BD
+                (p. ej. app.app_context)
+            mode: 'sync', 'batched' o 'async'
+            interval_ms: Espera máxima para juntar un grupo
+            batch_size: Mensajes máximos por transacción
+            queue_size: Capacidad de la cola (con la cola llena se escribe en línea)
+            enqueue_timeout: Segundos de espera por lugar en la cola
+        """
+        if mode not in PERSIST_MODES:
+            raise ValueError(f"Modo de persistencia inválido: {mode!r} (use {', '.join(PERSIST_MODES)})")
+
+        self.context_factory = context_factory
+        self.mode = mode
+        self.interval = interval_ms / 1000.0
+        self.batch_size = batch_size
+        self.enqueue_timeout = enqueue_timeout
+        self.green = False
+
+        self._queue: "queue.Queue[Optional[_PendingWrite]]" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._stats = {
+            'batches': 0, 'messages': 0, 'failed': 0, 'inline_writes': 0,
+            'max_batch': 0, 'last_flush_ms': 0.0
+        }
+
+    def save(self, session_id: int, user_id: int, content: str, is_bot: bool = False) -> Optional[ChatMessage]:
+        """
+        Guarda un mensaje según el modo de durabilidad
+
+        Requiere un contexto con acceso a la BD (para reservar IDs).
+
+        Args:
+            session_id: ID de la sesión/conversación
+            user_id: ID del usuario
+            content: Contenido del mensaje
+            is_bot: Si el mensaje es del bot
+
+        Returns:
+            ChatMessage con ID asignado, o None si no se pudo guardar
+        """
+        try:
+            message = MessageService.build_message(session_id, user_id, content, is_bot)
+        except Exception as e:
+            logger.error(f"Error asignando ID de mensaje: {str(e)}", exc_info=True)
+            return None
+
+        if self.mode == 'sync':
+            return message if MessageService.save_messages_batch([message]) else None
+
+        pending = _PendingWrite(message)
+        try:
+            self._ensure_worker()
+            if self._on_eventlet_hub():
+                self._queue.put_nowait(pending)
+            else:
+                self._queue.put(pending, timeout=self.enqueue_timeout)
+        except queue.Full:
+            # Contrapresión: con la cola llena el llamador escribe su propio mensaje
+            logger.warning("Cola de persistencia llena, escribiendo mensaje en línea")
+            with self._lock:
+                self._stats['inline_writes'] += 1
+            return message if MessageService.save_messages_batch([message]) else None
+
+        if self.mode == 'batched':
+            self._wait(pending)
+            return message if pending.ok else None
+        return message
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Espera a que se escriba todo lo encolado hasta ahora
+
+        Returns:
+            True si la cola se vació dentro del tiempo indicado
+        """
+        worker = self._worker
+        if worker is None or not worker.is_alive():
+            return self._queue.empty()
+
+        marker = _PendingWrite(None)
+        self._queue.put(marker)
+        return self._wait(marker, timeout)
+
+    def stop(self, timeout: float = 10.0):
+        """Escribe lo pendiente y detiene el hilo (se registra con atexit)"""
+        worker = self._worker
+        if worker and worker.is_alive():
+            self._queue.put(None)
+            worker.join(timeout)
+            if worker.is_alive():
+                logger.error(f"El persistidor no terminó en {timeout}s; quedan {self._queue.qsize()} mensajes")
+
+    def stats(self) -> dict:
+        """Estado de la cola y de los grupos escritos"""
+        with self._lock:
+            batches = self._stats['batches']
+            return dict(
+                self._stats,
+                mode=self.mode,
+                queued=self._queue.qsize(),
+                avg_batch=round(self._stats['messages'] / batches, 2) if batches else None
+            )
+
+    def _on_eventlet_hub(self) -> bool:
+        # Sin monkey patch el hub de eventlet corre en el hilo principal
+        return self.green and threading.current_thread() is threading.main_thread()
+
+    def _wait(self, pending: _PendingWrite, timeout: Optional[float] = None) -> bool:
+        """Espera el aviso del hilo de escritura sin bloquear el hub de eventlet"""
+        if not self._on_eventlet_hub():
+            return pending.done.wait(timeout)
+
+        from eventlet import sleep
+        deadline = None if timeout is None else time.monotonic() + timeout
+        poll = max(self.interval / 4, 0.001)
+        while not pending.done.is_set():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            sleep(poll)
+        return True
+
+    def _ensure_worker(self):
+        """Arranca el hilo de escritura la primera vez que se necesita (también tras un fork)"""
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run,
+                    name="message-persister",
+                    daemon=True
+                )
+                self._worker.start()
+
+    def _run(self):
+        """Bucle del hilo de escritura"""
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                return
+
+            batch: List[_PendingWrite] = [first]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._write(batch)
+            # Al detenerse se vacía lo que quede en la cola
+            while stopping and not self._queue.empty():
+                rest = []
+                while len(rest) < self.batch_size and not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is not None:
+                        rest.append(item)
+                self._write(rest)
+
+    def _write(self, batch: List[_PendingWrite]):
+        """Escribe un grupo y avisa a quienes esperan"""
+        writes = [item for item in batch if item.message is not None]
+        start = time.perf_counter()
+        failed = 0
+        try:
+            if writes:
+                with self.context_factory():
+                    if MessageService.save_messages_batch([item.message for item in writes]):
+                        for item in writes:
+                            item.ok = True
+                    else:
+                        # Un mensaje inválido no debe descartar al resto del grupo
+                        for item in writes:
+                            item.ok = MessageService.save_messages_batch([item.message])
+                            failed += not item.ok
+        except Exception as e:
+            logger.error(f"Error escribiendo grupo de mensajes: {str(e)}", exc_info=True)
+            failed = sum(not item.ok for item in writes)
+        finally:
+            for item in batch:
+                item.ok = item.ok or item.message is None
+                item.done.set()
+
+        with self._lock:
+            if writes:
+                self._stats['batches'] += 1
+                self._stats['messages'] += len(writes)
+                self._stats['max_batch'] = max(self._stats['max_batch'], len(writes))
+                self._stats['last_flush_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            self._stats['failed'] += failed
+        if failed:
+            logger.error(f"No se pudieron guardar {failed} de {len(writes)} mensajes")
@@ -1,9 +1,18 @@
-from typing import Optional
+from datetime import datetime
+from typing import Optional, List
 import traceback
+import zlib
 from dtos import MessageDTO, ResponseDTO, ConversationDTO
+from models.chat_message import ChatMessage
 from services.agnostic.entity.conversation_service import ConversationService
 from services.agnostic.entity.message_service import MessageService
 from services.agnostic.entity.user_service import UserService
+from services.agnostic.entity.summary_service import SummaryService
+from services.agnostic.entity.search_service import SearchService
+from services.agnostic.task.conversation_summarizer import ConversationSummarizer
+from services.agnostic.task.message_persister import MessagePersister
+from services.agnostic.task.conversation_exporter import ConversationExporter, EXPORT_FORMATS
+from services.agnostic.utility.identity_cache import UserRecord
 from services.agnostic.utility.text_utils import TextUtils
 from services.ai_service import AIService
 from config import Config
@@ -15,16 +24,29 @@ class MessagingCapability:
     Combina varios servicios de entidad y utilidad para operaciones de negocio
     """
     
-    def __init__(self, ai_service: AIService):
+    def __init__(self, ai_service: AIService, summarizer: Optional[ConversationSummarizer] = None,
+                 persister: Optional[MessagePersister] = None):
         """
         Inicializa el servicio de mensajería
         
         Args:
             ai_service: Instancia del servicio de IA
+            summarizer: Resumidor en segundo plano de turnos antiguos (opcional)
+            persister: Escritura agrupada de mensajes (None = un commit por mensaje)
         """
         self.ai_service = ai_service
+        self.summarizer = summarizer
+        self.persister = persister
     
-    def process_user_message(self, user_id: int, session_id: int, message_content: str) -> ResponseDTO:
+    @staticmethod
+    def _get_user(user_id: int, identity: Optional[UserRecord] = None) -> Optional[UserRecord]:
+        """Usuario verificado con el token (sin consultar) o leído de la caché / BD"""
+        if identity is not None and identity.id == user_id:
+            return identity
+        return UserService.get_user_identity(user_id)
+    
+    def process_user_message(self, user_id: int, session_id: int, message_content: str,
+                             identity: Optional[UserRecord] = None) -> ResponseDTO:
         """
         Procesa un mensaje del usuario (flujo completo)
         
@@ -39,6 +61,8 @@ class MessagingCapability:
             user_id: ID del usuario
             session_id: ID de la sesión
             message_content: Contenido del mensaje
+            identity: Usuario ya verificado con el token de sesión (evita la consulta);
+                su tenant elige el adaptador LoRA (sin token se usa el modelo base)
         
         Returns:
             ResponseDTO con el resultado del procesamiento
@@ -48,7 +72,7 @@ class MessagingCapability:
         try:
             # Paso 1: Validar usuario
             logger.debug(f"Validando usuario {user_id}")
-            user = UserService.get_user(user_id)
+            user = self._get_user(user_id, identity)
         except Exception as e:
             logger.error(f"Error al validar usuario: {str(e)}\n{traceback.format_exc()}")
             return ResponseDTO.error_response(
@@ -86,18 +110,30 @@ class MessagingCapability:
         
         # Paso 3: Validar que la conversación existe
         logger.debug(f"Verificando conversación {session_id}")
-        conversation = ConversationService.get_conversation(session_id)
+        conversation = ConversationService.get_session_identity(session_id)
         if not conversation:
             logger.warning(f"Conversación no encontrada: {session_id}")
             return ResponseDTO.error_response(
                 "Conversación no encontrada",
                 error_code="CONVERSATION_NOT_FOUND"
             )
+        
+        # El contexto del modelo (resumen y turnos recientes) es privado de su dueño
+        if conversation.user_id != user_id:
+            logger.warning(f"Usuario {user_id} intentó escribir en la conversación {session_id} de otro usuario")
+            return ResponseDTO.error_response(
+                "No autorizado para esta conversación",
+                error_code="UNAUTHORIZED"
+            )
+        
+        # Una conversación archivada recupera sus mensajes antes del nuevo (contexto del modelo)
+        if ConversationService.restore_messages(session_id) > 0:
+            logger.info(f"Conversación {session_id} restaurada del archivo")
             
         # Paso 4: Guardar mensaje del usuario
         logger.debug(f"Guardando mensaje del usuario en sesión {session_id}")
         try:
-            user_message = MessageService.save_message(
+            user_message = self._save_message(
                 session_id=session_id,
                 user_id=user_id,
                 content=cleaned_message,
@@ -132,10 +168,13 @@ class MessagingCapability:
                         error_code="AI_SERVICE_ERROR"
                     )
             
-            # Consultar al modelo
+            # Consultar al modelo con resumen + turnos recientes como contexto
             ai_response = self.ai_service.query_ai_model(
                 cleaned_message,
-                max_length=1000
+                max_length=1000,
+                context=self._build_context(user_id, session_id, cleaned_message, current=user_message),
+                max_context_tokens=getattr(Config, 'AI_MAX_CONTEXT_TOKENS', 512),
+                adapter_id=identity.tenant_id if identity is not None and identity.id == user_id else None
             )
             
             if not ai_response:
@@ -155,7 +194,7 @@ class MessagingCapability:
             )
         
         # Paso 6: Guardar respuesta del bot
-        bot_message = MessageService.save_message(
+        bot_message = self._save_message(
             session_id=session_id,
             user_id=user_id,  # Usamos el mismo user_id para mantener el contexto
             content=ai_response,
@@ -178,13 +217,15 @@ class MessagingCapability:
             }
         )
     
-    def create_new_conversation(self, user_id: int, title: str = "Nueva Conversación") -> ResponseDTO:
+    def create_new_conversation(self, user_id: int, title: str = "Nueva Conversación",
+                                identity: Optional[UserRecord] = None) -> ResponseDTO:
         """
         Crea una nueva conversación para el usuario
         
         Args:
             user_id: ID del usuario
             title: Título de la conversación
+            identity: Usuario ya verificado con el token de sesión (evita la consulta)
         
         Returns:
             ResponseDTO con la conversación creada
@@ -193,7 +234,7 @@ class MessagingCapability:
         
         try:
             # Validar usuario
-            user = UserService.get_user(user_id)
+            user = self._get_user(user_id, identity)
             if not user:
                 logger.warning(f"Usuario no encontrado: {user_id}")
                 return ResponseDTO.error_response(
@@ -204,7 +245,8 @@ class MessagingCapability:
             # Crear conversación
             new_conversation = ConversationService.create_conversation(
                 user_id=user_id,
-                title=title
+                title=title,
+                user=user
             )
             if not new_conversation:
                 logger.error(f"Error al crear conversación para usuario {user_id}")
@@ -212,8 +254,8 @@ class MessagingCapability:
                     "Error al crear conversación",
                     error_code="CREATE_ERROR"
                 )
-            # Convertir a dict para log y respuesta
-            conversation_dict = new_conversation.to_dict() if hasattr(new_conversation, 'to_dict') else {'id': getattr(new_conversation, 'id', 'N/A')}
+            # Convertir a dict para log y respuesta (recién creada: sin mensajes, no se carga la relación)
+            conversation_dict = new_conversation.to_dict(messages=[]) if hasattr(new_conversation, 'to_dict') else {'id': getattr(new_conversation, 'id', 'N/A')}
             logger.info(f"Conversación creada exitosamente - ID: {conversation_dict.get('id', 'N/A')}")
             return ResponseDTO.success_response(
                 "Conversación creada exitosamente",
@@ -226,13 +268,24 @@ class MessagingCapability:
                 error_code="INTERNAL_ERROR"
             )
     
-    def get_conversation_history(self, user_id: int, session_id: int) -> ResponseDTO:
+    def get_conversation_history(self, user_id: int, session_id: int, limit: Optional[int] = None,
+                                 before_id: Optional[int] = None, after_id: Optional[int] = None,
+                                 since: Optional[int] = None,
+                                 identity: Optional[UserRecord] = None) -> ResponseDTO:
         """
         Obtiene el historial de una conversación
         
+        Sin parámetros de paginación devuelve la conversación completa. Con
+        cualquiera de ellos devuelve una página ordenada por la secuencia de la sesión.
+        
         Args:
             user_id: ID del usuario
             session_id: ID de la sesión
+            limit: Mensajes por página
+            before_id: Cursor: mensajes anteriores a este mensaje
+            after_id: Cursor: mensajes posteriores a este mensaje
+            since: Modo delta: mensajes con seq mayor (el last_seq que ya tiene el cliente)
+            identity: Usuario ya verificado con el token de sesión (evita la consulta)
         
         Returns:
             ResponseDTO con el historial
@@ -242,7 +295,7 @@ class MessagingCapability:
         try:
             # Validar usuario
             logger.debug(f"Validando usuario {user_id}")
-            user = UserService.get_user(user_id)
+            user = self._get_user(user_id, identity)
             if not user:
                 logger.warning(f"Usuario no encontrado: {user_id}")
                 return ResponseDTO.error_response(
@@ -253,7 +306,7 @@ class MessagingCapability:
             # Obtener conversación
             logger.debug(f"Buscando conversación {session_id}")
             try:
-                conversation = ConversationService.get_conversation(session_id)
+                conversation = ConversationService.get_conversation(session_id, user_id=user_id)
             except Exception as e:
                 logger.error(f"Error al obtener conversación: {str(e)}\n{traceback.format_exc()}")
                 return ResponseDTO.error_response(
@@ -279,12 +332,18 @@ class MessagingCapability:
                     error_code="UNAUTHORIZED"
                 )
             
+            if any(value is not None for value in (limit, before_id, after_id, since)):
+                return self._get_history_page(conversation, limit, before_id, after_id, since)
+            
             # Convertir a diccionario para la respuesta
             try:
                 if isinstance(conversation, dict):
                     conversation_dict = conversation
                 else:
-                    conversation_dict = conversation.to_dict()
+                    # Mensajes por la ruta de lectura sin ORM (mismo JSON que la relación); se
+                    # convierten a diccionario de a uno mientras se serializa la respuesta
+                    records = MessageService.get_message_records(conversation.id)
+                    conversation_dict = conversation.to_dict(messages=(record.to_dict() for record in records))
                 
                 logger.info(f"Historial obtenido exitosamente para conversación {session_id}")
                 return ResponseDTO.success_response(
@@ -305,12 +364,16 @@ class MessagingCapability:
                 error_code="INTERNAL_ERROR"
             )
     
-    def get_user_conversations(self, user_id: int) -> ResponseDTO:
+    def get_user_conversations(self, user_id: int, view: Optional[str] = None,
+                               identity: Optional[UserRecord] = None) -> ResponseDTO:
         """
         Obtiene todas las conversaciones de un usuario
         
         Args:
             user_id: ID del usuario
+            view: "summary" devuelve solo id, título, número de mensajes, vista
+                previa del último mensaje y última actividad (sin mensajes)
+            identity: Usuario ya verificado con el token de sesión (evita la consulta)
         
         Returns:
             ResponseDTO con lista de conversaciones
@@ -319,7 +382,7 @@ class MessagingCapability:
         
         try:
             # Validar usuario
-            user = UserService.get_user(user_id)
+            user = self._get_user(user_id, identity)
             if not user:
                 logger.warning(f"Usuario no encontrado: {user_id}")
                 return ResponseDTO.error_response(
@@ -327,12 +390,30 @@ class MessagingCapability:
                     error_code="USER_NOT_FOUND"
                 )
             
+            if view == 'summary':
+                summaries = [
+                    {
+                        'id': row.id,
+                        'title': row.title,
+                        'created_at': row.created_at.isoformat(),
+                        'message_count': row.message_count,
+                        'last_message_preview': row.last_message_preview,
+                        'last_activity': row.last_activity.isoformat() if row.last_activity else None
+                    }
+                    for row in ConversationService.get_user_conversation_summaries(user_id)
+                ]
+                logger.info(f"Se encontraron {len(summaries)} conversaciones para usuario {user_id}")
+                return ResponseDTO.success_response(
+                    "Conversaciones obtenidas exitosamente",
+                    data=summaries
+                )
+            
             # Obtener conversaciones
             conversations = ConversationService.get_user_conversations(user_id)
             
             # Convertir a diccionarios
             conversations_data = []
-            for conv in conversations:
+            for conv, archived in conversations:
                 try:
                     if isinstance(conv, dict):
                         # Asegurar que tenga mensajes
@@ -353,6 +434,9 @@ class MessagingCapability:
                             'user_id': getattr(conv, 'user_id', None),
                             'title': getattr(conv, 'title', None),
                             'created_at': str(getattr(conv, 'created_at', '')),
+                            'message_count': getattr(conv, 'message_count', len(messages)),
+                            # Archivada: los mensajes se restauran al abrirla
+                            'archived': bool(archived),
                             'messages': messages
                         })
                 except Exception as e:
@@ -377,6 +461,278 @@ class MessagingCapability:
                 error_code="INTERNAL_ERROR"
             )
     
+    def get_conversation_validator(self, user_id: int, session_id: int, variant: str = '') -> Optional[str]:
+        """
+        Validador (ETag) del historial de una conversación
+        
+        Se calcula con Session.version, sin leer mensajes, así que una petición
+        condicional puede responderse antes de cargar el historial. Se lee antes
+        que los datos: si llega un mensaje entre ambos, la respuesta es más nueva
+        que su validador y el cliente solo vuelve a descargarla.
+        
+        Args:
+            user_id: ID del usuario que consulta
+            session_id: ID de la conversación
+            variant: Parámetros que cambian la representación (paginación)
+        
+        Returns:
+            Validador, o None si la conversación no existe o no es del usuario
+        """
+        version = ConversationService.get_conversation_version(session_id)
+        if version is None or version[0] != user_id:
+            return None
+        return f"c{session_id}-v{version[1]}-{zlib.crc32(variant.encode('utf-8')):08x}"
+    
+    def get_conversations_validator(self, user_id: int, variant: str = '',
+                                    identity: Optional[UserRecord] = None) -> Optional[str]:
+        """
+        Validador (ETag) de la lista de conversaciones de un usuario
+        
+        Args:
+            user_id: ID del usuario
+            variant: Parámetros que cambian la representación (view)
+            identity: Usuario ya verificado con el token de sesión (evita la consulta)
+        
+        Returns:
+            Validador, o None si el usuario no existe
+        """
+        if not self._get_user(user_id, identity):
+            return None
+        state = ConversationService.get_user_conversations_version(user_id)
+        if state is None:
+            return None
+        count, last_id, versions = state
+        return f"u{user_id}-n{count}-i{last_id}-v{versions}-{zlib.crc32(variant.encode('utf-8')):08x}"
+    
+    def search_messages(self, user_id: int, query: str, session_id: Optional[int] = None,
+                        limit: Optional[int] = None, offset: int = 0,
+                        identity: Optional[UserRecord] = None) -> ResponseDTO:
+        """
+        Busca en los mensajes de un usuario (texto completo, ordenado por relevancia)
+        
+        Args:
+            user_id: ID del usuario
+            query: Texto de la búsqueda
+            session_id: Limitar a una conversación del usuario
+            limit: Resultados por página (se acota a SEARCH_MAX_PAGE_SIZE)
+            offset: Resultados a saltar
+            identity: Usuario ya verificado con el token de sesión (evita la consulta)
+        
+        Returns:
+            ResponseDTO con los resultados y la paginación
+        """
+        logger.info(f"Buscando mensajes - User ID: {user_id}, Session ID: {session_id}")
+        
+        try:
+            user = self._get_user(user_id, identity)
+            if not user:
+                logger.warning(f"Usuario no encontrado: {user_id}")
+                return ResponseDTO.error_response(
+                    "Usuario no encontrado",
+                    error_code="USER_NOT_FOUND"
+                )
+            
+            if not SearchService.build_match_query(query):
+                return ResponseDTO.error_response(
+                    "El parámetro q debe contener al menos una palabra",
+                    error_code="INVALID_INPUT"
+                )
+            
+            limit = getattr(Config, 'SEARCH_PAGE_SIZE', 20) if limit is None else limit
+            if limit < 1 or offset < 0:
+                return ResponseDTO.error_response(
+                    "Parámetros de paginación inválidos",
+                    error_code="INVALID_INPUT"
+                )
+            limit = min(limit, getattr(Config, 'SEARCH_MAX_PAGE_SIZE', 100))
+            
+            if session_id is not None:
+                session = ConversationService.get_session_identity(session_id)
+                if not session or session.user_id != user_id:
+                    logger.warning(f"Usuario {user_id} no autorizado para buscar en conversación {session_id}")
+                    return ResponseDTO.error_response(
+                        "No autorizado para acceder a esta conversación",
+                        error_code="UNAUTHORIZED"
+                    )
+            
+            results, has_more = SearchService.search_messages(
+                user_id, query, session_id=session_id, limit=limit, offset=offset,
+                snippet_tokens=getattr(Config, 'SEARCH_SNIPPET_TOKENS', 12)
+            )
+            
+            logger.info(f"Búsqueda con {len(results)} resultados para usuario {user_id}")
+            return ResponseDTO.success_response(
+                "Búsqueda realizada exitosamente",
+                data={
+                    'query': query,
+                    'results': results,
+                    'page': {
+                        'limit': limit,
+                        'offset': offset,
+                        'has_more': has_more,
+                        'next_offset': offset + limit if has_more else None
+                    }
+                }
+            )
+        except Exception as e:
+            logger.error(f"Error al buscar mensajes: {str(e)}\n{traceback.format_exc()}")
+            return ResponseDTO.error_response(
+                f"Error interno: {str(e)}",
+                error_code="INTERNAL_ERROR"
+            )
+    
+    def export_conversations(self, user_id: int, export_format: str = 'ndjson', since: Optional[str] = None,
+                             until: Optional[str] = None, after_session: int = 0, after_seq: int = 0,
+                             identity: Optional[UserRecord] = None) -> ResponseDTO:
+        """
+        Prepara la exportación de todos los mensajes de un usuario
+        
+        La exportación no se arma en memoria: data['chunks'] es un generador
+        de bytes que lee la BD a medida que se consume (debe consumirse
+        dentro de un contexto con acceso a la BD).
+        
+        Args:
+            user_id: ID del usuario
+            export_format: 'ndjson' o 'parquet'
+            since: Fecha ISO desde la cual exportar (inclusive)
+            until: Fecha ISO hasta la cual exportar (exclusive)
+            after_session: Reanudar en esta sesión (session_id del último mensaje recibido)
+            after_seq: Reanudar después de este seq de `after_session` (seq del último mensaje recibido)
+            identity: Usuario ya verificado con el token de sesión (evita la consulta)
+        
+        Returns:
+            ResponseDTO con los fragmentos, el formato y el nombre de archivo sugerido
+        """
+        logger.info(f"Exportando conversaciones - User ID: {user_id}, formato: {export_format}")
+        
+        try:
+            user = self._get_user(user_id, identity)
+            if not user:
+                logger.warning(f"Usuario no encontrado: {user_id}")
+                return ResponseDTO.error_response(
+                    "Usuario no encontrado",
+                    error_code="USER_NOT_FOUND"
+                )
+            
+            if export_format not in EXPORT_FORMATS:
+                return ResponseDTO.error_response(
+                    f"Formato inválido: use {', '.join(EXPORT_FORMATS)}",
+                    error_code="INVALID_INPUT"
+                )
+            
+            try:
+                since_date = datetime.fromisoformat(since) if since else None
+                until_date = datetime.fromisoformat(until) if until else None
+            except ValueError:
+                return ResponseDTO.error_response(
+                    "Fechas inválidas: use el formato ISO (AAAA-MM-DD)",
+                    error_code="INVALID_INPUT"
+                )
+            
+            exporter = ConversationExporter(
+                user_id=user_id,
+                since=since_date,
+                until=until_date,
+                batch_size=getattr(Config, 'EXPORT_BATCH_SIZE', 1000)
+            )
+            chunks = exporter.stream(export_format, {'after_session': after_session, 'after_seq': after_seq})
+            return ResponseDTO.success_response(
+                "Exportación iniciada",
+                data={
+                    'chunks': chunks,
+                    'format': export_format,
+                    'filename': f"user-{user_id}-messages.{'ndjson' if export_format == 'ndjson' else 'parquet'}"
+                }
+            )
+        except Exception as e:
+            logger.error(f"Error al exportar conversaciones: {str(e)}\n{traceback.format_exc()}")
+            return ResponseDTO.error_response(
+                f"Error interno: {str(e)}",
+                error_code="INTERNAL_ERROR"
+            )
+    
+    def _get_history_page(self, conversation, limit: Optional[int], before_id: Optional[int],
+                          after_id: Optional[int], since: Optional[int]) -> ResponseDTO:
+        """
+        Página del historial por cursor de secuencia
+        
+        Args:
+            conversation: Session ya validada
+            limit: Mensajes por página (se acota a HISTORY_MAX_PAGE_SIZE)
+            before_id: Mensaje cursor hacia atrás
+            after_id: Mensaje cursor hacia adelante
+            since: seq a partir del cual devolver mensajes nuevos
+        
+        Returns:
+            ResponseDTO con la página y los cursores siguientes
+        """
+        if sum(value is not None for value in (before_id, after_id, since)) > 1:
+            return ResponseDTO.error_response(
+                "Use solo uno de before_id, after_id o since",
+                error_code="INVALID_INPUT"
+            )
+        
+        max_page = getattr(Config, 'HISTORY_MAX_PAGE_SIZE', 200)
+        limit = getattr(Config, 'HISTORY_PAGE_SIZE', 50) if limit is None else limit
+        if limit < 1 or (since is not None and since < 0):
+            return ResponseDTO.error_response(
+                "Parámetros de paginación inválidos",
+                error_code="INVALID_INPUT"
+            )
+        limit = min(limit, max_page)
+        
+        before_seq = after_seq = None
+        cursor_id = before_id if before_id is not None else after_id
+        if cursor_id is not None:
+            cursor_seq = MessageService.get_message_seq(conversation.id, cursor_id)
+            if cursor_seq is None:
+                return ResponseDTO.error_response(
+                    f"El mensaje {cursor_id} no pertenece a la conversación",
+                    error_code="INVALID_INPUT"
+                )
+            if before_id is not None:
+                before_seq = cursor_seq
+            else:
+                after_seq = cursor_seq
+        elif since is not None:
+            after_seq = since
+        
+        messages, has_more = MessageService.get_message_records_page(
+            conversation.id, limit, before_seq=before_seq, after_seq=after_seq
+        )
+        
+        forward = after_seq is not None
+        data = {
+            'id': conversation.id,
+            'user_id': conversation.user_id,
+            'title': conversation.title,
+            'created_at': conversation.created_at.isoformat(),
+            'last_seq': conversation.last_seq,
+            'messages': [message.to_dict() for message in messages],
+            'page': {
+                'limit': limit,
+                'has_more': has_more,
+                # Cursores para seguir en la misma dirección
+                'next_before_id': messages[0].id if messages and not forward and has_more else None,
+                'next_after_id': messages[-1].id if messages and forward and has_more else None,
+                # Valor de since para la próxima sincronización incremental
+                'since': messages[-1].seq if messages and forward else (since if since is not None else conversation.last_seq)
+            }
+        }
+        logger.info(f"Página de historial - Session ID: {conversation.id}, mensajes: {len(messages)}")
+        return ResponseDTO.success_response("Historial obtenido exitosamente", data=data)
+    
+    def _save_message(self, session_id: int, user_id: int, content: str, is_bot: bool):
+        """Guarda un mensaje a través del persistidor si está configurado"""
+        if self.persister is not None:
+            return self.persister.save(session_id, user_id, content, is_bot=is_bot)
+        return MessageService.save_message(
+            session_id=session_id,
+            user_id=user_id,
+            content=content,
+            is_bot=is_bot
+        )
+    
     def _validate_input(self, text: str) -> dict:
         """
         Valida la entrada del usuario
@@ -403,6 +759,59 @@ class MessagingCapability:
         
         return {'valid': True, 'error': None}
     
+    def _build_context(self, user_id: int, session_id: int, message: str, current: ChatMessage) -> List[str]:
+        """
+        Arma el contexto del modelo: fragmentos relevantes de otras sesiones del
+        usuario + resumen de turnos antiguos + turnos recientes
+        
+        Si hay turnos fuera de la ventana reciente que el resumen aún no cubre,
+        se usa el resumen disponible y se programa su actualización en segundo plano.
+        
+        Args:
+            user_id: ID del usuario
+            session_id: ID de la sesión
+            message: Mensaje actual (consulta para la recuperación)
+            current: Mensaje actual (se excluye del contexto; con persistencia
+                asíncrona puede no tener seq todavía)
+        
+        Returns:
+            Lista de turnos en orden cronológico
+        """
+        recent_window = getattr(Config, 'AI_CONTEXT_RECENT_TURNS', 6)
+        retrieval_top_k = getattr(Config, 'RETRIEVAL_TOP_K', 0)
+        try:
+            context = []
+            if retrieval_top_k > 0:
+                related = MessageService.search_user_history(
+                    user_id, message, top_k=retrieval_top_k, exclude_session_id=session_id
+                )
+                context.extend(
+                    TextUtils.truncate_text(m.content, getattr(Config, 'RETRIEVAL_SNIPPET_CHARS', 200))
+                    for m in related
+                )
+            
+            # Un mensaje extra indica si hay turnos que ya salieron de la ventana
+            messages = MessageService.get_recent_messages(
+                session_id, recent_window + 1, before_seq=current.seq, exclude_id=current.id
+            )
+            
+            if len(messages) > recent_window:
+                newest_aged_out_seq = messages[0].seq
+                messages = messages[1:]
+                
+                summary = SummaryService.get_summary(session_id)
+                if summary and summary.summary:
+                    context.append(summary.summary)
+                if self.summarizer and self.summarizer.is_stale(summary, newest_aged_out_seq):
+                    logger.debug(f"Resumen desactualizado, programando actualización - Session ID: {session_id}")
+                    self.summarizer.schedule(session_id)
+            
+            context.extend(m.content for m in messages)
+            return context
+        except Exception as e:
+            logger.error(f"Error al armar contexto: {str(e)}\n{traceback.format_exc()}")
+            return []
+    
     def _query_ai(self, text: str) -> Optional[str]:
         """
         Consulta al servicio de IA
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from models.storage import database_size, run_maintenance
+from services.agnostic.entity.archive_service import ArchiveService
+from utils.logger import logger
+
+
+class SessionArchiver:
+    """
+    Task Service: Archivo de sesiones inactivas (datos fríos)
+
+    Mueve los mensajes de las sesiones sin actividad desde hace
+    `inactive_days` días a los segmentos comprimidos de ArchiveService y
+    devuelve al sistema las páginas que quedan libres en la BD
+    (incremental_vacuum). Las sesiones se rehidratan solas al abrirse con
+    ConversationService.get_conversation.
+    """
+
+    def __init__(self, inactive_days: int = 90, max_sessions: Optional[int] = None, compression_level: int = 6):
+        """
+        Args:
+            inactive_days: Días sin actividad para archivar una sesión
+            max_sessions: Sesiones máximas por ejecución (None = todas)
+            compression_level: Nivel de zlib (1-9)
+        """
+        self.inactive_days = inactive_days
+        self.max_sessions = max_sessions
+        self.compression_level = compression_level
+
+    def run(self, now: Optional[datetime] = None) -> Dict:
+        """
+        Archiva las sesiones inactivas
+
+        Requiere un contexto con acceso a la BD.
+
+        Args:
+            now: Fecha de referencia (por defecto, ahora)
+
+        Returns:
+            Sesiones y mensajes archivados, bytes antes y después de comprimir
+            y tamaño de la BD antes y después
+        """
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.inactive_days)
+        size_before = database_size()
+
+        report = {'sessions': 0, 'messages': 0, 'raw_bytes': 0, 'stored_bytes': 0, 'failed': 0}
+        for session_id in ArchiveService.find_inactive_sessions(cutoff, self.max_sessions):
+            result = ArchiveService.archive_session(session_id, self.compression_level)
+            if result is None:
+                report['failed'] += 1
+                continue
+            report['sessions'] += 1
+            report['messages'] += result['messages']
+            report['raw_bytes'] += result['raw_bytes']
+            report['stored_bytes'] += result['stored_bytes']
+
+        if size_before is not None and report['sessions']:
+            # Devolver todas las páginas libres (solo con auto_vacuum=INCREMENTAL;
+            # en bases anteriores quedan libres dentro del archivo hasta un VACUUM)
+            run_maintenance(vacuum_pages=0, analyze=False)
+        size_after = database_size()
+
+        report['cutoff'] = cutoff.isoformat()
+        report['db_bytes_before'] = size_before['total_bytes'] if size_before else None
+        report['db_bytes_after'] = size_after['total_bytes'] if size_after else None
+        report['db_free_bytes'] = size_after['free_bytes'] if size_after else None
+        report['reclaimed_bytes'] = (
+            size_before['total_bytes'] - size_after['total_bytes'] if size_before and size_after else None
+        )
+        logger.info(
+            f"Archivo: {report['sessions']} sesiones, {report['messages']} mensajes, "
+            f"{report['raw_bytes']} -> {report['stored_bytes']} bytes comprimidos, "
+            f"{report['reclaimed_bytes']} bytes devueltos por la BD"
+        )
+        return report
@@ -0,0 +1,201 @@
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+from services.agnostic.entity.user_service import UserService
+from utils.logger import logger
+from utils.password_hasher import hash_passwords, password_hasher
+from utils.validators import validate_email, validate_username
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+# Contraseñas por tarea enviada al pool de procesos (menos idas y vueltas)
+_HASH_CHUNK = 32
+
+
+def iter_import_rows(stream: TextIO, import_format: str) -> Iterator[Dict]:
+    """
+    Lee los usuarios a importar de un flujo de texto
+
+    CSV con cabecera (username, email, password y opcionalmente is_active)
+    o NDJSON con un objeto por línea.
+
+    Args:
+        stream: Texto del archivo
+        import_format: 'csv' o 'ndjson'
+
+    Yields:
+        Diccionario por fila; una línea NDJSON inválida produce {'_error': ...}
+    """
+    if import_format == 'csv':
+        for row in csv.DictReader(stream):
+            yield row
+        return
+
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield {'_error': f"JSON inválido: {e}"}
+            continue
+        yield row if isinstance(row, dict) else {'_error': "Se esperaba un objeto JSON"}
+
+
+class UserImporter:
+    """
+    Task Service: Alta masiva de usuarios (CSV / NDJSON)
+
+    Procesa las filas por bloques: valida cada una, descarta duplicados del
+    propio archivo y comprueba los ya registrados con una consulta por bloque
+    (UserService.find_existing), calcula los hashes de contraseña en un pool
+    de procesos y los inserta en una transacción por bloque. Si la
+    transacción falla (un usuario registrado a la vez por otra vía) el
+    bloque se reintenta fila por fila.
+
+    Devuelve un resultado por fila, en el orden del archivo, a medida que
+    termina cada bloque; el resumen queda en `summary`.
+
+    Se ejecuta desde manage.py import-users, no dentro de una petición: los
+    procesos del pool se crean con 'spawn' (fork de un proceso con hilos
+    puede heredar locks tomados) y ocuparían las CPUs del servidor.
+    """
+
+    def __init__(self, batch_size: int = 1000, workers: Optional[int] = None):
+        """
+        Args:
+            batch_size: Filas por bloque (y por transacción)
+            workers: Procesos para el hash (None = uno por CPU)
+        """
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count() or 1
+        self.summary = {'rows': 0, 'created': 0, 'duplicate': 0, 'invalid': 0, 'error': 0, 'seconds': 0.0}
+
+    def run(self, rows: Iterable[Dict]) -> Iterator[Dict]:
+        """
+        Importa los usuarios
+
+        Requiere un contexto con acceso a la BD.
+
+        Args:
+            rows: Filas de iter_import_rows
+
+        Yields:
+            Resultado por fila: {'row', 'username', 'status', 'id' | 'error'} con
+            status 'created', 'duplicate', 'invalid' o 'error'
+        """
+        started = time.perf_counter()
+        seen_usernames, seen_emails = set(), set()
+        pool = self._open_pool()
+        try:
+            batch = []
+            for number, row in enumerate(rows, start=1):
+                batch.append((number, row))
+                if len(batch) >= self.batch_size:
+                    yield from self._import_batch(batch, seen_usernames, seen_emails, pool)
+                    batch = []
+            if batch:
+                yield from self._import_batch(batch, seen_usernames, seen_emails, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            self.summary['seconds'] = round(time.perf_counter() - started, 2)
+
+    def _import_batch(self, batch: List[tuple], seen_usernames: set, seen_emails: set, pool) -> Iterator[Dict]:
+        results = {}
+        candidates = []
+        for number, row in batch:
+            user, error = self._parse_row(row)
+            if error:
+                results[number] = {'row': number, 'username': row.get('username'), 'status': 'invalid', 'error': error}
+            elif user['username'] in seen_usernames or user['email'] in seen_emails:
+                results[number] = {
+                    'row': number, 'username': user['username'], 'status': 'duplicate',
+                    'error': "Repetido en el archivo"
+                }
+            else:
+                seen_usernames.add(user['username'])
+                seen_emails.add(user['email'])
+                candidates.append((number, user))
+
+        existing_usernames, existing_emails = UserService.find_existing(
+            [user['username'] for _, user in candidates], [user['email'] for _, user in candidates]
+        )
+        new_users = []
+        for number, user in candidates:
+            if user['username'] in existing_usernames or user['email'] in existing_emails:
+                results[number] = {
+                    'row': number, 'username': user['username'], 'status': 'duplicate',
+                    'error': "El usuario o email ya existe"
+                }
+            else:
+                new_users.append((number, user))
+
+        # Solo se calcula el hash de las filas que se van a insertar
+        for (_, user), password_hash in zip(new_users, self._hash([user.pop('password') for _, user in new_users], pool)):
+            user['password_hash'] = password_hash
+
+        created = UserService.insert_users([user for _, user in new_users])
+        if created is None:
+            logger.warning("Bloque de importación rechazado; reintentando fila por fila")
+            created = {}
+            for _, user in new_users:
+                created.update(UserService.insert_users([user]) or {})
+        for number, user in new_users:
+            if user['username'] in created:
+                results[number] = {
+                    'row': number, 'username': user['username'], 'status': 'created', 'id': created[user['username']]
+                }
+            else:
+                results[number] = {
+                    'row': number, 'username': user['username'], 'status': 'error',
+                    'error': "No se pudo crear (¿registrado a la vez?)"
+                }
+
+        for number, _ in batch:
+            result = results[number]
+            self.summary['rows'] += 1
+            self.summary[result['status']] += 1
+            yield result
+
+    @staticmethod
+    def _parse_row(row: Dict) -> tuple:
+        """Valida una fila; devuelve (usuario, None) o (None, error)"""
+        if '_error' in row:
+            return None, row['_error']
+        username = str(row.get('username') or '').strip()
+        email = str(row.get('email') or '').strip()
+        password = str(row.get('password') or '')
+        for valid, error in (validate_username(username), validate_email(email)):
+            if not valid:
+                return None, error
+        if not password:
+            return None, "La contraseña es requerida"
+        is_active = row.get('is_active', True)
+        if isinstance(is_active, str):
+            is_active = is_active.strip().lower() not in ('0', 'false', 'no')
+        return {'username': username, 'email': email, 'password': password, 'is_active': bool(is_active)}, None
+
+    def _open_pool(self):
+        # Con un solo proceso no vale la pena arrancar otro intérprete
+        if self.workers <= 1:
+            return None
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _hash(self, passwords: List[str], pool) -> List[str]:
+        if not passwords:
+            return []
+        if pool is None:
+            return hash_passwords(passwords, password_hasher.method, password_hasher.salt_length)
+        chunks = [passwords[start:start + _HASH_CHUNK] for start in range(0, len(passwords), _HASH_CHUNK)]
+        hashes = []
+        for chunk_hashes in pool.map(
+            hash_passwords, chunks, [password_hasher.method] * len(chunks), [password_hasher.salt_length] * len(chunks)
+        ):
+            hashes.extend(chunk_hashes)
+        return hashes
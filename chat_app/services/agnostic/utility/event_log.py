@@ -0,0 +1,373 @@
+import fcntl
+import json
+import os
+import re
+import struct
+import threading
+import zlib
+from bisect import bisect_right
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from utils.logger import logger
+
+# Cabecera de cada registro: longitud del contenido y CRC32
+_HEADER = struct.Struct('>II')
+# Los segmentos se nombran por la posición global de su primer byte
+_SEGMENT_PATTERN = re.compile(r'^events-(\d{20})\.log$')
+_CONSUMER_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+_CHECKPOINT_DIR = 'checkpoints'
+_LOCK_FILE = 'events.lock'
+
+
+class LogEvent(NamedTuple):
+    """Evento leído del registro"""
+    offset: int
+    event: dict
+
+
+class EventLog:
+    """
+    Utilidad: registro local de eventos de solo escritura al final (Agnóstico)
+
+    Los servicios de entidad agregan un evento por cambio ya confirmado en la
+    BD (mensaje guardado, sesión creada, archivada...). Los consumidores
+    (indexación, analítica, corpus) lo leen por su cuenta desde su propio
+    checkpoint, así que el trabajo secundario sale del camino de la petición
+    y se puede repetir desde cualquier posición.
+
+    El offset de un evento es la posición global de su primer byte: crece
+    siempre pero no es consecutivo. Cada grupo de eventos se escribe con una
+    sola llamada a write bajo un lock de archivo, de modo que varios workers
+    pueden compartir el directorio. Cada proceso empieza un segmento nuevo:
+    si otro murió a mitad de un registro, el registro incompleto queda al
+    final de su segmento y los lectores saltan al siguiente.
+
+    Sin fsync (por defecto) un corte de energía puede perder los últimos
+    eventos; un fallo del proceso entre el commit y la escritura también.
+    """
+
+    def __init__(self, directory: str = 'events', max_segment_bytes: int = 64 * 1024 * 1024,
+                 enabled: bool = False, fsync: bool = False):
+        """
+        Args:
+            directory: Directorio de los segmentos y de los checkpoints
+            max_segment_bytes: Tamaño a partir del cual se abre un segmento nuevo
+            enabled: Registrar eventos (False = append no hace nada)
+            fsync: Sincronizar a disco cada grupo de eventos
+        """
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.enabled = enabled
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._lock_fd: Optional[int] = None
+        self._segment_fd: Optional[int] = None
+        self._segment_base = 0
+        self._counters = {'events': 0, 'batches': 0, 'bytes': 0, 'failed': 0, 'skipped_bytes': 0}
+
+    def configure(self, directory: str, max_segment_bytes: int, enabled: bool, fsync: bool):
+        """Aplica la configuración de la app"""
+        with self._lock:
+            if directory != self.directory:
+                self._close()
+            self.directory = directory
+            self.max_segment_bytes = max_segment_bytes
+            self.enabled = enabled
+            self.fsync = fsync
+
+    def append(self, events: Iterable[dict]) -> Optional[int]:
+        """
+        Agrega un grupo de eventos
+
+        Se llama después del commit. Un error de disco no se propaga: se
+        registra y se cuenta en `failed`.
+
+        Args:
+            events: Diccionarios con 'type' y los datos del cambio
+                (las fechas se guardan en ISO 8601)
+
+        Returns:
+            Offset del primer evento, o None si el registro está desactivado o falló
+        """
+        if not self.enabled:
+            return None
+        at = datetime.utcnow().isoformat()
+        records = []
+        count = 0
+        for event in events:
+            payload = json.dumps(
+                {'type': event['type'], 'at': at, **event},
+                ensure_ascii=False, separators=(',', ':'), default=_json_default
+            ).encode('utf-8')
+            records.append(_HEADER.pack(len(payload), zlib.crc32(payload)))
+            records.append(payload)
+            count += 1
+        if not count:
+            return None
+        data = b''.join(records)
+
+        try:
+            with self._lock:
+                self._open()
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+                try:
+                    self._roll_if_full()
+                    size = os.fstat(self._segment_fd).st_size
+                    offset = self._segment_base + size
+                    try:
+                        view = memoryview(data)
+                        while view:
+                            view = view[os.write(self._segment_fd, view):]
+                        if self.fsync:
+                            os.fsync(self._segment_fd)
+                    except OSError:
+                        self._discard_from(size)
+                        raise
+                finally:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+                self._counters['events'] += count
+                self._counters['batches'] += 1
+                self._counters['bytes'] += len(data)
+        except OSError as e:
+            logger.error(f"No se pudieron registrar {count} eventos: {str(e)}")
+            with self._lock:
+                self._counters['failed'] += count
+            return None
+        return offset
+
+    def read(self, offset: int = 0, limit: int = 1000) -> Tuple[List[LogEvent], int]:
+        """
+        Lee eventos a partir de un offset
+
+        Un offset anterior al primer segmento conservado empieza por ese
+        segmento. Los registros dañados hacen saltar al segmento siguiente;
+        un registro incompleto al final del último segmento se considera
+        todavía en escritura.
+
+        Args:
+            offset: Offset del primer evento a leer (0 = desde el principio)
+            limit: Eventos máximos
+
+        Returns:
+            (eventos, offset siguiente para continuar la lectura)
+        """
+        segments = self._segments()
+        if not segments:
+            return [], offset
+        bases = [base for base, _ in segments]
+        index = max(bisect_right(bases, offset) - 1, 0)
+        offset = max(offset, bases[0])
+
+        events: List[LogEvent] = []
+        while len(events) < limit:
+            base, name = segments[index]
+            complete = True
+            with open(os.path.join(self.directory, name), 'rb') as handle:
+                handle.seek(offset - base)
+                while len(events) < limit:
+                    header = handle.read(_HEADER.size)
+                    if not header:
+                        break
+                    if len(header) < _HEADER.size:
+                        complete = False
+                        break
+                    length, crc = _HEADER.unpack(header)
+                    payload = handle.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        complete = False
+                        break
+                    events.append(LogEvent(offset, json.loads(payload)))
+                    offset += _HEADER.size + length
+            if len(events) >= limit or index + 1 >= len(segments):
+                break
+            index += 1
+            if not complete or offset != segments[index][0]:
+                logger.warning(f"Registro de eventos dañado en {name}@{offset - base}; se continúa en el segmento siguiente")
+                with self._lock:
+                    self._counters['skipped_bytes'] += segments[index][0] - offset
+            offset = segments[index][0]
+        return events, offset
+
+    def end_offset(self) -> int:
+        """Offset que tendrá el próximo evento"""
+        segments = self._segments()
+        if not segments:
+            return 0
+        base, name = segments[-1]
+        return base + os.path.getsize(os.path.join(self.directory, name))
+
+    def load_checkpoint(self, consumer: str) -> int:
+        """
+        Offset guardado de un consumidor
+
+        Args:
+            consumer: Nombre del consumidor (letras, números, '.', '_' o '-')
+
+        Returns:
+            Offset del siguiente evento a procesar (0 si el consumidor es nuevo)
+        """
+        try:
+            with open(self._checkpoint_path(consumer), 'r', encoding='utf-8') as handle:
+                return int(handle.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def save_checkpoint(self, consumer: str, offset: int):
+        """Guarda el offset de un consumidor (reemplazo atómico del archivo)"""
+        path = self._checkpoint_path(consumer)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as handle:
+            handle.write(str(int(offset)))
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temporary, path)
+
+    def checkpoints(self) -> Dict[str, int]:
+        """Offsets de todos los consumidores con checkpoint"""
+        directory = os.path.join(self.directory, _CHECKPOINT_DIR)
+        if not os.path.isdir(directory):
+            return {}
+        return {
+            name[:-len('.offset')]: self.load_checkpoint(name[:-len('.offset')])
+            for name in sorted(os.listdir(directory))
+            if name.endswith('.offset') and _CONSUMER_PATTERN.match(name[:-len('.offset')])
+        }
+
+    def prune(self, before_offset: int) -> int:
+        """
+        Elimina los segmentos cuyos eventos son todos anteriores a un offset
+
+        El último segmento nunca se elimina.
+
+        Args:
+            before_offset: Offset ya procesado por todos los consumidores
+
+        Returns:
+            Segmentos eliminados
+        """
+        segments = self._segments()
+        removed = 0
+        for (_, name), (next_base, _) in zip(segments, segments[1:]):
+            if next_base > before_offset:
+                break
+            os.remove(os.path.join(self.directory, name))
+            removed += 1
+        return removed
+
+    def stats(self) -> dict:
+        """Eventos escritos por el proceso, tamaño en disco y retraso de cada consumidor"""
+        segments = self._segments()
+        end = self.end_offset()
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            'enabled': self.enabled,
+            'segments': len(segments),
+            'first_offset': segments[0][0] if segments else 0,
+            'end_offset': end,
+            'consumers': {
+                name: {'offset': offset, 'lag_bytes': max(end - offset, 0)}
+                for name, offset in self.checkpoints().items()
+            },
+            **counters
+        }
+
+    def _checkpoint_path(self, consumer: str) -> str:
+        if not _CONSUMER_PATTERN.match(consumer or ''):
+            raise ValueError(f"Nombre de consumidor inválido: {consumer!r}")
+        return os.path.join(self.directory, _CHECKPOINT_DIR, f"{consumer}.offset")
+
+    def _segments(self) -> List[Tuple[int, str]]:
+        if not os.path.isdir(self.directory):
+            return []
+        segments = []
+        for name in os.listdir(self.directory):
+            match = _SEGMENT_PATTERN.match(name)
+            if match:
+                segments.append((int(match.group(1)), name))
+        return sorted(segments)
+
+    def _open(self):
+        """Abre el lock la primera vez (también tras un fork o al cambiar de directorio) y empieza un segmento"""
+        if self._pid == os.getpid() and self._lock_fd is not None:
+            return
+        self._close()
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_fd = os.open(os.path.join(self.directory, _LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        self._pid = os.getpid()
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            segments = self._segments()
+            if not segments:
+                self._start_segment(0)
+            else:
+                # Un segmento vacío se aprovecha; si no, se empieza uno nuevo
+                base, name = segments[-1]
+                self._start_segment(base + os.path.getsize(os.path.join(self.directory, name)))
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _roll_if_full(self):
+        """
+        Con el lock tomado: deja abierto el segmento vigente
+
+        El archivo de lock guarda la base del segmento vigente; si otro
+        proceso lo cambió se sigue en ese, y si está lleno se empieza otro.
+        """
+        current = int(os.pread(self._lock_fd, 20, 0) or b'0')
+        if current != self._segment_base or self._segment_fd is None:
+            self._open_segment(current)
+        size = os.fstat(self._segment_fd).st_size
+        if size >= self.max_segment_bytes:
+            self._start_segment(current + size)
+
+    def _discard_from(self, size: int):
+        """
+        Con el lock tomado: quita del segmento vigente lo escrito a partir de `size`
+
+        Un write parcial dejaría un registro incompleto delante de los
+        siguientes. Si no se puede truncar se empieza un segmento nuevo: los
+        lectores saltan el registro dañado al final de un segmento anterior.
+        """
+        try:
+            os.ftruncate(self._segment_fd, size)
+        except OSError as e:
+            logger.error(f"No se pudo truncar el segmento de eventos: {str(e)}")
+            try:
+                self._start_segment(self._segment_base + os.fstat(self._segment_fd).st_size)
+            except OSError as e:
+                logger.error(f"No se pudo empezar un segmento de eventos nuevo: {str(e)}")
+
+    def _start_segment(self, base: int):
+        """Con el lock tomado: abre el segmento que empieza en `base` y lo marca como vigente"""
+        self._open_segment(base)
+        os.pwrite(self._lock_fd, f"{base:020d}".encode('ascii'), 0)
+
+    def _open_segment(self, base: int):
+        if self._segment_fd is not None:
+            os.close(self._segment_fd)
+        path = os.path.join(self.directory, f"events-{base:020d}.log")
+        self._segment_fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._segment_base = base
+
+    def _close(self):
+        for fd in (self._segment_fd, self._lock_fd):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._segment_fd = self._lock_fd = None
+        self._pid = None
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Tipo no serializable en un evento: {type(value).__name__}")
+
+
+# Registro de eventos del proceso (directorio configurado al crear la app)
+event_log = EventLog()
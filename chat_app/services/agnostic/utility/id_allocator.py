@@ -0,0 +1,73 @@
+import os
+import threading
+from sqlalchemy import text
+from models import db
+
+class IdAllocator:
+    """
+    Utilidad: asignación de IDs por bloques (hi/lo) (Agnóstico)
+
+    Cada proceso reserva en la tabla id_sequences un bloque de `block_size`
+    IDs con una sola transacción corta y después los entrega desde memoria.
+    Así un mensaje tiene su ID definitivo antes de escribirse en la BD.
+
+    Los IDs son únicos entre procesos pero solo crecientes dentro de cada
+    proceso; el orden dentro de una sesión lo da `seq`.
+    """
+
+    def __init__(self, name: str, table: str, block_size: int = 100):
+        """
+        Args:
+            name: Nombre de la secuencia en id_sequences
+            table: Tabla cuyos IDs se asignan (se respeta su MAX(id) actual)
+            block_size: IDs reservados por viaje a la BD
+        """
+        self.name = name
+        self.table = table
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        """
+        Devuelve el siguiente ID (reserva un bloque nuevo si hace falta)
+
+        Requiere un contexto de aplicación. No debe llamarse con una escritura
+        pendiente en la sesión actual: la reserva usa su propia transacción.
+        """
+        with self._lock:
+            # Un bloque heredado por fork() pertenece al proceso padre
+            if self._pid != os.getpid() or self._next >= self._end:
+                self._reserve()
+            value = self._next
+            self._next += 1
+            return value
+
+    def _reserve(self):
+        """Reserva el siguiente bloque de IDs"""
+        with db.engine.begin() as connection:
+            params = {'name': self.name, 'n': self.block_size}
+            connection.execute(text(
+                "INSERT INTO id_sequences (name, next_value) "
+                "SELECT :name, 1 WHERE NOT EXISTS (SELECT 1 FROM id_sequences WHERE name = :name)"
+            ), params)
+            # Nunca por debajo de MAX(id): filas insertadas sin pasar por el asignador
+            floor = connection.execute(text(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {self.table}")).scalar()
+            connection.execute(text(
+                "UPDATE id_sequences SET next_value = "
+                "CASE WHEN next_value > :floor THEN next_value ELSE :floor END + :n "
+                "WHERE name = :name"
+            ), dict(params, floor=floor))
+            end = connection.execute(
+                text("SELECT next_value FROM id_sequences WHERE name = :name"), params
+            ).scalar()
+
+        self._next = end - self.block_size
+        self._end = end
+        self._pid = os.getpid()
+
+
+# Instancia compartida por el proceso
+message_id_allocator = IdAllocator('chat_messages', 'chat_messages')
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, NamedTuple, Optional
+
+
+class UserRecord(NamedTuple):
+    """Datos mínimos de un usuario para validar peticiones"""
+    id: int
+    is_active: bool
+    token_version: int = 0
+    tenant_id: Optional[str] = None
+
+
+class SessionRecord(NamedTuple):
+    """Datos mínimos de una sesión para validar peticiones"""
+    id: int
+    user_id: int
+
+
+class IdentityCache:
+    """
+    Utilidad: caché de lectura de usuarios y sesiones (Agnóstico)
+
+    Guarda registros compactos (UserRecord, SessionRecord) con TTL y límite
+    de entradas (LRU). Las escrituras deben invalidar la entrada afectada;
+    el TTL acota la desactualización entre procesos (cada worker tiene la suya).
+    Los "no encontrado" no se guardan: un ID inexistente puede crearse después.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 60.0):
+        """
+        Args:
+            max_entries: Registros máximos en memoria
+            ttl_seconds: Vigencia de cada registro
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def get_or_load(self, kind: str, key: int, loader: Callable[[int], Optional[tuple]],
+                    ttl_seconds: Optional[float] = None) -> Optional[tuple]:
+        """
+        Devuelve el registro en caché o lo carga con `loader`
+
+        Args:
+            kind: Tipo de registro ('user', 'session', 'token')
+            key: ID del registro
+            loader: Función que lee el registro de la BD (None si no existe)
+            ttl_seconds: Vigencia del registro cargado (None = ttl_seconds de la caché)
+
+        Returns:
+            El registro, o None si no existe
+        """
+        cache_key = (kind, key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(cache_key)
+                self._count(kind, 'hits')
+                return entry[1]
+            self._count(kind, 'misses')
+
+        record = loader(key)
+        if record is not None:
+            self.put(kind, key, record, ttl_seconds)
+        return record
+
+    def put(self, kind: str, key: int, record: tuple, ttl_seconds: Optional[float] = None):
+        """Guarda o reemplaza un registro"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[(kind, key)] = (time.monotonic() + ttl, record)
+            self._entries.move_to_end((kind, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._count(kind, 'evictions')
+
+    def invalidate(self, kind: str, key: int):
+        """Descarta un registro (después de modificarlo o eliminarlo)"""
+        with self._lock:
+            self._entries.pop((kind, key), None)
+
+    def clear(self):
+        """Descarta todos los registros"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Aciertos, fallos y tasa de acierto por tipo de registro"""
+        with self._lock:
+            by_kind = {}
+            for kind, counters in self._counters.items():
+                lookups = counters.get('hits', 0) + counters.get('misses', 0)
+                by_kind[kind] = dict(
+                    counters,
+                    hit_rate=round(counters.get('hits', 0) / lookups, 3) if lookups else None
+                )
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'kinds': by_kind
+            }
+
+    def _count(self, kind: str, name: str):
+        counters = self._counters.setdefault(kind, {'hits': 0, 'misses': 0, 'evictions': 0})
+        counters[name] += 1
+
+
+# Instancia compartida por el proceso
+identity_cache = IdentityCache()
@@ -0,0 +1,139 @@
+import json
+import zlib
+from collections.abc import Iterator as _Iterator
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+
+class JSONStreamEncoder:
+    """
+    Utilidad: serialización JSON por fragmentos (Agnóstico)
+
+    Produce los mismos bytes que json.dumps con las mismas opciones, pero
+    sin construir el documento completo en memoria. Los diccionarios y las
+    listas se recorren nivel por nivel y los iteradores (generadores, map...)
+    se escriben como arrays a medida que se consumen. Cada elemento de un
+    array se codifica de una vez con el codificador de json; los iteradores
+    que contenga se convierten en listas al codificar ese elemento.
+    """
+
+    def __init__(self, indent: Optional[int] = None, sort_keys: bool = False, ensure_ascii: bool = True,
+                 default: Optional[Callable[[Any], Any]] = None, chunk_size: int = 64 * 1024):
+        """
+        Args:
+            indent: Sangría (None = compacto, sin espacios)
+            sort_keys: Ordenar las claves de los diccionarios
+            ensure_ascii: Escapar los caracteres no ASCII
+            default: Función para los tipos que json no serializa
+            chunk_size: Tamaño aproximado de cada fragmento en bytes
+        """
+        self.indent = indent
+        self.sort_keys = sort_keys
+        self.chunk_size = chunk_size
+        self._key_separator = ': ' if indent is not None else ':'
+        self._encoder = json.JSONEncoder(
+            ensure_ascii=ensure_ascii, sort_keys=sort_keys, indent=indent,
+            separators=(',', self._key_separator), default=self._default_for(default)
+        )
+
+    @staticmethod
+    def _default_for(default: Optional[Callable[[Any], Any]]) -> Callable[[Any], Any]:
+        """`default` que además convierte los iteradores anidados en listas"""
+        def encode_default(value: Any) -> Any:
+            if isinstance(value, _Iterator):
+                return list(value)
+            if default is None:
+                raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+            return default(value)
+        return encode_default
+
+    def iter_encode(self, value: Any) -> Iterator[bytes]:
+        """
+        Serializa `value` por fragmentos
+
+        Args:
+            value: Valor a serializar
+
+        Yields:
+            Fragmentos UTF-8 de al menos chunk_size bytes (salvo el último)
+        """
+        buffer = []
+        size = 0
+        for part in self._iter_value(value, 0):
+            buffer.append(part)
+            size += len(part)
+            if size >= self.chunk_size:
+                yield ''.join(buffer).encode('utf-8')
+                buffer = []
+                size = 0
+        if buffer:
+            yield ''.join(buffer).encode('utf-8')
+
+    def _iter_value(self, value: Any, level: int) -> Iterator[str]:
+        if isinstance(value, dict):
+            yield from self._iter_dict(value, level)
+        elif isinstance(value, (list, tuple, _Iterator)):
+            yield from self._iter_array(value, level)
+        else:
+            yield self._encode(value, level)
+
+    def _iter_dict(self, value: dict, level: int) -> Iterator[str]:
+        if not value:
+            yield '{}'
+            return
+        items = sorted(value.items()) if self.sort_keys else value.items()
+        newline = self._newline(level + 1)
+        separator = ','
+        first = True
+        yield '{'
+        for key, item in items:
+            yield f"{'' if first else separator}{newline}{self._encode_key(key)}{self._key_separator}"
+            first = False
+            yield from self._iter_value(item, level + 1)
+        yield self._newline(level) + '}'
+
+    def _iter_array(self, values: Iterable, level: int) -> Iterator[str]:
+        newline = self._newline(level + 1)
+        first = True
+        for item in values:
+            yield f"{'[' if first else ','}{newline}{self._encode(item, level + 1)}"
+            first = False
+        yield '[]' if first else self._newline(level) + ']'
+
+    def _encode(self, value: Any, level: int) -> str:
+        text = self._encoder.encode(value)
+        if self.indent is not None and level:
+            # Las cadenas JSON no contienen saltos de línea sin escapar
+            text = text.replace('\n', self._newline(level))
+        return text
+
+    def _encode_key(self, key: Any) -> str:
+        # Misma conversión de claves que json.dumps
+        if isinstance(key, str):
+            return self._encoder.encode(key)
+        if key is True or key is False or key is None or isinstance(key, (int, float)):
+            return '"' + self._encoder.encode(key) + '"'
+        raise TypeError(f"keys must be str, int, float, bool or None, not {type(key).__name__}")
+
+    def _newline(self, level: int) -> str:
+        if self.indent is None:
+            return ''
+        return '\n' + ' ' * (self.indent * level)
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """
+    Comprime una secuencia de fragmentos como un único flujo gzip
+
+    Args:
+        chunks: Fragmentos sin comprimir
+        level: Nivel de compresión (1-9)
+
+    Yields:
+        Fragmentos comprimidos (se omiten los vacíos)
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
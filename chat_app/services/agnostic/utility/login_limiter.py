@@ -0,0 +1,67 @@
+import threading
+from typing import Dict
+
+
+class LoginLimiter:
+    """
+    Utilidad: límite de inicios de sesión simultáneos por IP y por usuario (Agnóstico)
+
+    Cuenta los intentos en curso (no por ventana de tiempo): como cada intento
+    ocupa el pool de hashing mientras dura, limitar los simultáneos acota
+    cuánto de ese pool puede tomar un solo cliente o un solo nombre de usuario.
+    """
+
+    def __init__(self, max_per_ip: int = 4, max_per_username: int = 2):
+        """
+        Args:
+            max_per_ip: Intentos simultáneos por dirección IP (0 = sin límite)
+            max_per_username: Intentos simultáneos por nombre de usuario (0 = sin límite)
+        """
+        self.max_per_ip = max_per_ip
+        self.max_per_username = max_per_username
+        self._in_flight: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+        self._rejected = {'ip': 0, 'username': 0}
+
+    def try_acquire(self, ip: str, username: str) -> bool:
+        """
+        Reserva un intento para la IP y el usuario
+
+        Returns:
+            True si se reservó (llamar a release al terminar), False si se supera un límite
+        """
+        ip_key, user_key = ('ip', ip), ('username', username.strip().lower())
+        with self._lock:
+            if self.max_per_ip and self._in_flight.get(ip_key, 0) >= self.max_per_ip:
+                self._rejected['ip'] += 1
+                return False
+            if self.max_per_username and self._in_flight.get(user_key, 0) >= self.max_per_username:
+                self._rejected['username'] += 1
+                return False
+            self._in_flight[ip_key] = self._in_flight.get(ip_key, 0) + 1
+            self._in_flight[user_key] = self._in_flight.get(user_key, 0) + 1
+            return True
+
+    def release(self, ip: str, username: str):
+        """Libera el intento reservado con try_acquire"""
+        with self._lock:
+            for key in (('ip', ip), ('username', username.strip().lower())):
+                count = self._in_flight.get(key, 0) - 1
+                if count > 0:
+                    self._in_flight[key] = count
+                else:
+                    self._in_flight.pop(key, None)
+
+    def stats(self) -> dict:
+        """Límites, intentos en curso y rechazos"""
+        with self._lock:
+            return {
+                'max_per_ip': self.max_per_ip,
+                'max_per_username': self.max_per_username,
+                'in_flight': sum(count for (kind, _), count in self._in_flight.items() if kind == 'ip'),
+                'rejected': dict(self._rejected)
+            }
+
+
+# Límite de inicios de sesión del proceso (límites configurados al crear la app)
+login_limiter = LoginLimiter()
@@ -0,0 +1,83 @@
+import threading
+from typing import Dict, List
+from models.message_blob import body_hash, encode_body
+
+
+class MessageCodec:
+    """
+    Utilidad: almacenamiento compacto de los mensajes (Agnóstico)
+
+    Decide qué cuerpos se guardan en message_blobs: los de al menos
+    `min_bytes` bytes, que se comparten entre copias idénticas y se
+    comprimen si así ocupan menos. Por debajo de ese tamaño la referencia
+    (hash + índice) ocupa casi lo mismo que el texto y no conviene.
+
+    No escribe en la BD: prepara las filas y los cuerpos que el servicio de
+    mensajes inserta en la misma transacción. La lectura no depende de esta
+    clase (ChatMessage.content decodifica siempre), así que desactivarla solo
+    afecta a los mensajes nuevos.
+    """
+
+    def __init__(self, enabled: bool = False, min_bytes: int = 256, level: int = 6):
+        """
+        Args:
+            enabled: Codificar los mensajes nuevos
+            min_bytes: Tamaño mínimo del texto (UTF-8) para guardarlo en message_blobs
+            level: Nivel de compresión zlib (1-9)
+        """
+        self.enabled = enabled
+        self.min_bytes = min_bytes
+        self.level = level
+        self._lock = threading.Lock()
+        self._counters = {'encoded': 0, 'encoded_bytes': 0}
+
+    def encode_rows(self, rows: List[Dict], force: bool = False) -> List[Dict]:
+        """
+        Codifica en el lugar las filas de chat_messages que lo justifican
+
+        A cada fila codificada le pone content = '' y su content_hash; las
+        demás quedan con content_hash = None (todas las filas con las mismas claves).
+
+        Args:
+            rows: Diccionarios con 'content' (se modifican)
+            force: Codificar aunque el codec esté desactivado (compactación explícita)
+
+        Returns:
+            Cuerpos a insertar en message_blobs (sin repetir dentro del grupo)
+        """
+        blobs = {}
+        encoded = encoded_bytes = 0
+        for row in rows:
+            row.setdefault('content_hash', None)
+            content = row['content']
+            if not (self.enabled or force) or row['content_hash'] is not None:
+                continue
+            # Cota rápida sin codificar: un carácter ocupa de 1 a 4 bytes en UTF-8
+            if len(content) * 4 < self.min_bytes:
+                continue
+            size = len(content.encode('utf-8'))
+            if size < self.min_bytes:
+                continue
+            digest = body_hash(content)
+            if digest not in blobs:
+                codec, data = encode_body(content, self.level)
+                blobs[digest] = {'hash': digest, 'codec': codec, 'data': data, 'size': size}
+            encoded += 1
+            encoded_bytes += size
+            row['content'] = ''
+            row['content_hash'] = digest
+
+        if encoded:
+            with self._lock:
+                self._counters['encoded'] += encoded
+                self._counters['encoded_bytes'] += encoded_bytes
+        return list(blobs.values())
+
+    def stats(self) -> dict:
+        """Configuración y mensajes codificados desde el arranque"""
+        with self._lock:
+            return {'enabled': self.enabled, 'min_bytes': self.min_bytes, **self._counters}
+
+
+# Codec del proceso (configurado al crear la app)
+message_codec = MessageCodec()
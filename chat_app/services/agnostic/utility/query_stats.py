@@ -0,0 +1,203 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from utils.logger import logger
+
+# Ámbitos abiertos en el contexto actual (por hilo y por greenlet)
+_active_scopes: ContextVar[tuple] = ContextVar('query_scopes', default=())
+
+
+class QueryScope:
+    """Consultas ejecutadas dentro de una petición, evento o bloque"""
+
+    __slots__ = ('name', 'count', 'seconds', 'statements', 'record', '_token')
+
+    def __init__(self, name: str, capture: bool = False, record: bool = True):
+        self.name = name
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Optional[List[str]] = [] if capture else None
+        self.record = record
+        self._token = None
+
+    @property
+    def ms(self) -> float:
+        return round(self.seconds * 1000, 3)
+
+
+class QueryStats:
+    """
+    Utilidad: número y tiempo de las consultas SQL por petición (Agnóstico)
+
+    Escucha los eventos de cursor del engine y suma cada consulta a los
+    ámbitos abiertos en el contexto actual: la petición HTTP, el evento del
+    socket o un bloque de assert_max_queries. Al cerrar un ámbito se acumula
+    por nombre (ruta o evento) y, si supera `warn_queries` consultas o
+    `warn_ms`, se registra como advertencia y entre los peores.
+
+    Las consultas de otros hilos (persistidor, resumidor) no cuentan para la
+    petición que los originó.
+    """
+
+    def __init__(self, enabled: bool = True, warn_queries: int = 25, warn_ms: float = 500.0, max_worst: int = 10):
+        """
+        Args:
+            enabled: Acumular por nombre (assert_max_queries cuenta igual)
+            warn_queries: Consultas de un ámbito a partir de las cuales se advierte
+            warn_ms: Tiempo en consultas de un ámbito a partir del cual se advierte
+            max_worst: Peores ámbitos recordados
+        """
+        self.enabled = enabled
+        self.warn_queries = warn_queries
+        self.warn_ms = warn_ms
+        self.max_worst = max_worst
+        self._lock = threading.Lock()
+        self._by_name: Dict[str, dict] = {}
+        self._worst: List[dict] = []
+        self._totals = {'queries': 0, 'seconds': 0.0}
+
+    def install(self, engine: Engine):
+        """Escucha las consultas del engine (una sola vez por engine)"""
+        if event.contains(engine, 'before_cursor_execute', self._before_execute):
+            return
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    def begin(self, name: str, capture: bool = False, record: bool = True) -> QueryScope:
+        """
+        Abre un ámbito en el contexto actual
+
+        Args:
+            name: Nombre con el que se acumula (p. ej. "GET /api/conversations/<int:session_id>")
+            capture: Guardar el SQL de cada consulta
+            record: Acumular el ámbito en las estadísticas al cerrarlo
+
+        Returns:
+            QueryScope que se cierra con end
+        """
+        scope = QueryScope(name, capture, record)
+        scope._token = _active_scopes.set(_active_scopes.get() + (scope,))
+        return scope
+
+    def end(self, scope: QueryScope) -> QueryScope:
+        """Cierra un ámbito abierto con begin y lo acumula"""
+        try:
+            _active_scopes.reset(scope._token)
+        except ValueError:
+            # Cerrado desde otro contexto: quitarlo sin restaurar el anterior
+            _active_scopes.set(tuple(s for s in _active_scopes.get() if s is not scope))
+        if self.enabled and scope.record:
+            self._record(scope)
+        return scope
+
+    @contextmanager
+    def track(self, name: str, capture: bool = False, record: bool = True) -> Iterator[QueryScope]:
+        """Cuenta las consultas del bloque (ver begin)"""
+        scope = self.begin(name, capture, record)
+        try:
+            yield scope
+        finally:
+            self.end(scope)
+
+    def tracked(self, name: str) -> Callable:
+        """Decorador: cuenta las consultas de cada llamada (p. ej. un evento del socket)"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.track(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def assert_max_queries(self, limit: int, name: str = 'assert_max_queries') -> Iterator[QueryScope]:
+        """
+        Falla si el bloque ejecuta más de `limit` consultas (para los tests)
+
+        Fija el costo de un endpoint: un N+1 nuevo (p. ej. una relación
+        perezosa recorrida en un bucle) rompe el test en vez de notarse en
+        producción.
+
+        Raises:
+            AssertionError: Con las consultas ejecutadas, si se superó el límite
+        """
+        with self.track(name, capture=True, record=False) as scope:
+            yield scope
+        if scope.count > limit:
+            listing = '\n'.join(f"  {number}. {sql}" for number, sql in enumerate(scope.statements, start=1))
+            raise AssertionError(f"{name}: {scope.count} consultas (máximo {limit}):\n{listing}")
+
+    def stats(self) -> dict:
+        """Totales, acumulados por nombre y peores ámbitos"""
+        with self._lock:
+            by_name = {
+                name: dict(
+                    entry,
+                    ms=round(entry['ms'], 3),
+                    avg_queries=round(entry['queries'] / entry['calls'], 2),
+                    avg_ms=round(entry['ms'] / entry['calls'], 3)
+                )
+                for name, entry in sorted(self._by_name.items(), key=lambda item: -item[1]['queries'])
+            }
+            return {
+                'enabled': self.enabled,
+                'queries': self._totals['queries'],
+                'query_ms': round(self._totals['seconds'] * 1000, 3),
+                'warn_queries': self.warn_queries,
+                'warn_ms': self.warn_ms,
+                'by_name': by_name,
+                'worst': list(self._worst)
+            }
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('query_started')
+        elapsed = time.perf_counter() - started.pop() if started else 0.0
+        for scope in _active_scopes.get():
+            scope.count += 1
+            scope.seconds += elapsed
+            if scope.statements is not None:
+                scope.statements.append(' '.join(statement.split()))
+        if self.enabled:
+            with self._lock:
+                self._totals['queries'] += 1
+                self._totals['seconds'] += elapsed
+
+    def _handle_error(self, exception_context):
+        # La consulta falló: after_cursor_execute no se llama (el contexto no
+        # siempre tiene el atributo cursor, p. ej. si falló al crearlo)
+        connection = exception_context.connection
+        started = connection.info.get('query_started') if connection is not None else None
+        if started and getattr(exception_context, 'cursor', None) is not None:
+            started.pop()
+
+    def _record(self, scope: QueryScope):
+        ms = scope.seconds * 1000
+        slow = scope.count >= self.warn_queries or ms >= self.warn_ms
+        with self._lock:
+            entry = self._by_name.setdefault(
+                scope.name, {'calls': 0, 'queries': 0, 'max_queries': 0, 'ms': 0.0, 'max_ms': 0.0}
+            )
+            entry['calls'] += 1
+            entry['queries'] += scope.count
+            entry['max_queries'] = max(entry['max_queries'], scope.count)
+            entry['ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], round(ms, 3))
+            if slow:
+                self._worst.append({'name': scope.name, 'queries': scope.count, 'ms': scope.ms, 'at': time.time()})
+                self._worst.sort(key=lambda item: (item['queries'], item['ms']), reverse=True)
+                del self._worst[self.max_worst:]
+        if slow:
+            logger.warning(f"{scope.name}: {scope.count} consultas en {scope.ms} ms")
+
+
+# Estadísticas de consultas del proceso (instaladas sobre el engine al crear la app)
+query_stats = QueryStats()
@@ -0,0 +1,184 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from services.agnostic.utility.text_utils import TextUtils
+
+class _UserIndex:
+    """Índice invertido de los mensajes de un usuario"""
+
+    __slots__ = ('postings', 'doc_lengths', 'doc_sessions', 'total_length', 'expires_at')
+
+    def __init__(self, expires_at: float = math.inf):
+        # {término: {doc_id: frecuencia}}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        # {doc_id: número de términos}
+        self.doc_lengths: Dict[int, int] = {}
+        # {doc_id: session_id}
+        self.doc_sessions: Dict[int, int] = {}
+        self.total_length = 0
+        # Momento (time.monotonic) a partir del cual se recarga desde la BD
+        self.expires_at = expires_at
+
+
+class RetrievalIndex:
+    """
+    Utilidad: índice BM25 incremental por usuario (Agnóstico)
+
+    Mantiene en memoria un índice invertido sobre los mensajes de cada usuario.
+    Los usuarios se cargan bajo demanda y se desalojan por LRU cuando se supera
+    max_users; un usuario no cargado se reconstruye desde la BD al consultarlo.
+    Cada índice caduca ttl_seconds después de cargarse: los mensajes guardados,
+    archivados o eliminados por otros workers aparecen en la recarga siguiente.
+    """
+
+    def __init__(self, max_users: int = 1000, ttl_seconds: float = 300.0,
+                 k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            max_users: Usuarios con índice residente en memoria
+            ttl_seconds: Vigencia de un índice cargado (0 = sin caducidad)
+            k1: Saturación de frecuencia de términos (BM25)
+            b: Normalización por longitud de documento (BM25)
+        """
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.k1 = k1
+        self.b = b
+        self._users: "OrderedDict[int, _UserIndex]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def has_user(self, user_id: int) -> bool:
+        """Indica si el índice del usuario está cargado y no ha caducado"""
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None:
+                return False
+            if index.expires_at <= time.monotonic():
+                del self._users[user_id]
+                return False
+            return True
+
+    def load_user(self, user_id: int, documents) -> int:
+        """
+        Reemplaza el índice de un usuario a partir de sus documentos
+
+        Args:
+            user_id: ID del usuario
+            documents: Iterable de (doc_id, session_id, texto)
+
+        Returns:
+            Número de documentos indexados
+        """
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds > 0 else math.inf
+        index = _UserIndex(expires_at)
+        count = 0
+        for doc_id, session_id, text in documents:
+            self._add_to(index, doc_id, session_id, text)
+            count += 1
+
+        with self._lock:
+            self._users[user_id] = index
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return count
+
+    def add(self, user_id: int, doc_id: int, session_id: int, text: str) -> bool:
+        """
+        Agrega un documento al índice del usuario si está cargado
+
+        Si el usuario no está en memoria no se hace nada: su índice se
+        reconstruirá completo desde la BD en la próxima consulta.
+
+        Returns:
+            True si el documento se indexó
+        """
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None:
+                return False
+            self._add_to(index, doc_id, session_id, text)
+            return True
+
+    def remove_user(self, user_id: int):
+        """Descarta el índice de un usuario (se reconstruirá bajo demanda)"""
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        """Descarta todos los índices"""
+        with self._lock:
+            self._users.clear()
+
+    def search(self, user_id: int, query: str, top_k: int = 3,
+               exclude_session_id: Optional[int] = None) -> List[Tuple[int, int, float]]:
+        """
+        Busca los documentos más relevantes del usuario
+
+        Args:
+            user_id: ID del usuario (su índice debe estar cargado)
+            query: Texto de la consulta
+            top_k: Número máximo de resultados
+            exclude_session_id: Sesión cuyos mensajes se omiten
+
+        Returns:
+            Lista de (doc_id, session_id, puntuación) ordenada por relevancia
+        """
+        terms = set(TextUtils.tokenize(query))
+        if not terms or top_k <= 0:
+            return []
+
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None or not index.doc_lengths:
+                return []
+            self._users.move_to_end(user_id)
+
+            total_docs = len(index.doc_lengths)
+            avg_length = index.total_length / total_docs
+            scores: Dict[int, float] = {}
+
+            for term in terms:
+                postings = index.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log((total_docs - len(postings) + 0.5) / (len(postings) + 0.5) + 1)
+                for doc_id, frequency in postings.items():
+                    if exclude_session_id is not None and index.doc_sessions[doc_id] == exclude_session_id:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * index.doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            return [(doc_id, index.doc_sessions[doc_id], score) for doc_id, score in ranked]
+
+    def stats(self) -> dict:
+        """Tamaño del índice residente"""
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'documents': sum(len(index.doc_lengths) for index in self._users.values()),
+                'terms': sum(len(index.postings) for index in self._users.values())
+            }
+
+    def _add_to(self, index: _UserIndex, doc_id: int, session_id: int, text: str):
+        """Indexa un documento (ignora documentos ya indexados)"""
+        if doc_id in index.doc_lengths:
+            return
+
+        terms = TextUtils.tokenize(text)
+        frequencies: Dict[str, int] = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, frequency in frequencies.items():
+            index.postings.setdefault(term, {})[doc_id] = frequency
+
+        index.doc_lengths[doc_id] = len(terms)
+        index.doc_sessions[doc_id] = session_id
+        index.total_length += len(terms)
+
+
+# Instancia compartida por el proceso
+retrieval_index = RetrievalIndex()
@@ -0,0 +1,158 @@
+import os
+import re
+import struct
+import threading
+import zlib
+from typing import Dict, NamedTuple
+
+# Cabecera de cada registro: marca, longitud del contenido y CRC32
+_HEADER = struct.Struct('>4sII')
+_MAGIC = b'SEG1'
+_SEGMENT_PATTERN = re.compile(r'^segment-(\d{5})\.seg$')
+
+
+class SegmentRecord(NamedTuple):
+    """Ubicación de un registro dentro de los segmentos"""
+    segment: str
+    offset: int
+    length: int
+    crc: int
+
+
+class SegmentStore:
+    """
+    Utilidad: archivos de segmentos de solo escritura al final (Agnóstico)
+
+    Cada registro se agrega al último segmento con una cabecera (marca,
+    longitud, CRC32) y se sincroniza a disco antes de devolver su ubicación;
+    los registros no se modifican. Al superar `max_segment_bytes` se abre un
+    segmento nuevo. El índice de registros lo guarda el llamador, que también
+    decide cuándo un segmento ya no tiene registros vivos y puede borrarse.
+    """
+
+    def __init__(self, directory: str = 'archive', max_segment_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            directory: Directorio de los segmentos
+            max_segment_bytes: Tamaño a partir del cual se abre un segmento nuevo
+        """
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self._lock = threading.Lock()
+
+    def append(self, payload: bytes) -> SegmentRecord:
+        """
+        Agrega un registro y lo sincroniza a disco
+
+        Args:
+            payload: Contenido del registro
+
+        Returns:
+            SegmentRecord con la ubicación del registro
+        """
+        crc = zlib.crc32(payload)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            segment = self._current_segment()
+            path = os.path.join(self.directory, segment)
+            with open(path, 'ab') as handle:
+                offset = handle.tell()
+                handle.write(_HEADER.pack(_MAGIC, len(payload), crc))
+                handle.write(payload)
+                handle.flush()
+                os.fsync(handle.fileno())
+        return SegmentRecord(segment, offset, len(payload), crc)
+
+    def read(self, record: SegmentRecord) -> bytes:
+        """
+        Lee un registro y verifica su cabecera y su CRC
+
+        Raises:
+            ValueError: Si el registro no coincide con el índice o está dañado
+        """
+        with open(os.path.join(self.directory, record.segment), 'rb') as handle:
+            handle.seek(record.offset)
+            magic, length, crc = _HEADER.unpack(handle.read(_HEADER.size))
+            payload = handle.read(length)
+
+        if magic != _MAGIC or length != record.length or crc != record.crc:
+            raise ValueError(f"Registro inválido en {record.segment}@{record.offset}")
+        if zlib.crc32(payload) != crc:
+            raise ValueError(f"CRC incorrecto en {record.segment}@{record.offset}")
+        return payload
+
+    @staticmethod
+    def record_size(length: int) -> int:
+        """Bytes que ocupa en disco un registro de `length` bytes de contenido"""
+        return _HEADER.size + length
+
+    def segment_sizes(self) -> Dict[str, int]:
+        """Bytes en disco de cada segmento, en orden de creación"""
+        return {name: os.path.getsize(os.path.join(self.directory, name)) for name in self._segments()}
+
+    def segment_mtime(self, segment: str) -> float:
+        """Última modificación de un segmento (time.time)"""
+        return os.path.getmtime(os.path.join(self.directory, segment))
+
+    def rotate(self) -> str:
+        """
+        Abre un segmento vacío: los registros siguientes ya no se agregan al actual
+
+        Returns:
+            Nombre del segmento nuevo
+        """
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            segments = self._segments()
+            number = int(_SEGMENT_PATTERN.match(segments[-1]).group(1)) + 1 if segments else 1
+            segment = f"segment-{number:05d}.seg"
+            open(os.path.join(self.directory, segment), 'ab').close()
+        return segment
+
+    def remove(self, segment: str) -> int:
+        """
+        Borra un segmento
+
+        Returns:
+            Bytes liberados (0 si no existía)
+        """
+        if not _SEGMENT_PATTERN.match(segment):
+            raise ValueError(f"Nombre de segmento inválido: {segment}")
+        path = os.path.join(self.directory, segment)
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                return 0
+        return size
+
+    def stats(self) -> dict:
+        """Número de segmentos y bytes en disco"""
+        sizes = self.segment_sizes()
+        return {
+            'directory': self.directory,
+            'segments': len(sizes),
+            'bytes': sum(sizes.values())
+        }
+
+    def _segments(self) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if _SEGMENT_PATTERN.match(name))
+
+    def _current_segment(self) -> str:
+        """Último segmento, o uno nuevo si está lleno"""
+        segments = self._segments()
+        if segments:
+            last = segments[-1]
+            if os.path.getsize(os.path.join(self.directory, last)) < self.max_segment_bytes:
+                return last
+            number = int(_SEGMENT_PATTERN.match(last).group(1)) + 1
+        else:
+            number = 1
+        return f"segment-{number:05d}.seg"
+
+
+# Segmentos del archivo de sesiones inactivas (directorio configurado al crear la app)
+archive_store = SegmentStore()
@@ -0,0 +1,173 @@
+import hashlib
+import threading
+from typing import Callable, Optional, Tuple
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from services.agnostic.utility.identity_cache import identity_cache, UserRecord
+
+# Mensaje por código de rechazo de SessionTokens.authorize
+TOKEN_ERROR_MESSAGES = {
+    'TOKEN_REQUIRED': "Token de sesión requerido",
+    'INVALID_TOKEN': "Token de sesión inválido o vencido",
+    'UNAUTHORIZED': "El token no corresponde al usuario"
+}
+
+
+class SessionTokens:
+    """
+    Utilidad: tokens de sesión firmados (Agnóstico)
+
+    El login emite un token firmado (HMAC-SHA256) con el ID del usuario y su
+    versión de tokens (users.token_version). Verificarlo es comprobar la
+    firma y la vigencia y comparar la versión con la actual del usuario,
+    leída con `loader` y guardada en identity_cache solo `check_ttl`
+    segundos: una consulta pequeña por usuario cada pocos segundos.
+
+    Desactivar o eliminar un usuario incrementa su versión en la BD (o borra
+    la fila), así que sus tokens anteriores dejan de valer en todos los
+    workers en a lo sumo `check_ttl` segundos (en el propio proceso, de
+    inmediato con revoke). Un login posterior, aunque sea en el mismo
+    segundo, recibe la versión nueva.
+    """
+
+    def __init__(self, secret_key: str = 'dev', expires_seconds: int = 3600,
+                 check_ttl: float = 5.0, required: bool = False):
+        """
+        Args:
+            secret_key: Clave de firma
+            expires_seconds: Vigencia de cada token
+            check_ttl: Segundos que se reutiliza la versión leída de un usuario
+            required: Exigir token en las peticiones (False = se acepta solo user_id)
+        """
+        self.expires_seconds = expires_seconds
+        self.check_ttl = check_ttl
+        self.required = required
+        # Lee el UserRecord actual de la BD (lo asigna la app; None = solo se verifica la firma)
+        self.loader: Optional[Callable[[int], Optional[UserRecord]]] = None
+        self._serializer = self._build_serializer(secret_key)
+        self._lock = threading.Lock()
+        self._counters = {'issued': 0, 'verified': 0, 'invalid': 0, 'expired': 0, 'revoked': 0}
+
+    def configure(self, secret_key: str, expires_seconds: int, check_ttl: float, required: bool):
+        """Aplica la configuración de la app (invalida los tokens firmados con otra clave)"""
+        self._serializer = self._build_serializer(secret_key)
+        self.expires_seconds = expires_seconds
+        self.check_ttl = check_ttl
+        self.required = required
+
+    @staticmethod
+    def _build_serializer(secret_key: str) -> URLSafeTimedSerializer:
+        return URLSafeTimedSerializer(
+            secret_key, salt='session-token', signer_kwargs={'digest_method': hashlib.sha256}
+        )
+
+    def issue(self, user_id: int) -> str:
+        """
+        Emite un token para el usuario con su versión actual (leída de la BD)
+
+        Args:
+            user_id: ID del usuario
+
+        Returns:
+            Token firmado (seguro para URLs y cabeceras)
+        """
+        record = self._current(user_id, fresh=True)
+        with self._lock:
+            self._counters['issued'] += 1
+        version = record.token_version if record else 0
+        return self._serializer.dumps({'uid': user_id, 'ver': version})
+
+    def verify(self, token: str) -> Optional[UserRecord]:
+        """
+        Verifica un token: firma, vigencia y versión del usuario
+
+        Args:
+            token: Token emitido por issue
+
+        Returns:
+            UserRecord del usuario, o None si el token es inválido, venció,
+            fue revocado o el usuario está inactivo
+        """
+        try:
+            payload = self._serializer.loads(token, max_age=self.expires_seconds)
+            user_id = int(payload['uid'])
+            version = int(payload['ver'])
+        except SignatureExpired:
+            return self._reject('expired')
+        except (BadSignature, KeyError, TypeError, ValueError):
+            return self._reject('invalid')
+
+        record = self._current(user_id)
+        if self.loader is not None and (
+            record is None or not record.is_active or record.token_version != version
+        ):
+            return self._reject('revoked')
+        with self._lock:
+            self._counters['verified'] += 1
+        return record or UserRecord(user_id, True, version)
+
+    def authorize(self, token: Optional[str], user_id: Optional[int] = None) -> Tuple[Optional[UserRecord], Optional[str]]:
+        """
+        Resuelve el usuario de una petición a partir del token
+
+        Args:
+            token: Token recibido (None si la petición no trae)
+            user_id: ID de usuario indicado en la petición, si lo hay
+
+        Returns:
+            (UserRecord, None) con un token válido del mismo usuario;
+            (None, None) sin token cuando no es obligatorio (el llamador
+            valida el user_id como antes); (None, código de error) si se
+            rechaza: TOKEN_REQUIRED, INVALID_TOKEN o UNAUTHORIZED
+        """
+        if not token:
+            return (None, 'TOKEN_REQUIRED') if self.required else (None, None)
+        identity = self.verify(token)
+        if identity is None:
+            return None, 'INVALID_TOKEN'
+        if user_id is not None:
+            try:
+                matches = int(user_id) == identity.id
+            except (TypeError, ValueError):
+                matches = False
+            if not matches:
+                return None, 'UNAUTHORIZED'
+        return identity, None
+
+    def revoke(self, user_id: int):
+        """
+        Descarta la versión guardada del usuario en este proceso
+
+        Se llama después de desactivarlo o eliminarlo (con la versión ya
+        incrementada en la BD); los demás workers la releen al vencer check_ttl.
+
+        Args:
+            user_id: ID del usuario
+        """
+        identity_cache.invalidate('token', user_id)
+
+    def _current(self, user_id: int, fresh: bool = False) -> Optional[UserRecord]:
+        """UserRecord actual del usuario (None sin loader o si no existe)"""
+        if self.loader is None:
+            return None
+        if fresh:
+            identity_cache.invalidate('token', user_id)
+        return identity_cache.get_or_load('token', user_id, self.loader, ttl_seconds=self.check_ttl)
+
+    def _reject(self, reason: str) -> None:
+        with self._lock:
+            self._counters[reason] += 1
+        return None
+
+    def stats(self) -> dict:
+        """Contadores de emisión y verificación"""
+        with self._lock:
+            return {
+                'expires_seconds': self.expires_seconds,
+                'check_ttl': self.check_ttl,
+                'required': self.required,
+                **self._counters
+            }
+
+
+# Tokens de sesión del proceso (clave, vigencia y loader configurados al crear la app)
+session_tokens = SessionTokens()
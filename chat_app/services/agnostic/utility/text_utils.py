@@ -1,5 +1,21 @@
 import re
-from typing import Optional
+import unicodedata
+from collections import Counter
+from typing import Optional, List
+
+# Palabras vacías (español e inglés) ignoradas al indexar o resumir
+STOPWORDS = {
+    'a', 'al', 'algo', 'como', 'con', 'de', 'del', 'el', 'ella', 'en', 'es', 'esa', 'ese',
+    'esta', 'este', 'esto', 'fue', 'ha', 'hay', 'la', 'las', 'le', 'lo', 'los', 'me', 'mi',
+    'muy', 'mas', 'no', 'o', 'para', 'pero', 'por', 'que', 'se', 'si', 'sin', 'su', 'sus',
+    'te', 'tu', 'un', 'una', 'uno', 'y', 'ya', 'yo',
+    'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'do', 'for', 'from', 'have', 'i',
+    'in', 'is', 'it', 'my', 'of', 'on', 'or', 'so', 'that', 'the', 'this', 'to', 'was',
+    'we', 'with', 'you'
+}
+
+_WORD_PATTERN = re.compile(r'\w+')
+_SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+')
 
 class TextUtils:
     """Servicio de Utilidad para procesamiento de texto (Agnóstico)"""
@@ -63,4 +79,56 @@ class TextUtils:
         offensive_words = ['spam', 'scam']  # Agregar más según contexto
         
         text_lower = text.lower()
-        return any(word in text_lower for word in offensive_words)
\ No newline at end of file
+        return any(word in text_lower for word in offensive_words)
+    
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        """Divide el texto en términos normalizados (minúsculas, sin acentos ni palabras vacías)"""
+        if not text:
+            return []
+        
+        normalized = unicodedata.normalize('NFKD', text.lower())
+        normalized = ''.join(c for c in normalized if not unicodedata.combining(c))
+        return [
+            word for word in _WORD_PATTERN.findall(normalized)
+            if len(word) > 1 and word not in STOPWORDS
+        ]
+    
+    @staticmethod
+    def extractive_summary(texts: List[str], max_sentences: int = 5, max_chars: int = 500) -> str:
+        """
+        Resume extrayendo las oraciones más representativas de los textos
+        
+        Las oraciones se puntúan por la frecuencia de sus términos en el conjunto
+        y se devuelven en su orden original.
+        
+        Args:
+            texts: Textos a resumir (p. ej. resumen anterior + turnos nuevos)
+            max_sentences: Número máximo de oraciones en el resumen
+            max_chars: Longitud máxima del resumen
+        
+        Returns:
+            Resumen extractivo
+        """
+        sentences = []
+        for text in texts:
+            for sentence in _SENTENCE_PATTERN.split(TextUtils.clean_text(text)):
+                if sentence and sentence not in sentences:
+                    sentences.append(sentence)
+        
+        if not sentences:
+            return ""
+        
+        frequencies = Counter(term for sentence in sentences for term in TextUtils.tokenize(sentence))
+        
+        def score(sentence: str) -> float:
+            terms = TextUtils.tokenize(sentence)
+            if not terms:
+                return 0.0
+            return sum(frequencies[term] for term in terms) / len(terms)
+        
+        ranked = sorted(range(len(sentences)), key=lambda i: score(sentences[i]), reverse=True)
+        selected = sorted(ranked[:max_sentences])
+        
+        summary = ' '.join(sentences[i] for i in selected)
+        return TextUtils.truncate_text(summary, max_chars)
\ No newline at end of file
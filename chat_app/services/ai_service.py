@@ -1,6 +1,15 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
+from collections import deque
+from contextlib import nullcontext
+import time
 from transformers import AutoModelForCausalLM, AutoTokenizer
 import torch
+from services.lora_adapters import AdapterManager, inject_lora, DEFAULT_TARGET_MODULES
+
+# Longitudes de prompt (en tokens) para las que se compila el modelo
+DEFAULT_SHAPE_BUCKETS = (32, 64, 128, 256)
+# Nuevos tokens generados en modo compilado (fija el tamaño de la caché estática)
+DEFAULT_COMPILED_NEW_TOKENS = 128
 
 class AIService:
     """
@@ -19,6 +28,18 @@ class AIService:
         self.tokenizer = None
         self.model = None
         self._is_loaded = False
+        
+        # Modo compilado (opcional)
+        self._compiled = False
+        self.shape_buckets: Tuple[int, ...] = DEFAULT_SHAPE_BUCKETS
+        self.compiled_new_tokens = DEFAULT_COMPILED_NEW_TOKENS
+        # Adaptadores LoRA por tenant (opcional)
+        self.adapters: Optional[AdapterManager] = None
+        # Latencia por token generado, en ms, por modo de ejecución
+        self._token_latency = {
+            'eager': deque(maxlen=500),
+            'compiled': deque(maxlen=500)
+        }
     
     def load_model(self) -> bool:
         """
@@ -52,17 +73,227 @@ class AIService:
             self.tokenizer = None
             return False
     
+    def freeze_for_sharing(self, use_shared_memory: bool = True) -> bool:
+        """
+        Congela los pesos del modelo para compartirlos entre procesos (pre-fork)
+        
+        Pone el modelo en modo inferencia, desactiva los gradientes y, opcionalmente,
+        mueve los tensores a memoria compartida. Así los workers creados con fork()
+        leen las mismas páginas físicas en lugar de obtener una copia cada uno.
+        
+        Args:
+            use_shared_memory: Mover los pesos a memoria compartida (/dev/shm)
+        
+        Returns:
+            True si el modelo quedó congelado
+        """
+        if not self.is_ready():
+            return False
+        
+        self.model.eval()
+        self.model.requires_grad_(False)
+        if use_shared_memory:
+            self.model.share_memory()
+        return True
+    
     def is_ready(self) -> bool:
         """Verifica si el servicio está listo para generar respuestas"""
         return self._is_loaded
     
-    def query_ai_model(self, input_text: str, max_length: int = 1000) -> Optional[str]:
+    def enable_compiled_mode(self, shape_buckets: Optional[List[int]] = None,
+                             new_tokens: int = DEFAULT_COMPILED_NEW_TOKENS,
+                             backend: str = "inductor") -> bool:
+        """
+        Activa el modo compilado (torch.compile) para la generación
+        
+        Los prompts se rellenan por la izquierda hasta el bucket más cercano y la
+        generación usa una caché KV estática, de modo que cada bucket produce
+        formas fijas (un grafo para el prefill y otro para cada paso de decodificación).
+        Los prompts más largos que el mayor bucket se ejecutan en modo eager.
+        
+        Args:
+            shape_buckets: Longitudes de prompt a compilar
+            new_tokens: Tokens nuevos por respuesta en modo compilado
+            backend: Backend de torch.compile
+        
+        Returns:
+            True si el modo compilado quedó activo
+        """
+        if not self.is_ready():
+            print("No se puede compilar: el modelo no está cargado")
+            return False
+        
+        if not hasattr(torch, 'compile'):
+            print("torch.compile no disponible, se mantiene el modo eager")
+            return False
+        
+        if shape_buckets:
+            self.shape_buckets = tuple(sorted(set(shape_buckets)))
+        self.compiled_new_tokens = new_tokens
+        
+        self.model.eval()
+        self.model.forward = torch.compile(self.model.forward, backend=backend, dynamic=False)
+        self._compiled = True
+        print(f"Modo compilado activo (buckets: {self.shape_buckets})")
+        return True
+    
+    def enable_adapters(self, adapters_dir: str, memory_budget_mb: float = 256,
+                        target_modules: Tuple[str, ...] = DEFAULT_TARGET_MODULES) -> bool:
+        """
+        Prepara el modelo base para servir adaptadores LoRA por tenant
+        
+        Args:
+            adapters_dir: Directorio con un subdirectorio por adaptador
+            memory_budget_mb: Memoria máxima de adaptadores residentes
+            target_modules: Capas del modelo que llevan adaptador
+        
+        Returns:
+            True si los adaptadores quedaron habilitados
+        """
+        if not self.is_ready():
+            print("No se pueden habilitar adaptadores: el modelo no está cargado")
+            return False
+        
+        wrapped = inject_lora(self.model, target_modules)
+        if not wrapped:
+            print(f"El modelo no tiene capas {target_modules}, adaptadores deshabilitados")
+            return False
+        
+        self.adapters = AdapterManager(self.model, adapters_dir, int(memory_budget_mb * 1024 * 1024))
+        print(f"Adaptadores LoRA habilitados sobre {len(wrapped)} capas ({adapters_dir})")
+        return True
+    
+    def warm_up(self) -> Dict[str, Any]:
+        """
+        Dispara la compilación para cada bucket y mide eager vs. compilado
+        
+        Returns:
+            Reporte de latencia por token de ambos modos
+        """
+        if not self._compiled:
+            return self.latency_report()
+        
+        for bucket in self.shape_buckets:
+            # Prompt sintético que ocupa el bucket completo; el modo compilado se
+            # ejecuta dos veces porque la segunda pasada recompila con la caché ya creada
+            input_ids = torch.full((1, bucket), self.tokenizer.eos_token_id, dtype=torch.long)
+            for mode in ('compiled', 'compiled', 'eager'):
+                start = time.perf_counter()
+                try:
+                    self._generate(input_ids, torch.ones_like(input_ids), bucket, mode)
+                except Exception as e:
+                    print(f"Error en warm-up (bucket {bucket}, {mode}): {str(e)}")
+                    continue
+                print(f"Warm-up bucket {bucket} ({mode}): {time.perf_counter() - start:.2f}s")
+        
+        # Las mediciones del warm-up incluyen la compilación; se descartan
+        for samples in self._token_latency.values():
+            samples.clear()
+        # Una pasada más por bucket ya compilado para tener una comparación limpia
+        for bucket in self.shape_buckets:
+            input_ids = torch.full((1, bucket), self.tokenizer.eos_token_id, dtype=torch.long)
+            for mode in ('compiled', 'eager'):
+                try:
+                    self._generate(input_ids, torch.ones_like(input_ids), bucket, mode)
+                except Exception:
+                    continue
+        
+        report = self.latency_report()
+        print(f"Latencia por token tras warm-up: {report}")
+        return report
+    
+    def latency_report(self) -> Dict[str, Any]:
+        """
+        Reporta la latencia por token generado en modo eager y compilado
+        
+        Returns:
+            Diccionario con muestras, media, p50 y p95 (ms/token) por modo
+        """
+        report = {'compiled_mode': self._compiled, 'shape_buckets': list(self.shape_buckets)}
+        if self.adapters:
+            report['adapters'] = self.adapters.stats()
+        for mode, samples in self._token_latency.items():
+            values = sorted(samples)
+            if not values:
+                report[mode] = {'samples': 0}
+                continue
+            report[mode] = {
+                'samples': len(values),
+                'mean_ms_per_token': round(sum(values) / len(values), 3),
+                'p50_ms_per_token': round(values[len(values) // 2], 3),
+                'p95_ms_per_token': round(values[min(len(values) - 1, int(len(values) * 0.95))], 3)
+            }
+        return report
+    
+    def _select_bucket(self, length: int) -> Optional[int]:
+        """Devuelve el bucket más pequeño que contiene el prompt, o None si no cabe"""
+        if not self._compiled:
+            return None
+        for bucket in self.shape_buckets:
+            if length <= bucket:
+                return bucket
+        return None
+    
+    def _generate(self, input_ids, attention_mask, bucket: Optional[int], mode: str,
+                  max_length: int = 1000):
+        """
+        Ejecuta model.generate en el modo indicado y registra la latencia por token
+        
+        Args:
+            input_ids: Tokens del prompt (ya rellenados si hay bucket)
+            attention_mask: Máscara de atención del prompt
+            bucket: Bucket de forma fija o None para longitud libre
+            mode: 'compiled' o 'eager'
+            max_length: Longitud máxima total cuando no hay bucket
+        """
+        prompt_length = input_ids.shape[-1]
+        generation_kwargs = dict(
+            attention_mask=attention_mask,
+            pad_token_id=self.tokenizer.eos_token_id,
+            do_sample=True,
+            temperature=0.7,  # Controlar creatividad
+            top_p=0.9,
+            top_k=50,
+            num_return_sequences=1,
+            no_repeat_ngram_size=2  # Evitar repeticiones
+        )
+        if bucket is not None:
+            # Caché estática: mismas formas en cada paso para el grafo compilado
+            generation_kwargs.update(
+                max_new_tokens=self.compiled_new_tokens,
+                min_new_tokens=max(0, 20 - int(attention_mask.sum())),
+                cache_implementation="static"
+            )
+        else:
+            generation_kwargs.update(max_length=max_length, min_length=20)
+        
+        stance = nullcontext()
+        if self._compiled and mode == 'eager':
+            stance = torch.compiler.set_stance("force_eager")
+        
+        start = time.perf_counter()
+        with stance:
+            outputs = self.model.generate(input_ids, **generation_kwargs)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        
+        new_tokens = outputs.shape[-1] - prompt_length
+        if new_tokens > 0:
+            self._token_latency[mode].append(elapsed_ms / new_tokens)
+        return outputs
+    
+    def query_ai_model(self, input_text: str, max_length: int = 1000,
+                       context: Optional[List[str]] = None,
+                       max_context_tokens: int = 512,
+                       adapter_id: Optional[str] = None) -> Optional[str]:
         """
         Consulta genérica al modelo de IA
         
         Args:
             input_text: Texto de entrada para el modelo
-            max_length: Longitud máxima de la respuesta
+            max_length: Longitud máxima de la respuesta (modo eager)
+            context: Turnos previos (resumen y/o mensajes recientes) en orden cronológico
+            max_context_tokens: Tokens máximos del prompt; el contexto más antiguo se recorta
+            adapter_id: Adaptador LoRA del tenant; None usa el modelo base
         
         Returns:
             Texto generado por el modelo o None si hay error
@@ -77,32 +308,54 @@ class AIService:
         
         try:
             print(f"Procesando entrada: '{input_text}'")
-            # Tokenizar entrada
-            inputs = self.tokenizer.encode(input_text + self.tokenizer.eos_token, 
-                                          return_tensors='pt')
+            # Tokenizar entrada (cada turno del contexto termina en EOS, como en DialoGPT)
+            input_ids = self.tokenizer.encode(input_text + self.tokenizer.eos_token)
+            context_ids = []
+            for turn in context or []:
+                context_ids.extend(self.tokenizer.encode(turn + self.tokenizer.eos_token))
+            budget = max(0, max_context_tokens - len(input_ids))
+            context_ids = context_ids[-budget:] if budget else []
+            
+            inputs = torch.tensor([context_ids + input_ids], dtype=torch.long)
+            attention_mask = torch.ones_like(inputs)
+            
+            bucket = self._select_bucket(inputs.shape[-1])
+            if bucket is not None:
+                # Relleno por la izquierda hasta la longitud fija del bucket
+                padding = bucket - inputs.shape[-1]
+                inputs = torch.cat([
+                    torch.full((1, padding), self.tokenizer.eos_token_id, dtype=inputs.dtype),
+                    inputs
+                ], dim=-1)
+                attention_mask = torch.cat([
+                    torch.zeros((1, padding), dtype=attention_mask.dtype),
+                    attention_mask
+                ], dim=-1)
+            
+            adapter_id = str(adapter_id) if adapter_id is not None else None
+            if adapter_id and not (self.adapters and self.adapters.exists(adapter_id)):
+                print(f"Adaptador '{adapter_id}' no disponible, usando el modelo base")
+                adapter_id = None
+            adapter_scope = self.adapters.activate(adapter_id) if self.adapters else nullcontext()
             
             print("Input tokenizado, generando respuesta...")
-            # Generar respuesta con parámetros ajustados
-            outputs = self.model.generate(
-                inputs,
-                max_length=max_length,
-                min_length=20,  # Asegurar respuestas no muy cortas
-                pad_token_id=self.tokenizer.eos_token_id,
-                do_sample=True,
-                temperature=0.7,  # Controlar creatividad
-                top_p=0.9,
-                top_k=50,
-                num_return_sequences=1,
-                no_repeat_ngram_size=2  # Evitar repeticiones
-            )
+            with adapter_scope:
+                try:
+                    outputs = self._generate(inputs, attention_mask, bucket,
+                                             'compiled' if bucket is not None else 'eager',
+                                             max_length=max_length)
+                except Exception as e:
+                    if bucket is None:
+                        raise
+                    # Fallback: forma no soportada por el grafo compilado
+                    print(f"Fallo en modo compilado, reintentando en eager: {str(e)}")
+                    inputs = inputs[:, padding:]
+                    outputs = self._generate(inputs, torch.ones_like(inputs), None, 'eager',
+                                             max_length=max_length)
             
             print("Respuesta generada, decodificando...")
-            # Decodificar respuesta
-            response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            
-            # Remover el input del output y limpiar
-            if response.startswith(input_text):
-                response = response[len(input_text):].strip()
+            # Decodificar solo los tokens nuevos
+            response = self.tokenizer.decode(outputs[0][inputs.shape[-1]:], skip_special_tokens=True).strip()
             
             print(f"Respuesta final: '{response[:100]}...'")
             return response
@@ -0,0 +1,253 @@
+"""
+Adaptadores LoRA (low-rank) por tenant sobre un modelo base compartido
+
+Las capas objetivo del modelo (por defecto `c_attn` de GPT-2/DialoGPT) se
+envuelven una sola vez con LoRALayer. Cada adaptador solo guarda las matrices
+A (r x in) y B (out x r) de esas capas, así que cambiar de tenant consiste en
+reasignar referencias a tensores ya residentes: no se copian pesos del modelo.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import torch
+from torch import nn
+
+ADAPTER_FILENAME = "adapter.pt"
+DEFAULT_TARGET_MODULES = ("c_attn",)
+
+
+class LoRALayer(nn.Module):
+    """Capa base congelada + delta de bajo rango opcional (x · Aᵀ · Bᵀ · escala)"""
+
+    def __init__(self, base: nn.Module):
+        super().__init__()
+        self.base = base
+        # Conv1D de transformers guarda el peso como (in, out); nn.Linear como (out, in)
+        if isinstance(base, nn.Linear):
+            self.in_features, self.out_features = base.in_features, base.out_features
+        else:
+            self.in_features, self.out_features = base.weight.shape
+        # Parámetros entrenables (solo durante el fine-tuning)
+        self.register_parameter('lora_A', None)
+        self.register_parameter('lora_B', None)
+        self.scaling = 1.0
+        # Adaptador activo al servir: (A, B, escala) o None para el modelo base
+        self.active: Optional[Tuple[torch.Tensor, torch.Tensor, float]] = None
+
+    def attach_trainable(self, rank: int, alpha: float):
+        """Crea matrices A/B entrenables (B en cero: el delta inicial es nulo)"""
+        weight = self.base.weight
+        self.lora_A = nn.Parameter(torch.empty(rank, self.in_features, dtype=weight.dtype, device=weight.device))
+        self.lora_B = nn.Parameter(torch.zeros(self.out_features, rank, dtype=weight.dtype, device=weight.device))
+        nn.init.kaiming_uniform_(self.lora_A, a=5 ** 0.5)
+        self.scaling = alpha / rank
+
+    def detach_trainable(self):
+        """Elimina las matrices entrenables y vuelve al modelo base"""
+        self.lora_A = None
+        self.lora_B = None
+        self.scaling = 1.0
+
+    def forward(self, x):
+        output = self.base(x)
+        if self.lora_A is not None:
+            lora_a, lora_b, scaling = self.lora_A, self.lora_B, self.scaling
+        elif self.active is not None:
+            lora_a, lora_b, scaling = self.active
+        else:
+            return output
+        return output + (x @ lora_a.t() @ lora_b.t()) * scaling
+
+
+def inject_lora(model: nn.Module, target_modules: Iterable[str] = DEFAULT_TARGET_MODULES) -> List[str]:
+    """
+    Envuelve las capas objetivo con LoRALayer (idempotente)
+
+    Args:
+        model: Modelo base
+        target_modules: Sufijos de nombre de las capas a envolver
+
+    Returns:
+        Nombres de las capas envueltas
+    """
+    targets = tuple(target_modules)
+    wrapped = []
+    for name, module in list(model.named_modules()):
+        if isinstance(module, LoRALayer):
+            wrapped.append(name)
+            continue
+        if name.split('.')[-1] not in targets or not hasattr(module, 'weight'):
+            continue
+        parent_name, _, child_name = name.rpartition('.')
+        parent = model.get_submodule(parent_name) if parent_name else model
+        setattr(parent, child_name, LoRALayer(module))
+        wrapped.append(name)
+    return wrapped
+
+
+def lora_layers(model: nn.Module) -> Dict[str, LoRALayer]:
+    """Capas LoRA del modelo indexadas por nombre"""
+    return {name: module for name, module in model.named_modules() if isinstance(module, LoRALayer)}
+
+
+def save_adapter(model: nn.Module, output_dir: str, metadata: Optional[dict] = None) -> str:
+    """
+    Guarda solo las matrices A/B entrenadas del modelo
+
+    Args:
+        model: Modelo con capas LoRA entrenables
+        output_dir: Directorio del adaptador
+        metadata: Datos adicionales (modelo base, rango, alpha...)
+
+    Returns:
+        Ruta del archivo guardado
+    """
+    weights = {}
+    scaling = None
+    for name, layer in lora_layers(model).items():
+        if layer.lora_A is None:
+            continue
+        weights[name] = {
+            'A': layer.lora_A.detach().cpu().contiguous(),
+            'B': layer.lora_B.detach().cpu().contiguous()
+        }
+        scaling = layer.scaling
+
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, ADAPTER_FILENAME)
+    torch.save({'metadata': dict(metadata or {}, scaling=scaling), 'weights': weights}, path)
+    return path
+
+
+class Adapter:
+    """Adaptador residente en memoria"""
+
+    __slots__ = ('adapter_id', 'weights', 'scaling', 'nbytes')
+
+    def __init__(self, adapter_id: str, weights: Dict[str, Dict[str, torch.Tensor]], scaling: float):
+        self.adapter_id = adapter_id
+        self.weights = weights
+        self.scaling = scaling
+        self.nbytes = sum(
+            tensor.numel() * tensor.element_size()
+            for pair in weights.values() for tensor in pair.values()
+        )
+
+    @classmethod
+    def load(cls, adapter_id: str, path: str, dtype: torch.dtype, device) -> "Adapter":
+        """Carga un adaptador desde disco con el dtype/dispositivo del modelo base"""
+        payload = torch.load(path, map_location='cpu', weights_only=True)
+        weights = {
+            name: {key: tensor.to(device=device, dtype=dtype) for key, tensor in pair.items()}
+            for name, pair in payload['weights'].items()
+        }
+        return cls(adapter_id, weights, float(payload['metadata'].get('scaling') or 1.0))
+
+
+class AdapterManager:
+    """
+    LRU de adaptadores residentes bajo un presupuesto de memoria
+
+    Un adaptador se carga desde `<adapters_dir>/<adapter_id>/adapter.pt` la
+    primera vez que se pide y se desaloja el menos usado cuando la suma de
+    adaptadores residentes supera el presupuesto.
+    """
+
+    def __init__(self, model: nn.Module, adapters_dir: str, memory_budget_bytes: int):
+        self.model = model
+        self.adapters_dir = adapters_dir
+        self.memory_budget_bytes = memory_budget_bytes
+        self.layers = lora_layers(model)
+
+        reference = next(model.parameters())
+        self._dtype = reference.dtype
+        self._device = reference.device
+        self._resident: "OrderedDict[str, Adapter]" = OrderedDict()
+        self._resident_bytes = 0
+        # El modelo es compartido: un solo adaptador activo a la vez
+        self._lock = threading.RLock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'last_switch_ms': 0.0, 'last_load_ms': 0.0}
+
+    def adapter_path(self, adapter_id: str) -> str:
+        """Ruta del archivo de un adaptador (rechaza ids con separadores de ruta)"""
+        if not adapter_id or os.path.basename(adapter_id) != adapter_id or adapter_id.startswith('.'):
+            raise ValueError(f"Identificador de adaptador inválido: {adapter_id!r}")
+        return os.path.join(self.adapters_dir, adapter_id, ADAPTER_FILENAME)
+
+    def exists(self, adapter_id: str) -> bool:
+        """Indica si el adaptador está residente o disponible en disco"""
+        try:
+            return adapter_id in self._resident or os.path.isfile(self.adapter_path(adapter_id))
+        except ValueError:
+            return False
+
+    def get(self, adapter_id: str) -> Adapter:
+        """Devuelve el adaptador, cargándolo y desalojando otros si hace falta"""
+        with self._lock:
+            adapter = self._resident.get(adapter_id)
+            if adapter is not None:
+                self._resident.move_to_end(adapter_id)
+                self._stats['hits'] += 1
+                return adapter
+
+            start = time.perf_counter()
+            adapter = Adapter.load(adapter_id, self.adapter_path(adapter_id), self._dtype, self._device)
+            missing = set(adapter.weights) - set(self.layers)
+            if missing:
+                raise ValueError(f"El adaptador {adapter_id} no corresponde a este modelo: {sorted(missing)[:3]}")
+            self._stats['misses'] += 1
+            self._stats['last_load_ms'] = round((time.perf_counter() - start) * 1000, 3)
+
+            self._resident[adapter_id] = adapter
+            self._resident_bytes += adapter.nbytes
+            while self._resident_bytes > self.memory_budget_bytes and len(self._resident) > 1:
+                _, evicted = self._resident.popitem(last=False)
+                self._resident_bytes -= evicted.nbytes
+                self._stats['evictions'] += 1
+            return adapter
+
+    def unload(self, adapter_id: str) -> bool:
+        """Descarga un adaptador residente"""
+        with self._lock:
+            adapter = self._resident.pop(adapter_id, None)
+            if adapter is None:
+                return False
+            self._resident_bytes -= adapter.nbytes
+            return True
+
+    @contextmanager
+    def activate(self, adapter_id: Optional[str]):
+        """
+        Activa un adaptador sobre el modelo base durante el bloque
+
+        Con adapter_id None se usa el modelo base. El cambio es una reasignación
+        de referencias en cada capa LoRA.
+        """
+        with self._lock:
+            adapter = self.get(adapter_id) if adapter_id else None
+            start = time.perf_counter()
+            for name, layer in self.layers.items():
+                pair = adapter.weights.get(name) if adapter else None
+                layer.active = (pair['A'], pair['B'], adapter.scaling) if pair else None
+            self._stats['last_switch_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            try:
+                yield adapter
+            finally:
+                for layer in self.layers.values():
+                    layer.active = None
+
+    def stats(self) -> dict:
+        """Estado del LRU de adaptadores"""
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(
+                self._stats,
+                resident=list(self._resident),
+                resident_mb=round(self._resident_bytes / (1024 * 1024), 3),
+                budget_mb=round(self.memory_budget_bytes / (1024 * 1024), 3),
+                hit_rate=round(self._stats['hits'] / lookups, 3) if lookups else None
+            )
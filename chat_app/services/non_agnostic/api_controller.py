@@ -1,7 +1,10 @@
-from flask import request
+from flask import request, stream_with_context
 from dtos import UserDTO, CredentialsDTO, MessageDTO, ConversationDTO
 from services.non_agnostic.response_handler import ResponseHandler
 from services.agnostic.entity.user_service import UserService
+from services.agnostic.utility.login_limiter import login_limiter
+from services.agnostic.utility.session_tokens import TOKEN_ERROR_MESSAGES, session_tokens
+from utils.password_hasher import PasswordHasherBusy
 from services.agnostic.task.messaging_capability import MessagingCapability
 
 class APIController:
@@ -20,6 +23,28 @@ class APIController:
         """
         self.messaging_capability = messaging_capability
     
+    @staticmethod
+    def _authorize(user_id=None, required=False):
+        """
+        Verifica el token de sesión de la petición (Authorization: Bearer)
+        
+        Args:
+            user_id: ID de usuario indicado en la petición (debe coincidir con el del token)
+            required: Exigir el token aunque SESSION_TOKEN_REQUIRED esté desactivado
+        
+        Returns:
+            Tupla (UserRecord o None si no se envió token, respuesta de error o None)
+        """
+        auth = request.authorization
+        token = auth.token if auth is not None and auth.type == 'bearer' else None
+        if required and not token:
+            error_code = 'TOKEN_REQUIRED'
+        else:
+            identity, error_code = session_tokens.authorize(token, user_id)
+        if error_code:
+            return None, ResponseHandler.send_error(TOKEN_ERROR_MESSAGES[error_code], error_code=error_code)
+        return identity, None
+    
     def register_user(self):
         """
         Endpoint: Registrar nuevo usuario
@@ -43,7 +68,13 @@ class APIController:
             )
             
             # Llamar servicio agnóstico
-            created_user = UserService.create_user(user_dto, data['password'])
+            try:
+                created_user = UserService.create_user(user_dto, data['password'])
+            except PasswordHasherBusy:
+                return ResponseHandler.send_retry_later(
+                    "Servicio ocupado, intente de nuevo",
+                    error_code="SERVICE_BUSY"
+                )
             
             if not created_user:
                 return ResponseHandler.send_error(
@@ -85,8 +116,22 @@ class APIController:
                 password=data['password']
             )
             
-            # Autenticar
-            user = UserService.authenticate(credentials)
+            # Intentos simultáneos por IP y por usuario (cada uno ocupa el pool de hashing)
+            client_ip = request.remote_addr or 'unknown'
+            if not login_limiter.try_acquire(client_ip, credentials.username):
+                return ResponseHandler.send_retry_later(
+                    "Demasiados intentos de inicio de sesión simultáneos",
+                    error_code="RATE_LIMITED"
+                )
+            try:
+                user = UserService.authenticate(credentials)
+            except PasswordHasherBusy:
+                return ResponseHandler.send_retry_later(
+                    "Servicio ocupado, intente de nuevo",
+                    error_code="SERVICE_BUSY"
+                )
+            finally:
+                login_limiter.release(client_ip, credentials.username)
             
             if not user:
                 return ResponseHandler.send_error(
@@ -95,9 +140,13 @@ class APIController:
                     status_code=401
                 )
             
+            # Token firmado: las siguientes peticiones se verifican sin consultar al usuario
+            data = user.to_dict()
+            data['token'] = session_tokens.issue(user.id)
+            data['expires_in'] = session_tokens.expires_seconds
             return ResponseHandler.send_success(
                 "Login exitoso",
-                data=user.to_dict()
+                data=data
             )
             
         except Exception as e:
@@ -107,6 +156,37 @@ class APIController:
                 status_code=500
             )
     
+    def get_current_user(self):
+        """
+        Endpoint: Usuario del token de sesión
+        GET /api/users/me   (Authorization: Bearer <token>)
+        """
+        try:
+            identity, error = self._authorize()
+            if error:
+                return error
+            if identity is None:
+                return ResponseHandler.send_error(
+                    TOKEN_ERROR_MESSAGES['TOKEN_REQUIRED'],
+                    error_code="TOKEN_REQUIRED"
+                )
+            
+            user = UserService.get_user(identity.id)
+            if not user:
+                return ResponseHandler.send_error(
+                    "Usuario no encontrado",
+                    error_code="USER_NOT_FOUND"
+                )
+            
+            return ResponseHandler.send_success(data=user.to_dict())
+            
+        except Exception as e:
+            return ResponseHandler.send_error(
+                f"Error interno: {str(e)}",
+                error_code="INTERNAL_ERROR",
+                status_code=500
+            )
+    
     def create_conversation(self):
         """
         Endpoint: Crear nueva conversación
@@ -115,18 +195,29 @@ class APIController:
         try:
             data = request.get_json()
             
+            if data is None:
+                return ResponseHandler.send_error(
+                    "user_id es requerido",
+                    error_code="INVALID_INPUT"
+                )
+            
+            # Con token el usuario sale de él (user_id es opcional y debe coincidir)
+            identity, error = self._authorize(data.get('user_id'))
+            if error:
+                return error
+            
             # Validar datos
-            if not data or 'user_id' not in data:
+            if identity is None and 'user_id' not in data:
                 return ResponseHandler.send_error(
                     "user_id es requerido",
                     error_code="INVALID_INPUT"
                 )
             
-            user_id = data['user_id']
+            user_id = identity.id if identity else data['user_id']
             title = data.get('title', 'Nueva Conversación')
             
             # Llamar task service
-            result = self.messaging_capability.create_new_conversation(user_id, title)
+            result = self.messaging_capability.create_new_conversation(user_id, title, identity=identity)
             
             # Convertir ResponseDTO a respuesta HTTP
             return ResponseHandler.send_response(result)
@@ -146,8 +237,13 @@ class APIController:
         try:
             data = request.get_json()
             
+            # Con token el usuario sale de él (user_id es opcional y debe coincidir)
+            identity, error = self._authorize(data.get('user_id'))
+            if error:
+                return error
+            
             # Validar datos requeridos
-            required_fields = ['user_id', 'session_id', 'content']
+            required_fields = ['session_id', 'content'] if identity else ['user_id', 'session_id', 'content']
             for field in required_fields:
                 if field not in data:
                     return ResponseHandler.send_error(
@@ -155,13 +251,14 @@ class APIController:
                         error_code="INVALID_INPUT"
                     )
             
-            user_id = data['user_id']
+            user_id = identity.id if identity else data['user_id']
             session_id = data['session_id']
             content = data['content']
             
             # Llamar task service (orquesta todo el flujo)
             result = self.messaging_capability.process_user_message(
-                user_id, session_id, content
+                user_id, session_id, content,
+                identity=identity
             )
             
             # Convertir ResponseDTO a respuesta HTTP
@@ -177,11 +274,16 @@ class APIController:
     def get_conversation_history(self, session_id: int):
         """
         Endpoint: Obtener historial de conversación
-        GET /api/conversations/<session_id>
+        GET /api/conversations/<session_id>?user_id=&limit=&before_id=&after_id=&since=
         """
         try:
-            # Obtener user_id de query params o headers
+            # Obtener user_id del token o de query params
             user_id = request.args.get('user_id', type=int)
+            identity, error = self._authorize(user_id)
+            if error:
+                return error
+            if identity:
+                user_id = identity.id
             
             if not user_id:
                 return ResponseHandler.send_error(
@@ -189,12 +291,25 @@ class APIController:
                     error_code="INVALID_INPUT"
                 )
             
-            # Llamar task service
+            # Petición condicional: se responde 304 sin leer los mensajes
+            etag = self.messaging_capability.get_conversation_validator(
+                user_id, session_id, request.query_string.decode('utf-8')
+            )
+            if etag and request.if_none_match.contains_weak(etag):
+                return ResponseHandler.send_not_modified(etag)
+            
+            # Paginación opcional (sin estos parámetros se devuelve la conversación completa)
             result = self.messaging_capability.get_conversation_history(
-                user_id, session_id
+                user_id, session_id,
+                limit=request.args.get('limit', type=int),
+                before_id=request.args.get('before_id', type=int),
+                after_id=request.args.get('after_id', type=int),
+                since=request.args.get('since', type=int),
+                identity=identity
             )
             
-            return ResponseHandler.send_response(result)
+            # El historial completo puede ser grande: se serializa por fragmentos
+            return ResponseHandler.with_validator(ResponseHandler.send_stream(result), etag)
             
         except Exception as e:
             return ResponseHandler.send_error(
@@ -206,17 +321,96 @@ class APIController:
     def get_user_conversations(self, user_id: int):
         """
         Endpoint: Obtener todas las conversaciones de un usuario
-        GET /api/users/<user_id>/conversations
+        GET /api/users/<user_id>/conversations?view=summary
         """
         try:
+            identity, error = self._authorize(user_id)
+            if error:
+                return error
+            
+            etag = self.messaging_capability.get_conversations_validator(
+                user_id, request.query_string.decode('utf-8'), identity=identity
+            )
+            if etag and request.if_none_match.contains_weak(etag):
+                return ResponseHandler.send_not_modified(etag)
+            
             # Llamar task service
-            result = self.messaging_capability.get_user_conversations(user_id)
+            result = self.messaging_capability.get_user_conversations(
+                user_id, view=request.args.get('view'), identity=identity
+            )
+            
+            return ResponseHandler.with_validator(ResponseHandler.send_response(result), etag)
+            
+        except Exception as e:
+            return ResponseHandler.send_error(
+                f"Error interno: {str(e)}",
+                error_code="INTERNAL_ERROR",
+                status_code=500
+            )
+    
+    def search_messages(self, user_id: int):
+        """
+        Endpoint: Buscar en los mensajes de un usuario
+        GET /api/users/<user_id>/search?q=&session_id=&limit=&offset=
+        """
+        try:
+            identity, error = self._authorize(user_id, required=True)
+            if error:
+                return error
+            
+            result = self.messaging_capability.search_messages(
+                user_id,
+                request.args.get('q', ''),
+                session_id=request.args.get('session_id', type=int),
+                limit=request.args.get('limit', type=int),
+                offset=request.args.get('offset', 0, type=int),
+                identity=identity
+            )
+            
+            return ResponseHandler.send_response(result)
+            
+        except Exception as e:
+            return ResponseHandler.send_error(
+                f"Error interno: {str(e)}",
+                error_code="INTERNAL_ERROR",
+                status_code=500
+            )
+    
+    def export_conversations(self, user_id: int):
+        """
+        Endpoint: Exportar los mensajes de un usuario (respuesta en streaming)
+        GET /api/users/<user_id>/export?format=ndjson|parquet&since=&until=&after_session=&after_seq=
+        """
+        try:
+            identity, error = self._authorize(user_id, required=True)
+            if error:
+                return error
             
-            return ResponseHandler.send_json_response(result)
+            result = self.messaging_capability.export_conversations(
+                user_id,
+                export_format=request.args.get('format', 'ndjson'),
+                since=request.args.get('since'),
+                until=request.args.get('until'),
+                after_session=request.args.get('after_session', 0, type=int),
+                after_seq=request.args.get('after_seq', 0, type=int),
+                identity=identity
+            )
+            if not result.success:
+                return ResponseHandler.send_response(result)
+            
+            ndjson = result.data['format'] == 'ndjson'
+            # stream_with_context mantiene el contexto (y la sesión de BD) mientras se envía;
+            # Parquet ya viene comprimido (zstd), NDJSON se comprime con gzip si el cliente lo acepta
+            return ResponseHandler.stream_chunks(
+                stream_with_context(result.data['chunks']),
+                mimetype='application/x-ndjson' if ndjson else 'application/vnd.apache.parquet',
+                headers={'Content-Disposition': f"attachment; filename={result.data['filename']}"},
+                compressible=ndjson
+            )
             
         except Exception as e:
             return ResponseHandler.send_error(
                 f"Error interno: {str(e)}",
                 error_code="INTERNAL_ERROR",
                 status_code=500
-            )
\ No newline at end of file
+            )
@@ -1,5 +1,7 @@
-from flask import jsonify
+from flask import Response, current_app, jsonify, make_response, request
+from config import Config
 from dtos import ResponseDTO
+from services.agnostic.utility.json_stream import JSONStreamEncoder, gzip_chunks
 
 class ResponseHandler:
     """
@@ -36,11 +38,15 @@ class ResponseHandler:
         'USER_NOT_FOUND': 404,
         'CONVERSATION_NOT_FOUND': 404,
         'UNAUTHORIZED': 403,
+        'INVALID_TOKEN': 401,
+        'TOKEN_REQUIRED': 401,
         'INVALID_INPUT': 400,
         'VALIDATION_ERROR': 400,
         'CREATE_ERROR': 400,
         'SAVE_ERROR': 500,
         'AI_ERROR': 503,
+        'RATE_LIMITED': 429,
+        'SERVICE_BUSY': 503,
         'INTERNAL_ERROR': 500
     }
     
@@ -60,6 +66,100 @@ class ResponseHandler:
         response_dto = ResponseDTO.success_response(message=message, data=data)
         return jsonify(response_dto.to_dict()), status_code
 
+    @staticmethod
+    def send_stream(response_dto: ResponseDTO):
+        """
+        Envía un ResponseDTO como JSON por fragmentos (respuestas grandes)
+        
+        El cuerpo es byte a byte el mismo que el de send_response (mismas
+        opciones del proveedor JSON de Flask, incluida la sangría en modo
+        debug), pero se genera mientras se envía: los iteradores dentro de
+        data (p. ej. los mensajes del historial) se consumen de a uno. Se
+        comprime con gzip si el cliente lo acepta (STREAM_GZIP).
+        
+        Args:
+            response_dto: ResponseDTO a enviar
+            
+        Returns:
+            Respuesta de Flask en streaming
+        """
+        if not response_dto.success or response_dto.data is None:
+            return ResponseHandler.send_response(response_dto)
+        
+        provider = current_app.json
+        compact = getattr(provider, 'compact', None)
+        encoder = JSONStreamEncoder(
+            indent=2 if (compact is None and current_app.debug) or compact is False else None,
+            sort_keys=getattr(provider, 'sort_keys', True),
+            ensure_ascii=getattr(provider, 'ensure_ascii', True),
+            default=getattr(provider, 'default', None),
+            chunk_size=getattr(Config, 'STREAM_CHUNK_BYTES', 64 * 1024)
+        )
+        envelope = ResponseDTO.success_response(message=response_dto.message, data=response_dto.data).to_dict()
+        
+        def generate():
+            yield from encoder.iter_encode(envelope)
+            # jsonify termina el cuerpo con un salto de línea
+            yield b'\n'
+        
+        return ResponseHandler.stream_chunks(generate(), mimetype='application/json')
+    
+    @staticmethod
+    def stream_chunks(chunks, mimetype: str, headers: dict = None, compressible: bool = True):
+        """
+        Respuesta en streaming con gzip negociado por Accept-Encoding
+        
+        Args:
+            chunks: Iterador de fragmentos en bytes
+            mimetype: Tipo de contenido
+            headers: Cabeceras adicionales
+            compressible: False para contenido ya comprimido (p. ej. Parquet)
+            
+        Returns:
+            Respuesta de Flask en streaming
+        """
+        headers = dict(headers or {})
+        if compressible and getattr(Config, 'STREAM_GZIP', True):
+            headers['Vary'] = 'Accept-Encoding'
+            if request.accept_encodings['gzip'] > 0:
+                chunks = gzip_chunks(chunks, getattr(Config, 'STREAM_GZIP_LEVEL', 6))
+                headers['Content-Encoding'] = 'gzip'
+        return Response(chunks, mimetype=mimetype, headers=headers)
+
+    @staticmethod
+    def send_not_modified(etag: str):
+        """
+        Respuesta 304 Not Modified para una petición condicional (If-None-Match)
+        
+        Args:
+            etag: Validador vigente
+            
+        Returns:
+            Respuesta de Flask sin cuerpo
+        """
+        response = Response(status=304)
+        return ResponseHandler.with_validator(response, etag)
+    
+    @staticmethod
+    def with_validator(response, etag: str = None):
+        """
+        Agrega ETag (débil) y Cache-Control a una respuesta exitosa
+        
+        El ETag es débil porque el mismo contenido puede enviarse con o sin gzip.
+        
+        Args:
+            response: Respuesta de Flask (o tupla respuesta, código)
+            etag: Validador; None para no agregar cabeceras
+            
+        Returns:
+            Respuesta de Flask
+        """
+        response = make_response(response)
+        if etag and response.status_code in (200, 304):
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = getattr(Config, 'HTTP_CACHE_CONTROL', 'private, no-cache')
+        return response
+
     @staticmethod
     def send_error(message: str, error_code: str = None, status_code: int = None):
         """
@@ -86,6 +186,23 @@ class ResponseHandler:
         )
         return jsonify(response_dto.to_dict()), status_code or 400
     
+    @staticmethod
+    def send_retry_later(message: str, error_code: str, retry_after: int = 1):
+        """
+        Envía un error temporal (429 / 503) con la cabecera Retry-After
+        
+        Args:
+            message: Mensaje de error
+            error_code: RATE_LIMITED o SERVICE_BUSY
+            retry_after: Segundos sugeridos antes de reintentar
+            
+        Returns:
+            Respuesta JSON de Flask
+        """
+        response = make_response(ResponseHandler.send_error(message, error_code=error_code))
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+    
     @staticmethod
     def format_validation_error(errors: dict):
         """
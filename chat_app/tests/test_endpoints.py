@@ -2,6 +2,7 @@ import pytest
 from app import create_app
 from models import db
 import json
+import os
 
 @pytest.fixture
 def client():
@@ -123,4 +124,1023 @@ def test_send_message(client):
     data = json.loads(response.data)
     assert data['success'] == True
     assert 'content' in data['data']
-    assert 'response' in data['data']
\ No newline at end of file
+    assert 'response' in data['data']
+
+def test_send_message_to_foreign_session(client):
+    """Prueba que no se puede escribir en la conversación de otro usuario (su contexto es privado)"""
+    from models import ChatMessage
+
+    user_ids = []
+    for name in ('owneruser', 'otheruser'):
+        client.post('/api/users/register', json={
+            'username': name,
+            'password': 'testpass123',
+            'email': f'{name}@example.com'
+        })
+        login_response = client.post('/api/users/login', json={
+            'username': name,
+            'password': 'testpass123'
+        })
+        user_ids.append(json.loads(login_response.data)['data']['id'])
+    owner_id, other_id = user_ids
+    session_id = json.loads(client.post(
+        '/api/conversations', json={'user_id': owner_id, 'title': 'Privada'}
+    ).data)['data']['id']
+
+    response = client.post('/api/messages', json={
+        'session_id': session_id,
+        'user_id': other_id,
+        'content': 'Cuéntame lo que hablaste'
+    })
+    assert response.status_code == 400
+    assert json.loads(response.data)['success'] == False
+    assert ChatMessage.query.filter_by(session_id=session_id).count() == 0
+
+def test_conversation_history_pagination(client):
+    """Prueba la paginación por cursor y el modo delta del historial"""
+    from services.agnostic.entity.message_service import MessageService
+
+    client.post('/api/users/register', json={
+        'username': 'pageuser',
+        'password': 'testpass123',
+        'email': 'page@example.com'
+    })
+    login_response = client.post('/api/users/login', json={
+        'username': 'pageuser',
+        'password': 'testpass123'
+    })
+    user_id = json.loads(login_response.data)['data']['id']
+    conv_response = client.post('/api/conversations', json={'user_id': user_id, 'title': 'Paginada'})
+    session_id = json.loads(conv_response.data)['data']['id']
+    for i in range(5):
+        MessageService.save_message(session_id, user_id, f"mensaje {i}")
+
+    # Última página
+    response = client.get(f'/api/conversations/{session_id}?user_id={user_id}&limit=2')
+    assert response.status_code == 200
+    page = json.loads(response.data)['data']
+    assert [m['seq'] for m in page['messages']] == [4, 5]
+    assert page['page']['has_more'] == True
+
+    # Página anterior con el cursor devuelto
+    before_id = page['page']['next_before_id']
+    response = client.get(f'/api/conversations/{session_id}?user_id={user_id}&limit=2&before_id={before_id}')
+    assert [m['seq'] for m in json.loads(response.data)['data']['messages']] == [2, 3]
+
+    # Modo delta: solo mensajes nuevos
+    response = client.get(f'/api/conversations/{session_id}?user_id={user_id}&since=3')
+    delta = json.loads(response.data)['data']
+    assert [m['seq'] for m in delta['messages']] == [4, 5]
+    assert delta['page']['since'] == 5
+
+def test_conditional_history(client):
+    """Prueba ETag / If-None-Match del historial y la lista de conversaciones"""
+    from services.agnostic.entity.message_service import MessageService
+
+    client.post('/api/users/register', json={
+        'username': 'etaguser',
+        'password': 'testpass123',
+        'email': 'etag@example.com'
+    })
+    login_response = client.post('/api/users/login', json={
+        'username': 'etaguser',
+        'password': 'testpass123'
+    })
+    user_id = json.loads(login_response.data)['data']['id']
+    conv_response = client.post('/api/conversations', json={'user_id': user_id, 'title': 'Condicional'})
+    session_id = json.loads(conv_response.data)['data']['id']
+    MessageService.save_message(session_id, user_id, "primer mensaje")
+
+    url = f'/api/conversations/{session_id}?user_id={user_id}'
+    response = client.get(url)
+    etag = response.headers['ETag']
+    assert 'no-cache' in response.headers['Cache-Control']
+
+    # Sin cambios: 304 sin cuerpo
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    # Un mensaje nuevo cambia la versión de la sesión
+    MessageService.save_message(session_id, user_id, "segundo mensaje")
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+    list_url = f'/api/users/{user_id}/conversations?view=summary'
+    list_etag = client.get(list_url).headers['ETag']
+    assert client.get(list_url, headers={'If-None-Match': list_etag}).status_code == 304
+
+def test_import_users(client, tmp_path):
+    """Prueba el alta masiva de usuarios con manage.py import-users (resultado por fila y resumen)"""
+    from argparse import Namespace
+    from manage import import_users
+
+    client.post('/api/users/register', json={
+        'username': 'existente',
+        'password': 'testpass123',
+        'email': 'existente@example.com'
+    })
+    source = tmp_path / 'usuarios.csv'
+    source.write_text(
+        "username,email,password\n"
+        "nuevo1,nuevo1@example.com,clave1\n"
+        "existente,otro@example.com,clave2\n"
+        "nuevo1,nuevo1b@example.com,clave3\n"
+        "x,invalido,clave4\n"
+        "nuevo2,nuevo2@example.com,clave5\n",
+        encoding='utf-8'
+    )
+    report = tmp_path / 'resultado.ndjson'
+    args = Namespace(input=str(source), format=None, report=str(report), batch_size=2, workers=2)
+    assert import_users(client.application, args) == 0
+    lines = [json.loads(line) for line in report.read_text(encoding='utf-8').splitlines()]
+    assert [line['status'] for line in lines] == ['created', 'duplicate', 'duplicate', 'invalid', 'created']
+
+    # El usuario importado puede iniciar sesión; el endpoint HTTP ya no existe
+    response = client.post('/api/users/login', json={'username': 'nuevo2', 'password': 'clave5'})
+    assert response.status_code == 200
+    assert client.post('/api/users/import?format=csv', data=b'').status_code in (404, 405)
+
+def test_session_token(client):
+    """Prueba el token de sesión: acceso sin user_id, usuario distinto, token inválido y revocación"""
+    from services.agnostic.entity.user_service import UserService
+    from dtos import UserDTO
+
+    client.post('/api/users/register', json={
+        'username': 'tokenuser',
+        'password': 'testpass123',
+        'email': 'token@example.com'
+    })
+    login_response = client.post('/api/users/login', json={
+        'username': 'tokenuser',
+        'password': 'testpass123'
+    })
+    user_data = json.loads(login_response.data)['data']
+    headers = {'Authorization': f"Bearer {user_data['token']}"}
+
+    response = client.get('/api/users/me', headers=headers)
+    assert response.status_code == 200
+    assert json.loads(response.data)['data']['username'] == 'tokenuser'
+
+    response = client.post('/api/conversations', json={'title': 'Con token'}, headers=headers)
+    session_id = json.loads(response.data)['data']['id']
+    response = client.get(f'/api/conversations/{session_id}', headers=headers)
+    assert response.status_code == 200
+
+    response = client.get(f"/api/users/{user_data['id'] + 1}/conversations", headers=headers)
+    assert response.status_code == 403
+    response = client.get('/api/users/me', headers={'Authorization': 'Bearer invalido'})
+    assert response.status_code == 401
+
+    # Otro worker revoca: la versión se relee de la BD al vencer SESSION_TOKEN_CHECK_TTL
+    from sqlalchemy import text
+    from services.agnostic.utility.identity_cache import identity_cache
+    db.session.execute(text("UPDATE users SET token_version = token_version + 1 WHERE id = :id"), {'id': user_data['id']})
+    db.session.commit()
+    identity_cache.invalidate('token', user_data['id'])
+    assert client.get('/api/users/me', headers=headers).status_code == 401
+    login = json.loads(client.post('/api/users/login', json={
+        'username': 'tokenuser',
+        'password': 'testpass123'
+    }).data)['data']
+    headers = {'Authorization': f"Bearer {login['token']}"}
+    assert client.get('/api/users/me', headers=headers).status_code == 200
+
+    UserService.update_user(user_data['id'], UserDTO(username=None, email=None, is_active=False))
+    response = client.get(f"/api/users/{user_data['id']}/conversations", headers=headers)
+    assert response.status_code == 401
+
+    # Reactivado y con login en el mismo segundo: el token nuevo vale, el anterior no
+    UserService.update_user(user_data['id'], UserDTO(username=None, email=None, is_active=True))
+    login = json.loads(client.post('/api/users/login', json={
+        'username': 'tokenuser',
+        'password': 'testpass123'
+    }).data)['data']
+    assert client.get('/api/users/me', headers={'Authorization': f"Bearer {login['token']}"}).status_code == 200
+    assert client.get('/api/users/me', headers=headers).status_code == 401
+
+def test_compact_message_storage(client):
+    """Prueba el almacenamiento compacto: cuerpos repetidos compartidos y lectura transparente"""
+    from services.agnostic.entity.message_service import MessageService
+    from services.agnostic.utility.message_codec import message_codec
+
+    client.post('/api/users/register', json={
+        'username': 'codecuser',
+        'password': 'testpass123',
+        'email': 'codec@example.com'
+    })
+    login_response = client.post('/api/users/login', json={
+        'username': 'codecuser',
+        'password': 'testpass123'
+    })
+    user_data = json.loads(login_response.data)['data']
+    user_id = user_data['id']
+    headers = {'Authorization': f"Bearer {user_data['token']}"}
+    conv_response = client.post('/api/conversations', json={'user_id': user_id, 'title': 'Compacta'})
+    session_id = json.loads(conv_response.data)['data']['id']
+
+    reply = "Lo siento, no pude generar una respuesta coherente. " * 10
+    MessageService.save_message(session_id, user_id, "respuesta sin codificar", is_bot=False)
+    MessageService.save_message(session_id, user_id, reply, is_bot=True)
+    previous = message_codec.enabled, message_codec.min_bytes
+    message_codec.enabled, message_codec.min_bytes = True, 64
+    try:
+        MessageService.save_message(session_id, user_id, reply, is_bot=True)
+        MessageService.save_message(session_id, user_id, reply, is_bot=True)
+        last_id, compacted = MessageService.compact_messages()
+    finally:
+        message_codec.enabled, message_codec.min_bytes = previous
+    assert compacted == 1
+
+    report = MessageService.storage_report()
+    assert report['encoded_messages'] == 3 and report['blobs'] == 1
+    assert report['blob_bytes'] < len(reply)
+
+    response = client.get(f'/api/conversations/{session_id}?user_id={user_id}')
+    messages = json.loads(response.data)['data']['messages']
+    assert [m['content'] for m in messages] == ["respuesta sin codificar", reply, reply, reply]
+
+    response = client.get(f'/api/users/{user_id}/search?q=coherente', headers=headers)
+    assert len(json.loads(response.data)['data']['results']) == 3
+
+def test_event_log_consumer(client, tmp_path):
+    """Prueba el registro de eventos: un evento por cambio, checkpoint por consumidor y repetición"""
+    from services.agnostic.entity.message_service import MessageService
+    from services.agnostic.task.event_consumer import EventConsumer
+    from services.agnostic.utility.event_log import event_log
+
+    previous = event_log.directory, event_log.max_segment_bytes, event_log.enabled, event_log.fsync
+    event_log.configure(str(tmp_path), 512, True, False)
+    try:
+        client.post('/api/users/register', json={
+            'username': 'eventuser',
+            'password': 'testpass123',
+            'email': 'event@example.com'
+        })
+        login_response = client.post('/api/users/login', json={
+            'username': 'eventuser',
+            'password': 'testpass123'
+        })
+        user_id = json.loads(login_response.data)['data']['id']
+        conv_response = client.post('/api/conversations', json={'user_id': user_id, 'title': 'Eventos'})
+        session_id = json.loads(conv_response.data)['data']['id']
+        for i in range(5):
+            MessageService.save_message(session_id, user_id, f"evento {i}", is_bot=i % 2 == 1)
+
+        seen = []
+        consumer = EventConsumer('test', lambda events: seen.extend(entry.event for entry in events), batch_size=2)
+        assert consumer.run_until_idle() == 6
+        assert [event['type'] for event in seen] == ['session.created'] + ['message.created'] * 5
+        assert [event['seq'] for event in seen[1:]] == [1, 2, 3, 4, 5]
+        assert event_log.stats()['segments'] > 1
+        assert consumer.stats()['lag_bytes'] == 0
+
+        # El checkpoint se conserva; un manejador que falla no lo avanza
+        MessageService.save_message(session_id, user_id, "otro evento")
+        failing = EventConsumer('test', lambda events: 1 / 0)
+        assert failing.run_once() == 0
+        assert consumer.run_until_idle() == 1 and seen[-1]['content'] == "otro evento"
+
+        consumer.replay(0)
+        assert consumer.run_until_idle() == 7
+    finally:
+        event_log.configure(*previous)
+
+def test_event_log_torn_write(tmp_path, monkeypatch):
+    """Prueba que un write parcial que falla no deja un registro incompleto en el segmento"""
+    from services.agnostic.utility.event_log import event_log
+
+    real_write = os.write
+    failures = []
+    def torn_write(fd, data):
+        # Solo el primer write de cada fallo escribe unos bytes y falla
+        if failures and failures[-1] is None:
+            failures[-1] = fd
+            real_write(fd, bytes(data[:5]))
+            raise OSError(28, "No queda espacio en el dispositivo")
+        return real_write(fd, data)
+
+    previous = event_log.directory, event_log.max_segment_bytes, event_log.enabled, event_log.fsync
+    event_log.configure(str(tmp_path), 1024 * 1024, True, False)
+    try:
+        failed = event_log.stats()['failed']
+        first = event_log.append([{'type': 'test', 'n': 1}])
+        monkeypatch.setattr(os, 'write', torn_write)
+        failures.append(None)
+        assert event_log.append([{'type': 'test', 'n': 2}]) is None
+        # Truncado: el evento siguiente ocupa el lugar del fallido (registros del mismo tamaño)
+        second = event_log.append([{'type': 'test', 'n': 3}])
+        assert second - first == event_log.end_offset() - second
+
+        # Si tampoco se puede truncar, se sigue en un segmento nuevo
+        monkeypatch.setattr(os, 'ftruncate', lambda fd, size: (_ for _ in ()).throw(OSError(5, "Error de E/S")))
+        failures.append(None)
+        assert event_log.append([{'type': 'test', 'n': 4}]) is None
+        monkeypatch.undo()
+        event_log.append([{'type': 'test', 'n': 5}])
+
+        events, _ = event_log.read(0)
+        assert [entry.event['n'] for entry in events] == [1, 3, 5]
+        stats = event_log.stats()
+        assert stats['segments'] == 2 and stats['failed'] == failed + 2
+    finally:
+        monkeypatch.undo()
+        event_log.configure(*previous)
+
+def test_search_messages(client):
+    """Prueba la búsqueda de texto completo con filtro por sesión y paginación"""
+    from services.agnostic.entity.message_service import MessageService
+
+    client.post('/api/users/register', json={
+        'username': 'searchuser',
+        'password': 'testpass123',
+        'email': 'search@example.com'
+    })
+    login_response = client.post('/api/users/login', json={
+        'username': 'searchuser',
+        'password': 'testpass123'
+    })
+    user_data = json.loads(login_response.data)['data']
+    user_id = user_data['id']
+    headers = {'Authorization': f"Bearer {user_data['token']}"}
+    first = json.loads(client.post('/api/conversations', json={'user_id': user_id, 'title': 'Música'}).data)['data']['id']
+    second = json.loads(client.post('/api/conversations', json={'user_id': user_id, 'title': 'Cocina'}).data)['data']['id']
+    MessageService.save_message(first, user_id, "Recomiéndame una canción de rock")
+    MessageService.save_message(first, user_id, "Otra cancion para <b>bailar</b>")
+    MessageService.save_message(second, user_id, "La receta de la paella")
+
+    # Sin token se rechaza aunque SESSION_TOKEN_REQUIRED esté desactivado
+    assert client.get(f'/api/users/{user_id}/search?q=cancion').status_code == 401
+
+    # Sin tildes encuentra ambas formas; el fragmento se escapa y marca el término
+    response = client.get(f'/api/users/{user_id}/search?q=cancion', headers=headers)
+    assert response.status_code == 200
+    data = json.loads(response.data)['data']
+    assert len(data['results']) == 2
+    assert all(r['session_id'] == first for r in data['results'])
+    assert any('&lt;b&gt;' in r['snippet'] and '<mark>' in r['snippet'] for r in data['results'])
+
+    # Paginación y filtro por sesión
+    response = client.get(f'/api/users/{user_id}/search?q=canc&session_id={first}&limit=1', headers=headers)
+    page = json.loads(response.data)['data']['page']
+    assert page['has_more'] == True and page['next_offset'] == 1
+    response = client.get(f'/api/users/{user_id}/search?q=paella&session_id={first}', headers=headers)
+    assert json.loads(response.data)['data']['results'] == []
+
+    # Consulta sin palabras
+    response = client.get(f'/api/users/{user_id}/search?q=%22*', headers=headers)
+    assert response.status_code == 400
+
+def test_migrations_from_version_3(client):
+    """Prueba las migraciones sobre una base sin índice de búsqueda ni message_blobs (versión 3)"""
+    from sqlalchemy import inspect, text
+    from models.message_search import drop_search_index
+    from models.migrations import add_message_search, run_migrations
+    from services.agnostic.entity.message_service import MessageService
+
+    client.post('/api/users/register', json={
+        'username': 'migrationuser',
+        'password': 'testpass123',
+        'email': 'migration@example.com'
+    })
+    login_response = client.post('/api/users/login', json={
+        'username': 'migrationuser',
+        'password': 'testpass123'
+    })
+    user_data = json.loads(login_response.data)['data']
+    user_id = user_data['id']
+    headers = {'Authorization': f"Bearer {user_data['token']}"}
+    session_id = json.loads(client.post('/api/conversations', json={'user_id': user_id, 'title': 'Vieja'}).data)['data']['id']
+    MessageService.save_message(session_id, user_id, "Una canción anterior")
+
+    # Esquema de la versión 3: chat_messages sin content_hash, sin message_blobs ni índice FTS
+    with db.engine.begin() as connection:
+        drop_search_index(connection)
+        columns = ', '.join(
+            column['name'] for column in inspect(connection).get_columns('chat_messages')
+            if column['name'] != 'content_hash'
+        )
+        connection.execute(text(f"CREATE TABLE chat_messages_v3 AS SELECT {columns} FROM chat_messages"))
+        connection.execute(text("DROP TABLE chat_messages"))
+        connection.execute(text("ALTER TABLE chat_messages_v3 RENAME TO chat_messages"))
+        connection.execute(text("DROP TABLE message_blobs"))
+        connection.execute(text("DROP TABLE IF EXISTS schema_version"))
+        connection.execute(text(
+            "CREATE TABLE schema_version ("
+            "version INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, applied_at DATETIME NOT NULL)"
+        ))
+        for version in (1, 2, 3, 4):
+            connection.execute(text(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (:version, 'v', CURRENT_TIMESTAMP)"
+            ), {'version': version})
+
+        # La migración 4 crea el índice sobre chat_messages.content sin tocar el esquema de la 6
+        add_message_search(connection)
+        assert 'content_hash' not in {column['name'] for column in inspect(connection).get_columns('chat_messages')}
+
+    assert run_migrations() == [5, 6, 7, 8]
+    MessageService.save_message(session_id, user_id, "Otra cancion nueva")
+    response = client.get(f'/api/users/{user_id}/search?q=cancion', headers=headers)
+    assert len(json.loads(response.data)['data']['results']) == 2
+
+def test_archived_conversation_rehydrates(client, tmp_path):
+    """Prueba que una conversación archivada se restaura completa al abrirla"""
+    from datetime import datetime, timedelta
+    from models import Session, ChatMessage
+    from services.agnostic.entity.message_service import MessageService
+    from services.agnostic.task.session_archiver import SessionArchiver
+    from services.agnostic.utility.segment_store import archive_store
+
+    archive_store.directory = str(tmp_path)
+    client.post('/api/users/register', json={
+        'username': 'archiveuser',
+        'password': 'testpass123',
+        'email': 'archive@example.com'
+    })
+    login_response = client.post('/api/users/login', json={
+        'username': 'archiveuser',
+        'password': 'testpass123'
+    })
+    user_id = json.loads(login_response.data)['data']['id']
+    conv_response = client.post('/api/conversations', json={'user_id': user_id, 'title': 'Antigua'})
+    session_id = json.loads(conv_response.data)['data']['id']
+    for i in range(4):
+        MessageService.save_message(session_id, user_id, f"mensaje antiguo {i}", is_bot=i % 2 == 1)
+    Session.query.get(session_id).last_activity = datetime.utcnow() - timedelta(days=365)
+    db.session.commit()
+
+    etag = client.get(f'/api/users/{user_id}/conversations').headers['ETag']
+    report = SessionArchiver(inactive_days=90).run()
+    assert report['sessions'] == 1 and report['messages'] == 4
+    assert ChatMessage.query.filter_by(session_id=session_id).count() == 0
+
+    # El listado completo la marca como archivada en lugar de mostrarla vacía (con otro ETag)
+    response = client.get(f'/api/users/{user_id}/conversations', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    listing = json.loads(response.data)['data']
+    entry = next(conv for conv in listing if conv['id'] == session_id)
+    assert entry['archived'] == True and entry['message_count'] == 4 and entry['messages'] == []
+
+    # Otro usuario no la restaura
+    client.post('/api/users/register', json={
+        'username': 'otheruser',
+        'password': 'testpass123',
+        'email': 'other@example.com'
+    })
+    other_id = json.loads(client.post('/api/users/login', json={
+        'username': 'otheruser',
+        'password': 'testpass123'
+    }).data)['data']['id']
+    response = client.get(f'/api/conversations/{session_id}?user_id={other_id}')
+    assert response.status_code != 200
+    assert ChatMessage.query.filter_by(session_id=session_id).count() == 0
+
+    response = client.get(f'/api/conversations/{session_id}?user_id={user_id}')
+    assert response.status_code == 200
+    messages = json.loads(response.data)['data']['messages']
+    assert [m['seq'] for m in messages] == [1, 2, 3, 4]
+    response = client.get(f'/api/users/{user_id}/conversations', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert messages[0]['content'] == "mensaje antiguo 0"
+
+    # Enviar un mensaje también la restaura antes de guardarlo
+    Session.query.get(session_id).last_activity = datetime.utcnow() - timedelta(days=365)
+    db.session.commit()
+    assert SessionArchiver(inactive_days=90).run()['sessions'] == 1
+    client.post('/api/messages', json={'session_id': session_id, 'user_id': user_id, 'content': 'Hola de nuevo'})
+    seqs = [m.seq for m in ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.seq).all()]
+    assert seqs[:5] == [1, 2, 3, 4, 5]
+
+def test_archive_compaction(client, tmp_path):
+    """Prueba que compactar el archivo borra los registros sin referencia y conserva los vivos"""
+    from services.agnostic.entity.archive_service import ArchiveService
+    from services.agnostic.entity.message_service import MessageService
+    from services.agnostic.utility.segment_store import archive_store
+
+    previous = archive_store.directory, archive_store.max_segment_bytes
+    # Un registro por segmento
+    archive_store.directory, archive_store.max_segment_bytes = str(tmp_path), 1
+    try:
+        client.post('/api/users/register', json={
+            'username': 'compactuser',
+            'password': 'testpass123',
+            'email': 'compact@example.com'
+        })
+        user_id = json.loads(client.post('/api/users/login', json={
+            'username': 'compactuser',
+            'password': 'testpass123'
+        }).data)['data']['id']
+        sessions = [
+            json.loads(client.post('/api/conversations', json={'user_id': user_id, 'title': f'Archivo {i}'}).data)['data']['id']
+            for i in range(2)
+        ]
+        for session_id in sessions:
+            for i in range(3):
+                MessageService.save_message(session_id, user_id, f"mensaje {session_id}.{i}")
+            ArchiveService.archive_session(session_id)
+        assert ArchiveService.stats()['dead_bytes'] == 0
+
+        # Restaurar la primera y volver a archivar la segunda deja dos registros muertos
+        assert ArchiveService.rehydrate(sessions[0]) == 3
+        MessageService.save_message(sessions[1], user_id, "mensaje nuevo")
+        ArchiveService.archive_session(sessions[1])
+        stats = ArchiveService.stats()
+        assert stats['dead_bytes'] > 0 and stats['segments']['segments'] == 3
+
+        # El segmento recién escrito no se toca hasta que pasa min_age_seconds
+        assert ArchiveService.compact(min_age_seconds=3600)['segments_compacted'] == 0
+        report = ArchiveService.compact(min_age_seconds=0)
+        assert report['segments_removed'] == 2 and report['records_moved'] == 0
+        assert report['reclaimed_bytes'] == stats['dead_bytes']
+        stats = ArchiveService.stats()
+        assert stats['dead_bytes'] == 0 and stats['segments']['bytes'] == stats['live_bytes']
+        contents = [message[3] for message in ArchiveService.get_archived_messages(sessions[1])]
+        assert contents == [f"mensaje {sessions[1]}.{i}" for i in range(3)] + ["mensaje nuevo"]
+
+        # Un segmento con registros vivos y muertos se copia al segmento actual
+        archive_store.max_segment_bytes = 64 * 1024 * 1024
+        ArchiveService.archive_session(sessions[0])
+        assert ArchiveService.rehydrate(sessions[0]) == 3
+        report = ArchiveService.compact(min_age_seconds=0)
+        assert report['records_moved'] == 1 and report['reclaimed_bytes'] > 0
+        assert ArchiveService.stats()['dead_bytes'] == 0
+        assert len(ArchiveService.get_archived_messages(sessions[1])) == 4
+    finally:
+        archive_store.directory, archive_store.max_segment_bytes = previous
+
+def test_export_conversations(client, tmp_path):
+    """Prueba la exportación NDJSON en streaming y la reanudación por sesión y seq"""
+    from services.agnostic.entity.message_service import MessageService
+    from services.agnostic.task.conversation_exporter import ConversationExporter
+
+    client.post('/api/users/register', json={
+        'username': 'exportuser',
+        'password': 'testpass123',
+        'email': 'export@example.com'
+    })
+    login_response = client.post('/api/users/login', json={
+        'username': 'exportuser',
+        'password': 'testpass123'
+    })
+    user_data = json.loads(login_response.data)['data']
+    user_id = user_data['id']
+    headers = {'Authorization': f"Bearer {user_data['token']}"}
+    conv_response = client.post('/api/conversations', json={'user_id': user_id, 'title': 'Exportada'})
+    session_id = json.loads(conv_response.data)['data']['id']
+    for i in range(3):
+        MessageService.save_message(session_id, user_id, f"mensaje {i}")
+
+    # Sin token se rechaza aunque SESSION_TOKEN_REQUIRED esté desactivado
+    response = client.get(f'/api/users/{user_id}/export?format=ndjson')
+    assert response.status_code == 401
+
+    response = client.get(f'/api/users/{user_id}/export?format=ndjson', headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+    assert [row['content'] for row in rows] == ["mensaje 0", "mensaje 1", "mensaje 2"]
+    assert rows[0]['username'] == 'exportuser' and rows[0]['session_title'] == 'Exportada'
+
+    # Reanudar después del primer mensaje
+    response = client.get(
+        f"/api/users/{user_id}/export?after_session={session_id}&after_seq={rows[0]['seq']}", headers=headers
+    )
+    assert [json.loads(line)['seq'] for line in response.data.decode('utf-8').splitlines()] == [2, 3]
+
+    # Sobre una exportación terminada se agregan los mensajes nuevos de sesiones anteriores, sin duplicados
+    second_id = json.loads(client.post(
+        '/api/conversations', json={'user_id': user_id, 'title': 'Segunda'}
+    ).data)['data']['id']
+    MessageService.save_message(second_id, user_id, "segunda 0")
+    output = str(tmp_path / 'export.ndjson')
+    exporter = ConversationExporter(user_id=user_id, batch_size=2)
+    assert exporter.export_to_path('ndjson', output, checkpoint_rows=2)['rows'] == 4
+    MessageService.save_message(session_id, user_id, "mensaje 3")
+    result = exporter.export_to_path('ndjson', output, resume=True)
+    assert result['resumed'] and result['written'] == 1 and result['rows'] == 5
+    with open(output, encoding='utf-8') as f:
+        exported = [(row['session_id'], row['seq']) for row in map(json.loads, f)]
+    assert sorted(exported) == [(session_id, 1), (session_id, 2), (session_id, 3), (session_id, 4), (second_id, 1)]
+
+    # Con el checkpoint pero sin el archivo de salida se exporta de nuevo
+    os.remove(output)
+    result = exporter.export_to_path('ndjson', output, resume=True)
+    assert not result['resumed'] and result['rows'] == 5
+
+    response = client.get(f'/api/users/{user_id}/export?format=xml', headers=headers)
+    assert response.status_code == 400
+
+def test_corpus_builder_crash_safety(client, tmp_path, monkeypatch):
+    """Prueba que una caída antes de escribir el manifiesto no pierde los pares en la ejecución siguiente"""
+    from services.agnostic.entity.message_service import MessageService
+    from services.agnostic.task.corpus_builder import CorpusBuilder
+
+    client.post('/api/users/register', json={
+        'username': 'corpususer',
+        'password': 'testpass123',
+        'email': 'corpus@example.com'
+    })
+    login_response = client.post('/api/users/login', json={
+        'username': 'corpususer',
+        'password': 'testpass123'
+    })
+    user_id = json.loads(login_response.data)['data']['id']
+    conv_response = client.post('/api/conversations', json={'user_id': user_id, 'title': 'Corpus'})
+    session_id = json.loads(conv_response.data)['data']['id']
+    MessageService.save_message(session_id, user_id, "hola")
+    MessageService.save_message(session_id, user_id, "buenas", is_bot=True)
+
+    builder = CorpusBuilder(str(tmp_path))
+    assert builder.build()['new_pairs'] == 1
+
+    MessageService.save_message(session_id, user_id, "qué tal")
+    MessageService.save_message(session_id, user_id, "bien", is_bot=True)
+
+    def crash(manifest):
+        raise OSError("caída simulada")
+    with monkeypatch.context() as patch:
+        patch.setattr(CorpusBuilder, '_write_manifest', staticmethod(crash))
+        with pytest.raises(OSError):
+            builder.build()
+
+    result = builder.build()
+    assert result['version'] == 2 and result['new_pairs'] == 1 and result['duplicates'] == 0
+    assert result['total_pairs'] == 2
+
+def test_send_stream_matches_jsonify(client, monkeypatch):
+    """Prueba que send_stream genera los mismos bytes que send_response/jsonify"""
+    from config import Config
+    from datetime import datetime
+    from decimal import Decimal
+    from dtos import ResponseDTO
+    from services.non_agnostic.response_handler import ResponseHandler
+
+    def make_data(lazy):
+        wrap = iter if lazy else list
+        messages = wrap({
+            'id': i, 'content': f"mensaje {i} ñandú \"citado\" </script>",
+            'created_at': datetime(2025, 1, 2, 3, 4, 5, 678000), 'score': 0.1 * i,
+            'tags': wrap(f"t{j}" for j in range(i)), 'extra': None
+        } for i in range(4))
+        return {'zeta': True, 'messages': messages, 'alpha': {'b': Decimal('1.50'), 'a': (1, 2)}, 'empty': wrap(())}
+
+    # Fragmentos pequeños: los cortes caen dentro de claves, cadenas y elementos
+    monkeypatch.setattr(Config, 'STREAM_CHUNK_BYTES', 16)
+    app = client.application
+    for debug in (False, True):
+        app.debug = debug
+        with app.test_request_context('/'):
+            expected = ResponseHandler.send_response(ResponseDTO.success_response("ok", data=make_data(False)))[0]
+            streamed = ResponseHandler.send_stream(ResponseDTO.success_response("ok", data=make_data(True)))
+            assert 'Content-Encoding' not in streamed.headers
+            chunks = list(streamed.response)
+            assert len(chunks) > 1
+            assert b''.join(chunks) == expected.get_data()
+    app.debug = False
+
+def test_query_budget(client):
+    """Fija el número máximo de consultas por endpoint (un N+1 nuevo rompe el test)"""
+    from models import Session
+    from services.agnostic.entity.message_service import MessageService
+    from services.agnostic.utility.query_stats import query_stats
+
+    client.post('/api/users/register', json={
+        'username': 'queryuser',
+        'password': 'testpass123',
+        'email': 'query@example.com'
+    })
+    login = json.loads(client.post('/api/users/login', json={
+        'username': 'queryuser',
+        'password': 'testpass123'
+    }).data)['data']
+    user_id = login['id']
+    headers = {'Authorization': f"Bearer {login['token']}"}
+
+    with query_stats.assert_max_queries(2, 'POST /api/conversations'):
+        response = client.post('/api/conversations', json={'user_id': user_id, 'title': 'Consultas 0'}, headers=headers)
+    session_id = json.loads(response.data)['data']['id']
+    for i in range(3):
+        if i:
+            session_id = json.loads(client.post(
+                '/api/conversations', json={'user_id': user_id, 'title': f'Consultas {i}'}
+            ).data)['data']['id']
+        for j in range(4):
+            MessageService.save_message(session_id, user_id, f"mensaje {i}.{j}", is_bot=j % 2 == 1)
+    db.session.expire_all()
+
+    # Número de consultas independiente del número de sesiones y mensajes
+    budgets = [
+        (f'/api/users/{user_id}/conversations', 3),
+        (f'/api/users/{user_id}/conversations?view=summary', 2),
+        (f'/api/conversations/{session_id}?user_id={user_id}', 4),
+        (f'/api/conversations/{session_id}?user_id={user_id}&limit=2', 4),
+        (f'/api/users/{user_id}/search?q=mensaje', 1),
+        ('/api/users/me', 1)
+    ]
+    for url, limit in budgets:
+        with query_stats.assert_max_queries(limit, f"GET {url}"):
+            assert client.get(url, headers=headers).status_code == 200
+
+    # Recorrer la relación perezosa en un bucle es exactamente lo que se detecta
+    with pytest.raises(AssertionError, match="consultas"):
+        with query_stats.assert_max_queries(2):
+            [len(session.messages) for session in Session.query.filter_by(user_id=user_id).all()]
+
+    stats = json.loads(client.get('/api/metrics').data)['queries']
+    assert 'GET /api/users/<int:user_id>/conversations' in stats['by_name']
+
+def test_id_allocator_blocks_and_seq_order(client):
+    """Prueba los bloques de IDs entre procesos y que el orden de la sesión lo da seq, no el ID"""
+    from datetime import datetime
+    from models import ChatMessage
+    from services.agnostic.entity.message_service import MessageService
+    from services.agnostic.entity.summary_service import SummaryService
+    from services.agnostic.task.conversation_summarizer import ConversationSummarizer
+    from services.agnostic.utility.id_allocator import IdAllocator
+
+    client.post('/api/users/register', json={
+        'username': 'allocuser',
+        'password': 'testpass123',
+        'email': 'alloc@example.com'
+    })
+    login_response = client.post('/api/users/login', json={
+        'username': 'allocuser',
+        'password': 'testpass123'
+    })
+    user_id = json.loads(login_response.data)['data']['id']
+    conv_response = client.post('/api/conversations', json={'user_id': user_id, 'title': 'Orden'})
+    session_id = json.loads(conv_response.data)['data']['id']
+
+    # Dos asignadores con la misma secuencia hacen de dos workers
+    first, second = IdAllocator('test_messages', 'chat_messages', 5), IdAllocator('test_messages', 'chat_messages', 5)
+    low = first.next_id()
+    high = second.next_id()
+    assert high >= low + 5 and low > (db.session.query(db.func.max(ChatMessage.id)).scalar() or 0)
+    assert [first.next_id() for _ in range(4)] == list(range(low + 1, low + 5))
+    # Un bloque heredado por fork() no se reutiliza
+    first._pid = -1
+    assert first.next_id() > high
+
+    # El worker con el bloque más alto escribe primero
+    def message(message_id, content, is_bot=False):
+        return ChatMessage(id=message_id, session_id=session_id, user_id=user_id, content=content,
+                           is_bot=is_bot, created_at=datetime.utcnow())
+    turns = [message(high, "primero"), message(low, "segundo", True)]
+    turns += [message(second.next_id(), f"turno {i}", i % 2 == 1) for i in range(6)]
+    for turn in turns:
+        assert MessageService.save_messages_batch([turn])
+    assert [m.seq for m in turns] == list(range(1, 9))
+
+    expected = [turn.content for turn in turns]
+    assert [m.content for m in MessageService.get_messages(session_id)] == expected
+    assert [m.content for m in MessageService.get_message_records(session_id)] == expected
+    recent = MessageService.get_recent_messages(session_id, 3, before_seq=turns[-1].seq)
+    assert [m.content for m in recent] == expected[4:7]
+    assert [m.content for m in MessageService.get_recent_messages(session_id, 2, exclude_id=turns[-1].id)] == expected[5:7]
+
+    # El resumen cubre los mensajes fuera de la ventana por seq, incluido el de ID menor
+    summarizer = ConversationSummarizer(context_factory=None, recent_window=4)
+    assert summarizer.summarize_session(session_id)
+    record = SummaryService.get_summary(session_id)
+    assert record.covered_seq == 4 and record.covered_count == 4
+    assert not summarizer.is_stale(record, 4) and summarizer.is_stale(record, 5)
+
+def test_message_persister(client):
+    """Prueba los modos del persistidor: seq en orden de escritura y flush en modo async"""
+    from services.agnostic.entity.message_service import MessageService
+    from services.agnostic.task.message_persister import MessagePersister
+
+    client.post('/api/users/register', json={
+        'username': 'persistuser',
+        'password': 'testpass123',
+        'email': 'persist@example.com'
+    })
+    login_response = client.post('/api/users/login', json={
+        'username': 'persistuser',
+        'password': 'testpass123'
+    })
+    user_id = json.loads(login_response.data)['data']['id']
+    conv_response = client.post('/api/conversations', json={'user_id': user_id, 'title': 'Persistida'})
+    session_id = json.loads(conv_response.data)['data']['id']
+
+    with pytest.raises(ValueError):
+        MessagePersister(client.application.app_context, mode='lazy')
+
+    sync = MessagePersister(client.application.app_context, mode='sync')
+    assert sync.save(session_id, user_id, "sync").seq == 1
+
+    batched = MessagePersister(client.application.app_context, mode='batched', interval_ms=5)
+    saved = [batched.save(session_id, user_id, f"batched {i}", is_bot=i % 2 == 1) for i in range(2)]
+    assert [m.seq for m in saved] == [2, 3]
+    batched.stop()
+
+    persister = MessagePersister(client.application.app_context, mode='async', interval_ms=50)
+    queued = [persister.save(session_id, user_id, f"async {i}") for i in range(5)]
+    assert all(m.id for m in queued)
+    assert persister.flush(timeout=5)
+    stats = persister.stats()
+    assert stats['messages'] == 5 and stats['failed'] == 0 and stats['queued'] == 0
+    persister.stop()
+
+    # Con el servidor de eventlet la espera del commit cede el hub a los demás greenlets
+    import eventlet
+    green = MessagePersister(client.application.app_context, mode='batched', interval_ms=50)
+    green.green = True
+    ticks = []
+    ticker = eventlet.spawn(lambda: [ticks.append(eventlet.sleep(0.005)) for _ in range(3)])
+    assert green.save(session_id, user_id, "green").seq == 9
+    assert len(ticks) == 3
+    ticker.wait()
+    green.stop()
+
+    db.session.expire_all()
+    records = MessageService.get_message_records(session_id)
+    assert [m.seq for m in records] == list(range(1, 10))
+    assert [m.content for m in records] == ["sync", "batched 0", "batched 1"] + [f"async {i}" for i in range(5)] + ["green"]
+
+def test_password_hasher_backpressure(client):
+    """Prueba el rechazo con el pool de hashing lleno (503) y con demasiados intentos simultáneos (429)"""
+    from services.agnostic.utility.login_limiter import login_limiter
+    from utils.password_hasher import password_hasher
+
+    client.post('/api/users/register', json={
+        'username': 'busyuser',
+        'password': 'testpass123',
+        'email': 'busy@example.com'
+    })
+    # La app corre con el servidor de eventlet: el hashing pasa por tpool
+    assert password_hasher.green and password_hasher.stats()['hash'] >= 1
+
+    previous = password_hasher.method, password_hasher.salt_length, password_hasher.workers, password_hasher.max_queue
+    password_hasher.configure(password_hasher.method, password_hasher.salt_length, 1, 0)
+    password_hasher._slots.acquire()
+    try:
+        response = client.post('/api/users/login', json={'username': 'busyuser', 'password': 'testpass123'})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        response = client.post('/api/users/register', json={
+            'username': 'busyuser2',
+            'password': 'testpass123',
+            'email': 'busy2@example.com'
+        })
+        assert response.status_code == 503
+    finally:
+        password_hasher._slots.release()
+        password_hasher.configure(*previous)
+
+    # Los intentos en curso del mismo usuario ocupan su cupo
+    for _ in range(login_limiter.max_per_username):
+        assert login_limiter.try_acquire('10.0.0.1', 'BusyUser')
+    try:
+        response = client.post('/api/users/login', json={'username': 'busyuser', 'password': 'testpass123'})
+        assert response.status_code == 429
+    finally:
+        for _ in range(login_limiter.max_per_username):
+            login_limiter.release('10.0.0.1', 'BusyUser')
+    assert client.post('/api/users/login', json={'username': 'busyuser', 'password': 'testpass123'}).status_code == 200
+
+def test_tenant_from_authenticated_user(client, monkeypatch):
+    """Prueba que el adaptador LoRA sale del tenant del usuario autenticado, no de la petición"""
+    from services.ai_service import AIService
+    from services.agnostic.entity.user_service import UserService
+
+    adapters = []
+    def fake_query(self, input_text, *args, adapter_id=None, **kwargs):
+        adapters.append(adapter_id)
+        return "respuesta"
+    monkeypatch.setattr(AIService, 'is_ready', lambda self: True)
+    monkeypatch.setattr(AIService, 'query_ai_model', fake_query)
+
+    client.post('/api/users/register', json={
+        'username': 'tenantuser',
+        'password': 'testpass123',
+        'email': 'tenant@example.com'
+    })
+    login = json.loads(client.post('/api/users/login', json={
+        'username': 'tenantuser',
+        'password': 'testpass123'
+    }).data)['data']
+    assert UserService.set_tenant(login['id'], 'acme')
+    headers = {'Authorization': f"Bearer {login['token']}"}
+    session_id = json.loads(client.post(
+        '/api/conversations', json={'title': 'Tenant'}, headers=headers
+    ).data)['data']['id']
+
+    message = {'session_id': session_id, 'content': 'Hola', 'tenant_id': 'otro'}
+    assert client.post('/api/messages', json=message, headers=headers).status_code == 200
+    # Sin token no hay usuario autenticado: modelo base
+    assert client.post('/api/messages', json=dict(message, user_id=login['id'])).status_code == 200
+    assert adapters == ['acme', None]
+
+def test_retrieval_context(client, monkeypatch):
+    """Prueba el contexto con fragmentos de otras sesiones y la recarga del índice al caducar"""
+    from types import SimpleNamespace
+    from config import Config
+    from services.ai_service import AIService
+    from services.agnostic.entity.message_service import MessageService
+    from services.agnostic.utility import retrieval_index as retrieval_module
+    from services.agnostic.utility.retrieval_index import retrieval_index
+
+    contexts = []
+    def fake_query(self, input_text, *args, context=None, **kwargs):
+        contexts.append(context)
+        return "respuesta"
+    monkeypatch.setattr(AIService, 'is_ready', lambda self: True)
+    monkeypatch.setattr(AIService, 'query_ai_model', fake_query)
+    monkeypatch.setattr(Config, 'RETRIEVAL_TOP_K', 2)
+    monkeypatch.setattr(Config, 'AI_CONTEXT_RECENT_TURNS', 2)
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(retrieval_module, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    monkeypatch.setattr(retrieval_index, 'ttl_seconds', 60)
+    retrieval_index.clear()
+
+    client.post('/api/users/register', json={
+        'username': 'retrievaluser',
+        'password': 'testpass123',
+        'email': 'retrieval@example.com'
+    })
+    user_id = json.loads(client.post('/api/users/login', json={
+        'username': 'retrievaluser',
+        'password': 'testpass123'
+    }).data)['data']['id']
+    previous = json.loads(client.post('/api/conversations', json={'user_id': user_id, 'title': 'Cocina'}).data)['data']['id']
+    current = json.loads(client.post('/api/conversations', json={'user_id': user_id, 'title': 'Hoy'}).data)['data']['id']
+    MessageService.save_message(previous, user_id, "Mi receta de paella lleva azafrán")
+    MessageService.save_message(previous, user_id, "Me gusta el rock de los setenta")
+    for i in range(3):
+        MessageService.save_message(current, user_id, f"turno {i}", is_bot=i % 2 == 1)
+
+    # Fragmento de la otra sesión primero, después solo los turnos de la ventana reciente
+    message = {'user_id': user_id, 'session_id': current, 'content': '¿Qué lleva la paella?'}
+    assert client.post('/api/messages', json=message).status_code == 200
+    assert contexts[-1] == ["Mi receta de paella lleva azafrán", "turno 1", "turno 2"]
+
+    # Un mensaje escrito por otro worker no llega al índice residente hasta que caduca
+    monkeypatch.setattr(retrieval_index, 'add', lambda *args: False)
+    MessageService.save_message(previous, user_id, "La paella de marisco también")
+    assert [m.content for m in MessageService.search_user_history(user_id, 'marisco')] == []
+    clock.now += 61
+    assert [m.content for m in MessageService.search_user_history(user_id, 'marisco')] == ["La paella de marisco también"]
+    retrieval_index.clear()
+
+def test_lora_adapters(tmp_path):
+    """Prueba inject_lora, el cambio de adaptadores y el desalojo del LRU por memoria"""
+    import torch
+    from torch import nn
+    from services.lora_adapters import AdapterManager, LoRALayer, inject_lora, lora_layers, save_adapter
+
+    class Block(nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.c_attn = nn.Linear(4, 4)
+            self.c_proj = nn.Linear(4, 4)
+
+        def forward(self, x):
+            return self.c_proj(self.c_attn(x))
+
+    torch.manual_seed(0)
+    model = nn.Sequential(Block(), Block())
+    x = torch.randn(2, 4)
+    base_output = model(x)
+
+    assert inject_lora(model) == ['0.c_attn', '1.c_attn']
+    assert inject_lora(model) == ['0.c_attn', '1.c_attn']  # idempotente
+    assert isinstance(model[0].c_attn, LoRALayer) and not isinstance(model[0].c_proj, LoRALayer)
+    assert torch.allclose(model(x), base_output)
+
+    # Dos adaptadores entrenados (B distinto de cero para que cambien la salida)
+    for tenant, value in (('acme', 0.5), ('globex', -0.5)):
+        for layer in lora_layers(model).values():
+            layer.attach_trainable(rank=2, alpha=2)
+            nn.init.constant_(layer.lora_B, value)
+        save_adapter(model, str(tmp_path / tenant))
+        for layer in lora_layers(model).values():
+            layer.detach_trainable()
+    assert torch.allclose(model(x), base_output)
+
+    # A (2x4) y B (4x2) en float32 por capa
+    adapter_bytes = len(lora_layers(model)) * (2 * 4 + 4 * 2) * 4
+    manager = AdapterManager(model, str(tmp_path), memory_budget_bytes=adapter_bytes)
+    with torch.no_grad():
+        with manager.activate('acme'):
+            acme_output = model(x)
+        with manager.activate('globex'):
+            globex_output = model(x)
+        with manager.activate(None):
+            assert torch.allclose(model(x), base_output)
+        with manager.activate('acme'):
+            assert torch.allclose(model(x), acme_output)
+    assert not torch.allclose(acme_output, base_output)
+    assert not torch.allclose(acme_output, globex_output)
+    # Al salir del bloque vuelve el modelo base
+    assert torch.allclose(model(x), base_output)
+
+    # El presupuesto alcanza para un solo adaptador: cada cambio desaloja al otro
+    stats = manager.stats()
+    assert stats['resident'] == ['acme']
+    assert stats['evictions'] == 2 and stats['misses'] == 3
+
+    with pytest.raises(ValueError):
+        manager.adapter_path('../acme')
@@ -0,0 +1,188 @@
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordHasherBusy(Exception):
+    """La cola del pool de hashing está llena"""
+
+
+def hash_passwords(passwords: List[str], method: str, salt_length: int) -> List[str]:
+    """Hash de varias contraseñas (función de nivel de módulo para ProcessPoolExecutor)"""
+    return [generate_password_hash(password, method, salt_length) for password in passwords]
+
+
+def is_eventlet_patched() -> bool:
+    """Indica si el proceso corre con hilos verdes de eventlet (monkey patch)"""
+    patcher = sys.modules.get('eventlet.patcher')
+    return bool(patcher and patcher.is_monkey_patched('thread'))
+
+
+class PasswordHasher:
+    """
+    Hash y verificación de contraseñas en un pool acotado
+
+    El hash de werkzeug (scrypt / pbkdf2) es costoso a propósito. Aquí se
+    ejecuta en hilos del sistema fuera del hilo de la petición. Con el
+    servidor de eventlet (`green`, o monkey patch) se usa eventlet.tpool y un
+    semáforo verde: esperar el resultado de un ThreadPoolExecutor bloquearía
+    el hub y con él todos los sockets. Si no, un ThreadPoolExecutor. Como mucho `workers` hashes
+    corren a la vez y `max_queue` esperan; con la cola llena se rechaza con
+    PasswordHasherBusy en lugar de acumular latencia.
+
+    El costo lo fija `method` (formato de werkzeug, p. ej. "scrypt:32768:8:1"
+    o "pbkdf2:sha256:600000"); needs_rehash indica si un hash guardado usa
+    otros parámetros.
+    """
+
+    def __init__(self, method: str = 'scrypt:32768:8:1', salt_length: int = 16, workers: int = 4,
+                 max_queue: int = 64):
+        """
+        Args:
+            method: Algoritmo y parámetros de costo (formato de werkzeug)
+            salt_length: Longitud de la sal
+            workers: Hashes simultáneos como máximo
+            max_queue: Hashes en espera como máximo
+        """
+        self.green = False
+        self.configure(method, salt_length, workers, max_queue)
+        self._latency = {'hash': deque(maxlen=1000), 'verify': deque(maxlen=1000), 'wait': deque(maxlen=1000)}
+        self._counters = {'hash': 0, 'verify': 0, 'rehash': 0, 'rejected': 0}
+        self._stats_lock = threading.Lock()
+
+    def configure(self, method: str, salt_length: int, workers: int, max_queue: int):
+        """Cambia los parámetros (antes de atender peticiones)"""
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._gate = None
+        self._executor_lock = threading.Lock()
+        self._method_prefix: Optional[str] = None
+        self._dummy_hash: Optional[str] = None
+
+    def hash(self, password: str) -> str:
+        """
+        Genera el hash de una contraseña con los parámetros actuales
+
+        Raises:
+            PasswordHasherBusy: Si la cola está llena
+        """
+        return self._run('hash', generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, password_hash: Optional[str], password: str) -> bool:
+        """
+        Verifica una contraseña contra un hash guardado
+
+        Sin hash (usuario inexistente) se verifica contra un hash de prueba, para
+        que la respuesta tarde lo mismo y no revele qué usuarios existen.
+
+        Raises:
+            PasswordHasherBusy: Si la cola está llena
+        """
+        if password_hash is None:
+            self._run('verify', check_password_hash, self._get_dummy_hash(), password)
+            return False
+        return self._run('verify', check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """Indica si el hash se generó con otro algoritmo o parámetros de costo"""
+        return password_hash.split('$', 1)[0] != self._get_method_prefix()
+
+    def count_rehash(self):
+        """Registra un hash actualizado al iniciar sesión"""
+        with self._stats_lock:
+            self._counters['rehash'] += 1
+
+    def stats(self) -> Dict:
+        """Parámetros, contadores y latencias (ms) de hash, verificación y espera en cola"""
+        with self._stats_lock:
+            report = {'method': self.method, 'workers': self.workers, 'max_queue': self.max_queue, **self._counters}
+            samples = {name: sorted(values) for name, values in self._latency.items()}
+        for name, values in samples.items():
+            if not values:
+                report[f'{name}_ms'] = {'samples': 0}
+                continue
+            report[f'{name}_ms'] = {
+                'samples': len(values),
+                'p50': round(values[len(values) // 2], 2),
+                'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 2),
+                'p99': round(values[min(len(values) - 1, int(len(values) * 0.99))], 2),
+                'max': round(values[-1], 2)
+            }
+        return report
+
+    def _run(self, operation: str, function: Callable, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self._counters['rejected'] += 1
+            raise PasswordHasherBusy("Demasiadas operaciones de contraseña en curso")
+        queued_at = time.perf_counter()
+        timing = {}
+
+        def task():
+            started = time.perf_counter()
+            timing['wait'] = (started - queued_at) * 1000
+            try:
+                return function(*args)
+            finally:
+                timing[operation] = (time.perf_counter() - started) * 1000
+
+        try:
+            if self._on_eventlet_hub():
+                from eventlet import tpool
+                # tpool no limita la concurrencia por sí mismo: lo hace un semáforo verde
+                with self._green_gate():
+                    result = tpool.execute(task)
+            else:
+                result = self._get_executor().submit(task).result()
+        finally:
+            self._slots.release()
+
+        with self._stats_lock:
+            self._counters[operation] += 1
+            for name, value in timing.items():
+                self._latency[name].append(value)
+        return result
+
+    def _on_eventlet_hub(self) -> bool:
+        # Sin monkey patch el hub de eventlet corre en el hilo principal; los
+        # hilos del sistema (persistidor, CLI) usan el ThreadPoolExecutor
+        if is_eventlet_patched():
+            return True
+        return self.green and threading.current_thread() is threading.main_thread()
+
+    def _green_gate(self):
+        with self._executor_lock:
+            if self._gate is None:
+                from eventlet.semaphore import Semaphore
+                self._gate = Semaphore(self.workers)
+            return self._gate
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hasher')
+            return self._executor
+
+    def _get_method_prefix(self) -> str:
+        # werkzeug completa los parámetros por defecto ("scrypt" -> "scrypt:32768:8:1"):
+        # el prefijo se toma de un hash real
+        if self._method_prefix is None:
+            self._method_prefix = generate_password_hash('', self.method, 1).split('$', 1)[0]
+        return self._method_prefix
+
+    def _get_dummy_hash(self) -> str:
+        if self._dummy_hash is None:
+            self._dummy_hash = generate_password_hash('', self.method, self.salt_length)
+        return self._dummy_hash
+
+
+# Pool de hashing del proceso (parámetros configurados al crear la app)
+password_hasher = PasswordHasher()
@@ -1,12 +1,141 @@
+import os
+import sys
 import torch
 from transformers import (
-    AutoTokenizer, AutoModelForCausalLM, Trainer, TrainingArguments,
-    DataCollatorForLanguageModeling
+    AutoTokenizer, AutoModelForCausalLM, Trainer, TrainingArguments, TrainerCallback
 )
-from datasets import load_dataset
+from datasets import load_dataset, load_from_disk
+import hashlib
+import json
+import time
 import warnings
 warnings.filterwarnings("ignore")
 
+# Reutilizar la implementación LoRA que sirve la aplicación
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chat_app'))
+from services.lora_adapters import inject_lora, lora_layers, save_adapter, DEFAULT_TARGET_MODULES
+
+DEFAULT_CACHE_DIR = "./.cache/packed_datasets"
+
+
+def packed_cache_key(tokenizer, dataset, block_size):
+    """Clave de caché: tokenizer + parámetros de empaquetado + huella del dataset."""
+    fingerprint = getattr(dataset, '_fingerprint', None) or hashlib.sha1(
+        "\x1e".join(dataset['text']).encode('utf-8')
+    ).hexdigest()
+    payload = json.dumps({
+        'tokenizer': tokenizer.name_or_path,
+        'vocab_size': len(tokenizer),
+        'eos_token': tokenizer.eos_token,
+        'block_size': block_size,
+        'dataset': fingerprint,
+        'format': 1
+    }, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def pack_sequences(sequences, block_size):
+    """
+    Concatena secuencias tokenizadas y las corta en bloques de block_size.
+    
+    Cada bloque guarda la longitud de los segmentos que contiene, para que el
+    collator impida que un diálogo atienda a otro. Un diálogo que cruza el límite
+    del bloque continúa como segmento nuevo en el bloque siguiente.
+    """
+    blocks, segments = [], []
+    current, current_segments = [], []
+    for sequence in sequences:
+        position = 0
+        while position < len(sequence):
+            take = min(block_size - len(current), len(sequence) - position)
+            current.extend(sequence[position:position + take])
+            current_segments.append(take)
+            position += take
+            if len(current) == block_size:
+                blocks.append(current)
+                segments.append(current_segments)
+                current, current_segments = [], []
+    if current:
+        blocks.append(current)
+        segments.append(current_segments)
+    return {'input_ids': blocks, 'segment_lengths': segments}
+
+
+class PackedDataCollator:
+    """
+    Arma lotes de bloques empaquetados con límites de atención por diálogo.
+    
+    Genera una máscara 4D causal y diagonal por bloques (cada token solo ve su
+    propio segmento), position_ids que reinician en cada segmento y labels que
+    ignoran el primer token de cada segmento y el relleno.
+    """
+    
+    def __init__(self, pad_token_id):
+        self.pad_token_id = pad_token_id
+        self.tokens_seen = 0
+    
+    def __call__(self, features):
+        length = max(len(f['input_ids']) for f in features)
+        batch_size = len(features)
+        input_ids = torch.full((batch_size, length), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((batch_size, length), -100, dtype=torch.long)
+        position_ids = torch.zeros((batch_size, length), dtype=torch.long)
+        # -1 marca el relleno
+        segment_ids = torch.full((batch_size, length), -1, dtype=torch.long)
+        
+        for row, feature in enumerate(features):
+            ids = torch.as_tensor(feature['input_ids'], dtype=torch.long)
+            input_ids[row, :len(ids)] = ids
+            labels[row, :len(ids)] = ids
+            start = 0
+            for segment, segment_length in enumerate(feature['segment_lengths']):
+                end = start + segment_length
+                position_ids[row, start:end] = torch.arange(segment_length)
+                segment_ids[row, start:end] = segment
+                labels[row, start] = -100  # No predecir un diálogo a partir del anterior
+                start = end
+            self.tokens_seen += len(ids)
+        
+        causal = torch.tril(torch.ones((length, length), dtype=torch.bool))
+        allowed = (segment_ids[:, :, None] == segment_ids[:, None, :]) & causal
+        # El relleno solo se ve a sí mismo (evita filas totalmente enmascaradas)
+        allowed |= torch.eye(length, dtype=torch.bool)
+        attention_mask = torch.zeros((batch_size, 1, length, length), dtype=torch.float32)
+        attention_mask.masked_fill_(~allowed[:, None], torch.finfo(torch.float32).min)
+        
+        return {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'position_ids': position_ids,
+            'labels': labels
+        }
+
+
+class TokensPerSecondCallback(TrainerCallback):
+    """Reporta tokens reales (sin relleno) procesados por segundo durante el entrenamiento."""
+    
+    def __init__(self, collator):
+        self.collator = collator
+        self.start_time = None
+        self.start_tokens = 0
+    
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.start_time = time.perf_counter()
+        self.start_tokens = self.collator.tokens_seen
+    
+    def tokens_per_second(self):
+        elapsed = time.perf_counter() - self.start_time if self.start_time else 0
+        return (self.collator.tokens_seen - self.start_tokens) / elapsed if elapsed > 0 else 0.0
+    
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if logs is not None:
+            logs['tokens_per_second'] = round(self.tokens_per_second(), 1)
+    
+    def on_train_end(self, args, state, control, **kwargs):
+        print(f"Entrenamiento: {self.collator.tokens_seen - self.start_tokens} tokens, "
+              f"{self.tokens_per_second():.1f} tokens/s")
+
+
 class DialoGPTService:
     def __init__(self, model_name="microsoft/DialoGPT-medium"):
         self.model_name = model_name
@@ -60,34 +189,75 @@ class DialoGPTService:
             print(f"Bot: {response}")
     
     def prepare_dataset(self, dataset_name="daily_dialog", split="train", max_samples=1000):
-        """Prepara dataset para fine-tuning (formato: diálogos concatenados)."""
-        dataset = load_dataset(dataset_name, split=split)
+        """
+        Prepara dataset para fine-tuning (formato: diálogos concatenados).
+        
+        dataset_name puede ser un dataset del Hub o el directorio de un corpus
+        generado con `python chat_app/manage.py build-corpus` (se leen sus shards).
+        """
+        manifest_path = os.path.join(dataset_name, "manifest.json")
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                shards = [os.path.join(dataset_name, s['file']) for s in json.load(f)['shards']]
+            print(f"Usando corpus local: {len(shards)} shards")
+            dataset = load_dataset('json', data_files=shards, split='train')
+        else:
+            dataset = load_dataset(dataset_name, split=split)
         # Toma muestras limitadas para demo rápida
         dataset = dataset.select(range(min(max_samples, len(dataset))))
+        eos_token = self.tokenizer.eos_token
         
         def format_dialogue(example):
             dialogue = example['dialog']
             # Concatena turnos con EOS tokens para entrenamiento causal
-            formatted = tokenizer.eos_token.join(dialogue) + tokenizer.eos_token
+            formatted = eos_token.join(dialogue) + eos_token
             return {'text': formatted}
         
-        dataset = dataset.map(format_dialogue)
-        return dataset.map(lambda x: self.tokenizer(x['text'], truncation=True, padding=False), batched=True)
+        # La tokenización se hace (y se cachea) al empaquetar en build_packed_dataset
+        return dataset.map(format_dialogue, remove_columns=dataset.column_names)
     
-    def fine_tune(self, dataset, output_dir="./fine_tuned_dialo_gpt", epochs=3, batch_size=4):
-        """Fine-tuning con Hugging Face Trainer."""
-        print("Iniciando fine-tuning...")
+    def build_packed_dataset(self, dataset, block_size=512, cache_dir=DEFAULT_CACHE_DIR):
+        """
+        Tokeniza y empaqueta diálogos en bloques completos de block_size tokens.
+        
+        Los bloques se guardan en formato Arrow (memory-mapped al cargarlos) bajo una
+        clave derivada del tokenizer, los parámetros y la huella del dataset, así que
+        las ejecuciones siguientes no vuelven a tokenizar.
+        """
+        cache_path = os.path.join(cache_dir, packed_cache_key(self.tokenizer, dataset, block_size))
+        if os.path.isdir(cache_path):
+            print(f"Usando bloques tokenizados en caché: {cache_path}")
+            return load_from_disk(cache_path)
         
-        # Tokenizar dataset
-        tokenized_dataset = dataset.map(
-            lambda examples: self.tokenizer(examples['text'], truncation=True, padding='max_length', max_length=512),
+        print("Tokenizando y empaquetando diálogos...")
+        tokenized = dataset.map(
+            lambda examples: self.tokenizer(examples['text'], truncation=False, padding=False),
             batched=True,
             remove_columns=dataset.column_names
         )
-        tokenized_dataset.set_format(type='torch', columns=['input_ids', 'attention_mask'])
+        packed = tokenized.map(
+            lambda examples: pack_sequences(examples['input_ids'], block_size),
+            batched=True,
+            batch_size=1000,
+            remove_columns=tokenized.column_names
+        )
+        packed.save_to_disk(cache_path)
         
-        # Data collator para language modeling
-        data_collator = DataCollatorForLanguageModeling(tokenizer=self.tokenizer, mlm=False)
+        total_tokens = sum(sum(lengths) for lengths in packed['segment_lengths'])
+        fill = total_tokens / max(1, len(packed) * block_size)
+        print(f"{len(packed)} bloques de {block_size} tokens ({fill:.1%} ocupados), guardados en {cache_path}")
+        return load_from_disk(cache_path)
+    
+    def _train(self, dataset, output_dir, epochs, batch_size, block_size, gradient_accumulation_steps,
+               gradient_checkpointing, cache_dir, save_steps=500):
+        """Entrena sobre bloques empaquetados y reporta tokens/segundo."""
+        packed_dataset = self.build_packed_dataset(dataset, block_size=block_size, cache_dir=cache_dir)
+        data_collator = PackedDataCollator(pad_token_id=self.tokenizer.pad_token_id)
+        throughput = TokensPerSecondCallback(data_collator)
+        
+        if gradient_checkpointing:
+            # La caché KV no se usa al entrenar y es incompatible con el checkpointing
+            self.model.config.use_cache = False
         
         # Argumentos de entrenamiento
         training_args = TrainingArguments(
@@ -95,10 +265,15 @@ class DialoGPTService:
             overwrite_output_dir=True,
             num_train_epochs=epochs,
             per_device_train_batch_size=batch_size,
-            save_steps=500,
+            # Lotes efectivos grandes en CPU: acumular gradientes y recomputar activaciones
+            gradient_accumulation_steps=gradient_accumulation_steps,
+            gradient_checkpointing=gradient_checkpointing,
+            save_steps=save_steps,
             save_total_limit=2,
             prediction_loss_only=True,
             dataloader_pin_memory=False,
+            remove_unused_columns=False,  # segment_lengths lo consume el collator
+            logging_steps=10,
             report_to=[]  # Desactiva logging externo
         )
         
@@ -107,14 +282,61 @@ class DialoGPTService:
             model=self.model,
             args=training_args,
             data_collator=data_collator,
-            train_dataset=tokenized_dataset
+            train_dataset=packed_dataset,
+            callbacks=[throughput]
         )
         
         # Entrenar
         trainer.train()
+        self.model.config.use_cache = True
+        return trainer
+    
+    def fine_tune(self, dataset, output_dir="./fine_tuned_dialo_gpt", epochs=3, batch_size=4, block_size=512,
+                  gradient_accumulation_steps=8, gradient_checkpointing=True, cache_dir=DEFAULT_CACHE_DIR):
+        """Fine-tuning con Hugging Face Trainer sobre bloques empaquetados."""
+        print("Iniciando fine-tuning...")
+        trainer = self._train(dataset, output_dir, epochs, batch_size, block_size,
+                              gradient_accumulation_steps, gradient_checkpointing, cache_dir)
         trainer.save_model(output_dir)
         print(f"Modelo fine-tuneado guardado en {output_dir}")
 
+    def fine_tune_adapter(self, dataset, tenant_id, adapters_dir="./chat_app/adapters", rank=8, alpha=16,
+                          target_modules=DEFAULT_TARGET_MODULES, epochs=3, batch_size=4, block_size=512,
+                          gradient_accumulation_steps=8, gradient_checkpointing=True, cache_dir=DEFAULT_CACHE_DIR):
+        """Fine-tuning LoRA: entrena solo matrices de bajo rango y guarda un adaptador por tenant."""
+        print(f"Iniciando fine-tuning LoRA para el tenant '{tenant_id}'...")
+        
+        # Congelar el modelo base y agregar matrices A/B entrenables
+        self.model.requires_grad_(False)
+        inject_lora(self.model, target_modules)
+        layers = lora_layers(self.model)
+        for layer in layers.values():
+            layer.attach_trainable(rank, alpha)
+        trainable = sum(p.numel() for p in self.model.parameters() if p.requires_grad)
+        total = sum(p.numel() for p in self.model.parameters())
+        print(f"Parámetros entrenables: {trainable} de {total} ({100 * trainable / total:.2f}%)")
+        if gradient_checkpointing:
+            # Con el modelo base congelado, las entradas deben pedir gradiente para recomputar
+            self.model.enable_input_require_grads()
+        
+        output_dir = os.path.join(adapters_dir, str(tenant_id))
+        self._train(dataset, os.path.join(output_dir, "checkpoints"), epochs, batch_size, block_size,
+                    gradient_accumulation_steps, gradient_checkpointing, cache_dir, save_steps=10 ** 9)
+        
+        path = save_adapter(self.model, output_dir, metadata={
+            'base_model': self.model_name,
+            'tenant_id': str(tenant_id),
+            'rank': rank,
+            'alpha': alpha,
+            'target_modules': list(target_modules)
+        })
+        
+        # Volver al modelo base para no mezclar el adaptador con otros entrenamientos
+        for layer in layers.values():
+            layer.detach_trainable()
+        print(f"Adaptador guardado en {path} ({os.path.getsize(path) / 1024:.1f} KB)")
+        return path
+
 # Ejemplo de uso
 if __name__ == "__main__":
     service = DialoGPTService()
@@ -126,9 +348,14 @@ if __name__ == "__main__":
     # Opción 2: Fine-tuning (descomenta para ejecutar)
     # print("\n=== MODO ENTRENAMIENTO ===")
     # dataset = service.prepare_dataset("daily_dialog", max_samples=500)
+    # # o con las conversaciones propias: dataset = service.prepare_dataset("chat_app/corpus")
     # service.fine_tune(dataset, epochs=1, batch_size=2)  # Ajusta epochs/batch para tu hardware
     # 
     # # Después de entrenar, usa el modelo fine-tuneado
     # service.model = AutoModelForCausalLM.from_pretrained("./fine_tuned_dialo_gpt")
     # service.load_model()  # Recarga para inferencia
-    # service.interactive_chat(num_turns=5)
\ No newline at end of file
+    # service.interactive_chat(num_turns=5)
+    #
+    # Opción 3: Adaptador LoRA por tenant (la app lo carga sobre el modelo base con "tenant_id")
+    # dataset = service.prepare_dataset("daily_dialog", max_samples=500)
+    # service.fine_tune_adapter(dataset, tenant_id="acme", epochs=1, batch_size=2)
\ No newline at end of file
@@ -0,0 +1,152 @@
+"""
+Benchmark de la lectura del historial: ORM vs registros sin ORM
+
+Crea sesiones con muchos mensajes (por defecto 10k) y mide, para el
+historial completo y para una página, las dos rutas de MessageService:
+objetos ChatMessage (Session.messages / get_messages_page + to_dict) y
+MessageRecord (get_message_records / get_message_records_page + to_dict),
+hasta el JSON de la respuesta. Informa latencia (p50/p95) y memoria
+(pico y bloques asignados, con tracemalloc).
+
+Uso:
+    python tools/bench_history.py --messages 10000 --sessions 3 --repeat 20
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chat_app'))
+
+from flask import Flask
+
+from config import Config
+from models import db, User, Session
+from models.migrations import run_migrations
+from models.storage import apply_storage_profile, engine_options
+from services.agnostic.entity.message_service import MessageService
+
+
+def create_bench_app(path: str) -> Flask:
+    """Aplicación mínima sobre una base nueva con el perfil de almacenamiento"""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.abspath(path)}"
+
+    app = Flask(__name__)
+    app.config.from_object(BenchConfig)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(BenchConfig)
+    db.init_app(app)
+    with app.app_context():
+        apply_storage_profile(db.engine, BenchConfig)
+        db.create_all()
+        run_migrations()
+    return app
+
+
+def seed(app, sessions: int, messages_per_session: int) -> list:
+    """Sesiones con `messages_per_session` mensajes cada una"""
+    with app.app_context():
+        user = User(username="bench", email="bench@bench.local", password="bench")
+        db.session.add(user)
+        db.session.flush()
+        db.session.add_all([Session(user_id=user.id, title=f"Sesión {i}") for i in range(sessions)])
+        db.session.commit()
+        session_ids = [sid for (sid,) in db.session.query(Session.id).all()]
+        for sid in session_ids:
+            for start in range(0, messages_per_session, 1000):
+                MessageService.save_messages_batch([
+                    MessageService.build_message(sid, user.id, f"mensaje de historial número {i} " * 4, i % 2 == 1)
+                    for i in range(start, min(start + 1000, messages_per_session))
+                ])
+        return session_ids
+
+
+def orm_full(session_id: int) -> str:
+    return json.dumps(db.session.get(Session, session_id).to_dict())
+
+
+def records_full(session_id: int) -> str:
+    conversation = db.session.get(Session, session_id)
+    records = MessageService.get_message_records(session_id)
+    return json.dumps(conversation.to_dict(messages=[record.to_dict() for record in records]))
+
+
+def orm_page(session_id: int, limit: int) -> str:
+    messages, _ = MessageService.get_messages_page(session_id, limit)
+    return json.dumps([message.to_dict() for message in messages])
+
+
+def records_page(session_id: int, limit: int) -> str:
+    records, _ = MessageService.get_message_records_page(session_id, limit)
+    return json.dumps([record.to_dict() for record in records])
+
+
+def measure(app, function, session_ids: list, repeat: int) -> dict:
+    """Latencia por llamada y memoria de una llamada, cada una con una sesión limpia"""
+    latencies = []
+    for i in range(repeat):
+        with app.app_context():
+            start = time.perf_counter()
+            function(session_ids[i % len(session_ids)])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    with app.app_context():
+        tracemalloc.start()
+        function(session_ids[0])
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    # Bloques aún vivos al terminar (objetos retenidos por la sesión del ORM)
+    blocks = sum(stat.count for stat in snapshot.statistics('filename'))
+
+    latencies.sort()
+    return {
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+        'peak_kb': round(peak / 1024, 1),
+        'live_blocks': blocks
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del historial: ORM vs registros sin ORM")
+    parser.add_argument('--db', default='/tmp/bench_history.db')
+    parser.add_argument('--messages', type=int, default=10000, help="Mensajes por sesión")
+    parser.add_argument('--sessions', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--page', type=int, default=200, help="Tamaño de la página")
+    args = parser.parse_args(argv)
+
+    app = create_bench_app(args.db)
+    session_ids = seed(app, args.sessions, args.messages)
+
+    with app.app_context():
+        # Ambas rutas deben producir exactamente el mismo JSON
+        assert orm_full(session_ids[0]) == records_full(session_ids[0])
+        assert orm_page(session_ids[0], args.page) == records_page(session_ids[0], args.page)
+
+    cases = {
+        'completo ORM': lambda sid: orm_full(sid),
+        'completo registros': lambda sid: records_full(sid),
+        f'página {args.page} ORM': lambda sid: orm_page(sid, args.page),
+        f'página {args.page} registros': lambda sid: records_page(sid, args.page),
+    }
+    results = {name: measure(app, function, session_ids, args.repeat) for name, function in cases.items()}
+
+    columns = list(next(iter(results.values())).keys())
+    print(f"\n{args.sessions} sesiones x {args.messages} mensajes, {args.repeat} repeticiones")
+    print(f"   {'':<22}" + "".join(f"{column:>14}" for column in columns))
+    for name, row in results.items():
+        print(f"   {name:<22}" + "".join(f"{str(row[column]):>14}" for column in columns))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
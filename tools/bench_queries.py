@@ -0,0 +1,168 @@
+"""
+Benchmark de las consultas frecuentes con y sin los índices de los modelos
+
+Genera una base SQLite sintética (por defecto 1M de mensajes), mide las
+consultas del camino caliente sin índices secundarios y vuelve a medirlas
+después de aplicar la migración de índices.
+
+Uso:
+    python tools/bench_queries.py --messages 1000000 --db /tmp/bench_chat.db
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chat_app'))
+
+from flask import Flask
+from sqlalchemy import text
+
+from models import db, ChatMessage, Session
+from models.migrations import add_query_indexes, run_migrations
+from services.agnostic.entity.conversation_service import ConversationService
+from services.agnostic.entity.message_service import MessageService
+
+
+def populate(path: str, users: int, sessions_per_user: int, messages: int):
+    """Carga datos sintéticos directamente con sqlite3 (mucho más rápido que el ORM)"""
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=OFF")
+    connection.execute("PRAGMA synchronous=OFF")
+    start = datetime(2024, 1, 1)
+
+    connection.executemany(
+        "INSERT INTO users (id, username, email, password_hash, created_at, updated_at, is_active) "
+        "VALUES (?, ?, ?, ?, ?, ?, 1)",
+        ((uid, f"user{uid}", f"user{uid}@bench.local", "x", start, start) for uid in range(1, users + 1))
+    )
+
+    total_sessions = users * sessions_per_user
+    connection.executemany(
+        "INSERT INTO sessions (id, user_id, title, created_at, last_seq, message_count, last_activity) "
+        "VALUES (?, ?, ?, ?, 0, 0, ?)",
+        (
+            (sid, (sid - 1) // sessions_per_user + 1, f"Sesión {sid}", start, start)
+            for sid in range(1, total_sessions + 1)
+        )
+    )
+
+    rng = random.Random(42)
+    seqs = [0] * (total_sessions + 1)
+    last_activity = [start] * (total_sessions + 1)
+
+    def rows():
+        for mid in range(1, messages + 1):
+            sid = rng.randint(1, total_sessions)
+            seqs[sid] += 1
+            last_activity[sid] = start + timedelta(seconds=mid)
+            yield (mid, sid, seqs[sid], (sid - 1) // sessions_per_user + 1,
+                   f"mensaje {mid} de prueba", mid % 2 == 0, last_activity[sid])
+
+    connection.executemany(
+        "INSERT INTO chat_messages (id, session_id, seq, user_id, content, is_bot, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows()
+    )
+    # Columnas desnormalizadas calculadas al generar (sin índices, un UPDATE correlacionado sería cuadrático)
+    connection.executemany(
+        "UPDATE sessions SET last_seq = ?, message_count = ?, last_activity = ? WHERE id = ?",
+        ((seqs[sid], seqs[sid], last_activity[sid], sid) for sid in range(1, total_sessions + 1))
+    )
+    connection.commit()
+    connection.close()
+
+
+def drop_model_indexes():
+    """Elimina los índices secundarios declarados en los modelos"""
+    with db.engine.begin() as connection:
+        for table in (ChatMessage.__table__, Session.__table__):
+            for index in table.indexes:
+                connection.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        connection.execute(text("ANALYZE"))
+
+
+def measure(name: str, func, repeat: int) -> dict:
+    """Ejecuta la consulta `repeat` veces y devuelve la mediana y el p95 en ms"""
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - start) * 1000)
+        db.session.rollback()
+    samples.sort()
+    return {
+        'query': name,
+        'p50_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3)
+    }
+
+
+def run_queries(users: int, total_sessions: int, repeat: int) -> list:
+    """Mide las consultas del camino caliente sobre ids pseudoaleatorios"""
+    rng = random.Random(7)
+    session_ids = [rng.randint(1, total_sessions) for _ in range(repeat)]
+    user_ids = [rng.randint(1, users) for _ in range(repeat)]
+    return [
+        measure("historial completo (session_id ORDER BY created_at)",
+                lambda i: MessageService.get_messages(session_ids[i]), repeat),
+        measure("página de historial (session_id, seq) LIMIT 50",
+                lambda i: MessageService.get_messages_page(session_ids[i], 50), repeat),
+        measure("conversaciones del usuario (user_id ORDER BY last_activity)",
+                lambda i: ConversationService.get_user_conversation_summaries(user_ids[i]), repeat),
+        measure("mensajes del usuario (user_id)",
+                lambda i: db.session.query(ChatMessage.id).filter(ChatMessage.user_id == user_ids[i]).count(), repeat),
+    ]
+
+
+def print_results(title: str, results: list):
+    print(f"\n{title}")
+    print(f"   {'consulta':<62}{'p50 ms':>10}{'p95 ms':>10}")
+    for row in results:
+        print(f"   {row['query']:<62}{row['p50_ms']:>10}{row['p95_ms']:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de consultas con y sin índices")
+    parser.add_argument('--db', default='/tmp/bench_chat.db')
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--sessions-per-user', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.abspath(args.db)}"
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        run_migrations()
+        drop_model_indexes()
+
+        print(f"Generando {args.messages:,} mensajes en {args.users * args.sessions_per_user:,} sesiones...")
+        start = time.perf_counter()
+        populate(args.db, args.users, args.sessions_per_user, args.messages)
+        print(f"   listo en {time.perf_counter() - start:.1f} s")
+
+        total_sessions = args.users * args.sessions_per_user
+        print_results("Sin índices secundarios:", run_queries(args.users, total_sessions, args.repeat))
+
+        start = time.perf_counter()
+        with db.engine.begin() as connection:
+            add_query_indexes(connection)
+        print(f"\nÍndices creados en {time.perf_counter() - start:.1f} s")
+        print_results("Con índices:", run_queries(args.users, total_sessions, args.repeat))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+Benchmark del perfil de almacenamiento de SQLite con concurrencia
+
+Ejecuta la misma carga mixta (escrituras con MessageService.save_message y
+lecturas de páginas de historial) con varios hilos sobre dos bases nuevas:
+una con la configuración por defecto de SQLAlchemy/SQLite (journal de
+rollback, pool por defecto) y otra con el perfil de models/storage.py.
+
+Uso:
+    python tools/bench_storage.py --threads 16 --ops 300 --write-ratio 0.3
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chat_app'))
+
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+
+from config import Config
+from models import db, User, Session
+from models.migrations import run_migrations
+from models.storage import apply_storage_profile, engine_options
+from services.agnostic.entity.message_service import MessageService
+
+
+def create_bench_app(path: str, tuned: bool) -> Flask:
+    """Aplicación mínima sobre una base nueva, con o sin el perfil"""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.abspath(path)}"
+
+    app = Flask(__name__)
+    app.config.from_object(BenchConfig)
+    if tuned:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(BenchConfig)
+    db.init_app(app)
+    with app.app_context():
+        if tuned:
+            apply_storage_profile(db.engine, BenchConfig)
+        db.create_all()
+        run_migrations()
+    return app
+
+
+def seed(app, sessions: int, messages_per_session: int):
+    """Usuarios, sesiones e historial inicial para las lecturas"""
+    with app.app_context():
+        user = User(username="bench", email="bench@bench.local", password="bench")
+        db.session.add(user)
+        db.session.flush()
+        db.session.add_all([Session(user_id=user.id, title=f"Sesión {i}") for i in range(sessions)])
+        db.session.commit()
+        session_ids = [sid for (sid,) in db.session.query(Session.id).all()]
+        for sid in session_ids:
+            MessageService.save_messages_batch([
+                MessageService.build_message(sid, user.id, f"historial {i}", i % 2 == 1)
+                for i in range(messages_per_session)
+            ])
+        return user.id, session_ids
+
+
+def run_load(app, user_id: int, session_ids: list, threads: int, ops: int, write_ratio: float) -> dict:
+    """Cada hilo ejecuta `ops` operaciones con su propio contexto de aplicación"""
+    latencies = {'write': [], 'read': []}
+    errors = {'locked': 0, 'other': 0}
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(seed_value: int):
+        rng = random.Random(seed_value)
+        local = {'write': [], 'read': []}
+        local_errors = {'locked': 0, 'other': 0}
+        barrier.wait()
+        for i in range(ops):
+            kind = 'write' if rng.random() < write_ratio else 'read'
+            sid = rng.choice(session_ids)
+            start = time.perf_counter()
+            try:
+                with app.app_context():
+                    if kind == 'write':
+                        if MessageService.save_message(sid, user_id, f"mensaje {seed_value}-{i}") is None:
+                            local_errors['other'] += 1
+                            continue
+                    else:
+                        MessageService.get_messages_page(sid, 50)
+            except OperationalError as e:
+                local_errors['locked' if 'locked' in str(e) else 'other'] += 1
+                continue
+            local[kind].append((time.perf_counter() - start) * 1000)
+        with lock:
+            for name in local:
+                latencies[name].extend(local[name])
+            for name in local_errors:
+                errors[name] += local_errors[name]
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    def p95(samples):
+        samples = sorted(samples)
+        return round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2) if samples else None
+
+    done = len(latencies['write']) + len(latencies['read'])
+    return {
+        'ops_per_s': round(done / elapsed, 1),
+        'write_p50_ms': round(statistics.median(latencies['write']), 2) if latencies['write'] else None,
+        'write_p95_ms': p95(latencies['write']),
+        'read_p50_ms': round(statistics.median(latencies['read']), 2) if latencies['read'] else None,
+        'read_p95_ms': p95(latencies['read']),
+        'locked_errors': errors['locked'],
+        'other_errors': errors['other']
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del perfil de SQLite con concurrencia")
+    parser.add_argument('--db', default='/tmp/bench_storage.db')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--ops', type=int, default=300, help="Operaciones por hilo")
+    parser.add_argument('--write-ratio', type=float, default=0.3)
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--history', type=int, default=200, help="Mensajes iniciales por sesión")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, tuned in (('por defecto', False), ('perfil', True)):
+        app = create_bench_app(args.db, tuned)
+        user_id, session_ids = seed(app, args.sessions, args.history)
+        results[name] = run_load(app, user_id, session_ids, args.threads, args.ops, args.write_ratio)
+        with app.app_context():
+            db.engine.dispose()
+
+    columns = list(next(iter(results.values())).keys())
+    print(f"\n{args.threads} hilos x {args.ops} operaciones, {int(args.write_ratio * 100)}% escrituras")
+    print(f"   {'':<14}" + "".join(f"{column:>15}" for column in columns))
+    for name, row in results.items():
+        print(f"   {name:<14}" + "".join(f"{str(row[column]):>15}" for column in columns))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())